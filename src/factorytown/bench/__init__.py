@@ -0,0 +1,55 @@
+from .bench import (
+    FIXTURE_PAGES,
+    get_fixture_dir,
+    read_fixture,
+    install_page,
+    install_fixtures,
+    temporary_cache,
+    fixture_cache,
+    extraction_skip_reason,
+    percentile,
+    TimingStats,
+    BenchStage,
+    BenchReport,
+    Regression,
+    compare_to_baseline,
+    time_stage,
+    benchmark_stages,
+    run_benchmarks,
+)
+from .synthetic import (
+    BUILDINGS_PAGE_TABLES,
+    BUILDINGS_PAGE_HEADERS,
+    format_wikitable,
+    generate_buildings_page,
+    SyntheticModelInfo,
+    generate_recipe_model,
+)
+from .scaling import (
+    DEFAULT_SCALING_SIZES,
+    ScalingResult,
+    measure,
+    page_scaling_stages,
+    model_scaling_stages,
+    run_scaling_benchmarks,
+)
+from .replay import (
+    ReplayConfig,
+    ReplayStats,
+    WikiReplayServer,
+    LoadTestResult,
+    fixture_responses,
+    replay_wiki,
+    run_fetch_load_test,
+    run_scrape_test,
+)
+from .startup import (
+    DEFAULT_STARTUP_COMMANDS,
+    HEAVY_MODULES,
+    DEFAULT_STARTUP_BUDGET,
+    ImportTime,
+    StartupResult,
+    parse_importtime,
+    measure_startup,
+    check_startup_budget,
+)
@@ -0,0 +1,317 @@
+from ..internal_types import *
+from ..proj_dir import get_project_dir
+from ..raw_scrape.fandom_scrape import (
+    get_url_filename,
+    get_url_text,
+    get_url_markdown,
+    get_markdown_cache_dir,
+    get_markdown_scrape_script,
+    get_memory_cache,
+    reset_cache_dirs,
+)
+from ..raw_scrape.factorytown_wiki_scrape import get_page_url
+from ..mdparse import parse_markdown, TABLE_PARSER_BACKENDS, get_table_parser_backend
+from ..model import FactoryTownModel, Item
+from ..model_scrape.util import TableReader, StreamingTableReader
+from ..model_scrape.buildings import scrape_buildings, BUILDING_COLUMNS, BUILDING_CONVERTERS
+
+from contextlib import contextmanager
+import json
+import math
+import os
+import subprocess
+import tempfile
+import time
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+FIXTURE_PAGES = ["Buildings"]
+"""Wiki pages with recorded fixtures. Each page has a wikitext fixture, <page>.wiki, and the HTML of its
+   edit page, <page>.edit.html."""
+
+def get_fixture_dir() -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def read_fixture(filename: str) -> str:
+    with open(os.path.join(get_fixture_dir(), filename), 'r') as f:
+        return f.read()
+
+def install_page(cache_dir: str, page: str, markdown: str, html: Optional[str]=None):
+    """Writes a page's wikitext, and optionally its edit page HTML, into a scrape cache directory under the
+       same filenames that get_url_markdown() and get_url_text() use, so the scrapers read them without
+       going to the network."""
+    filename = get_url_filename(get_page_url(page) + "?action=edit")
+    md_dir = os.path.join(cache_dir, "md")
+    os.makedirs(md_dir, exist_ok=True)
+    with open(os.path.join(md_dir, filename), 'w') as f:
+        f.write(markdown)
+    if html is not None:
+        http_dir = os.path.join(cache_dir, "http")
+        os.makedirs(http_dir, exist_ok=True)
+        with open(os.path.join(http_dir, filename), 'w') as f:
+            f.write(html)
+
+def install_fixtures(cache_dir: str):
+    """Writes the recorded page fixtures into a scrape cache directory."""
+    for page in FIXTURE_PAGES:
+        install_page(cache_dir, page, read_fixture(f"{page}.wiki"), read_fixture(f"{page}.edit.html"))
+
+@contextmanager
+def temporary_cache() -> Generator[str, None, None]:
+    """Points the scrape cache at an empty temporary directory for the duration of the context. Yields the
+       cache directory."""
+    previous = os.environ.get('FACTORYTOWN_CACHE_DIR')
+    with tempfile.TemporaryDirectory(prefix="factorytown-bench-") as cache_dir:
+        os.environ['FACTORYTOWN_CACHE_DIR'] = cache_dir
+        reset_cache_dirs()
+        try:
+            yield cache_dir
+        finally:
+            if previous is None:
+                del os.environ['FACTORYTOWN_CACHE_DIR']
+            else:
+                os.environ['FACTORYTOWN_CACHE_DIR'] = previous
+            reset_cache_dirs()
+
+@contextmanager
+def fixture_cache(pages: Optional[Mapping[str, str]]=None) -> Generator[str, None, None]:
+    """Points the scrape cache at a temporary directory holding the recorded fixtures for the duration of
+       the context. pages optionally gives additional or replacement page wikitext, by page name. Yields
+       the cache directory."""
+    with temporary_cache() as cache_dir:
+        install_fixtures(cache_dir)
+        for page, markdown in (pages or {}).items():
+            install_page(cache_dir, page, markdown)
+        yield cache_dir
+
+def percentile(sorted_samples: Sequence[float], fraction: float) -> float:
+    """Returns the nearest-rank percentile of an ascending, non-empty sequence."""
+    rank = max(1, math.ceil(fraction * len(sorted_samples)))
+    return sorted_samples[rank - 1]
+
+class TimingStats(NamedTuple):
+    """Summary statistics of a stage's samples, in seconds."""
+    name: str
+    samples: int
+    min: float
+    p50: float
+    p90: float
+    p99: float
+    max: float
+    mean: float
+
+    @classmethod
+    def from_samples(cls, name: str, samples: Sequence[float]) -> Self:
+        s = sorted(samples)
+        return cls(name, len(s), s[0], percentile(s, 0.5), percentile(s, 0.9), percentile(s, 0.99), s[-1], sum(s) / len(s))
+
+    def to_jsonable(self) -> JsonableDict:
+        return self._asdict()
+
+    @classmethod
+    def from_jsonable(cls, data: JsonableDict) -> Self:
+        return cls(**{field: data[field] for field in cls._fields})
+
+    def __str__(self):
+        ms = lambda x: f"{x * 1000:9.3f}"
+        return f"{self.name:32} n={self.samples:<4} min={ms(self.min)} p50={ms(self.p50)} p90={ms(self.p90)} p99={ms(self.p99)} max={ms(self.max)} ms"
+
+class BenchStage(NamedTuple):
+    """One benchmarked operation. If setup is given, it is called (untimed) before each sample and its
+       result is passed to run."""
+    name: str
+    run: Callable[..., Any]
+    setup: Optional[Callable[[], Any]] = None
+    skip_reason: Optional[str] = None
+
+class BenchReport(NamedTuple):
+    results: List[TimingStats]
+    skipped: Dict[str, str]
+    """Reasons for skipped stages, by stage name."""
+
+    def get(self, name: str) -> Optional[TimingStats]:
+        for result in self.results:
+            if result.name == name:
+                return result
+        return None
+
+    def to_jsonable(self) -> JsonableDict:
+        return dict(results=[x.to_jsonable() for x in self.results], skipped=dict(self.skipped))
+
+    @classmethod
+    def from_jsonable(cls, data: JsonableDict) -> Self:
+        return cls([TimingStats.from_jsonable(x) for x in data["results"]], dict(data.get("skipped", {})))
+
+    def save(self, filename: str):
+        with open(filename, 'w') as f:
+            json.dump(self.to_jsonable(), f, indent=1)
+            f.write("\n")
+
+    @classmethod
+    def load(cls, filename: str) -> Self:
+        with open(filename, 'r') as f:
+            return cls.from_jsonable(json.load(f))
+
+class Regression(NamedTuple):
+    name: str
+    statistic: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return math.inf if self.baseline == 0 else self.current / self.baseline
+
+    def __str__(self):
+        return (f"{self.name}: {self.statistic} {self.current * 1000:.3f} ms vs baseline "
+                f"{self.baseline * 1000:.3f} ms ({self.ratio:.2f}x)")
+
+def compare_to_baseline(report: BenchReport, baseline: BenchReport, tolerance: float=0.25, statistic: str="p50") -> List[Regression]:
+    """Returns the stages whose statistic is more than (1 + tolerance) times the baseline's. Stages that
+       are missing from either report are not compared."""
+    regressions: List[Regression] = []
+    for result in report.results:
+        previous = baseline.get(result.name)
+        if previous is None:
+            continue
+        old_value: float = getattr(previous, statistic)
+        new_value: float = getattr(result, statistic)
+        if new_value > old_value * (1.0 + tolerance):
+            regressions.append(Regression(result.name, statistic, old_value, new_value))
+    return regressions
+
+def time_stage(stage: BenchStage, repeat: int, warmup: int=1) -> TimingStats:
+    """Runs a stage warmup + repeat times and summarizes the timings of the last repeat runs."""
+    samples: List[float] = []
+    for i in range(warmup + repeat):
+        if stage.setup is None:
+            start = time.perf_counter()
+            stage.run()
+        else:
+            arg = stage.setup()
+            start = time.perf_counter()
+            stage.run(arg)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            samples.append(elapsed)
+    return TimingStats.from_samples(stage.name, samples)
+
+def extraction_skip_reason() -> Optional[str]:
+    """Returns why wikitext extraction cannot run offline here, or None if it can."""
+    try:
+        project_dir = get_project_dir()
+    except FactoryTownError as ex:
+        return str(ex)
+    # extract_wikitext.sh builds the fandom-wiki tool from the network if it is missing.
+    tool_dir = os.path.join(project_dir, "build", "fandom-wiki")
+    if not os.path.isdir(os.path.join(tool_dir, "fandom-wiki")) or not os.path.isdir(os.path.join(tool_dir, ".venv")):
+        return f"wikitext extraction tool is not built in {tool_dir!r}"
+    return None
+
+def _registry_names(n: int) -> List[str]:
+    return [f"Bench Item {i}" for i in range(n)]
+
+def _populated_model(names: List[str]) -> FactoryTownModel:
+    """A model in which every other name is instantiated and the rest are only referenced."""
+    model = FactoryTownModel()
+    for i, name in enumerate(names):
+        if i % 2 == 0:
+            model.records.create(name, Item)
+        else:
+            model.records.get_ref(name, Item)
+    return model
+
+def benchmark_stages(registry_size: int=2000) -> List[BenchStage]:
+    """Returns the benchmark stages. Must be called inside fixture_cache()."""
+    page = "Buildings"
+    url = get_page_url(page)
+    html = read_fixture(f"{page}.edit.html")
+    markdown = read_fixture(f"{page}.wiki")
+    wtp_tables = parse_markdown(markdown).tables
+    table_names = ["Storage", "Production", "Market"]
+    names = _registry_names(registry_size)
+    populated = _populated_model(names)
+
+    def clear_memory_cache():
+        get_memory_cache().clear()
+
+    def read_markdown_file():
+        with open(os.path.join(get_markdown_cache_dir(), get_url_filename(url + "?action=edit")), 'r') as f:
+            return f.read()
+
+    def construct_table_readers():
+        return [TableReader(wtp_tables[i], name) for i, name in enumerate(table_names)]
+
+    def stream_tables(tables):
+        return [
+            list(StreamingTableReader(tables[i], name, BUILDING_COLUMNS, BUILDING_CONVERTERS))
+            for i, name in enumerate(table_names)
+          ]
+
+    def get_or_create_all(model: FactoryTownModel):
+        for name in names:
+            model.records.get_or_create(name, Item)
+
+    def get_ref_all():
+        for name in names:
+            populated.records.get_ref(name, Item)
+
+    stages = [
+        # The cache-read stages measure reads of the cache files, so the memory tier is emptied (untimed)
+        # before each sample; cache-read/markdown-memory measures a memory tier hit.
+        BenchStage("cache-read/html", lambda _: get_url_text(url + "?action=edit"), setup=clear_memory_cache),
+        BenchStage("cache-read/markdown", lambda _: get_url_markdown(url), setup=clear_memory_cache),
+        BenchStage("cache-read/markdown-file", read_markdown_file),
+        BenchStage("cache-read/markdown-memory", lambda: get_url_markdown(url)),
+        BenchStage(
+            "extract",
+            lambda: subprocess.check_output([get_markdown_scrape_script()], input=html.encode('utf-8')),
+            skip_reason=extraction_skip_reason(),
+          ),
+        BenchStage("parse/wikitext", lambda: parse_markdown(markdown).tables),
+      ]
+    for backend_name in TABLE_PARSER_BACKENDS:
+        backend = get_table_parser_backend(backend_name)
+        stages.append(BenchStage(f"parse/tables/{backend_name}", lambda backend=backend: backend.parse_tables(markdown)))
+    stages.extend([
+        BenchStage("table-reader", construct_table_readers),
+        BenchStage(
+            "streaming-table-reader",
+            stream_tables,
+            setup=lambda: get_table_parser_backend().parse_tables(markdown),
+          ),
+        BenchStage("scrape-buildings", lambda model: scrape_buildings(model), setup=FactoryTownModel),
+        BenchStage(f"registry/get-or-create/{registry_size}", get_or_create_all, setup=FactoryTownModel),
+        BenchStage(f"registry/get-ref/{registry_size}", get_ref_all),
+        BenchStage(f"registry/values/{registry_size}", lambda: populated.records.values(Item)),
+      ])
+    return stages
+
+def run_benchmarks(
+        repeat: int=20,
+        warmup: int=1,
+        stage_filter: Optional[Callable[[str], bool]]=None,
+        registry_size: int=2000,
+      ) -> BenchReport:
+    """Runs the benchmark stages offline against the recorded fixtures.
+
+    Args:
+        repeat: Number of timed samples per stage.
+        warmup: Number of untimed runs before sampling.
+        stage_filter: If given, only stages for which it returns True are run.
+        registry_size: Number of record names used by the registry stages.
+    """
+    results: List[TimingStats] = []
+    skipped: Dict[str, str] = {}
+    with fixture_cache():
+        for stage in benchmark_stages(registry_size):
+            if stage_filter is not None and not stage_filter(stage.name):
+                continue
+            if stage.skip_reason is not None:
+                logger.info(f"Skipping benchmark {stage.name!r}: {stage.skip_reason}")
+                skipped[stage.name] = stage.skip_reason
+                continue
+            results.append(time_stage(stage, repeat, warmup))
+    return BenchReport(results, skipped)
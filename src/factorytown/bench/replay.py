@@ -0,0 +1,343 @@
+from ..internal_types import *
+from ..raw_scrape.fandom_scrape import get_url_filename
+from ..raw_scrape.factorytown_wiki_scrape import FACTORYTOWN_WIKI, get_page_html, set_wiki_base_url
+from ..raw_scrape.fetch_scheduler import FetchScheduler, get_fetch_scheduler, set_fetch_scheduler
+from ..model import FactoryTownModel
+from .bench import FIXTURE_PAGES, read_fixture, temporary_cache, extraction_skip_reason, TimingStats
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, urlsplit
+import os
+import random
+import threading
+import time
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+class ReplayConfig(NamedTuple):
+    """Fault and delay injection for WikiReplayServer."""
+    latency: float = 0.0
+    """Seconds to wait before responding."""
+
+    latency_jitter: float = 0.0
+    """Up to this many seconds are added to latency, uniformly at random."""
+
+    bandwidth: Optional[float] = None
+    """Maximum bytes per second for each response body, or None for no limit."""
+
+    throttle_rate: float = 0.0
+    """Fraction of requests answered with 429 Too Many Requests."""
+
+    retry_after: Optional[float] = 1.0
+    """Retry-After seconds sent with 429 and 503 responses, or None to omit the header."""
+
+    error_rate: float = 0.0
+    """Fraction of requests answered with a 5xx error."""
+
+    error_statuses: Tuple[int, ...] = (500, 502, 503)
+    seed: Optional[int] = None
+
+class ReplayStats:
+    """Counts of the responses a WikiReplayServer has sent."""
+    requests: int
+    statuses: Dict[int, int]
+    bytes_sent: int
+    _lock: threading.Lock
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = {}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def record(self, status: int, n_bytes: int):
+        with self._lock:
+            self.requests += 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.bytes_sent += n_bytes
+
+    def to_jsonable(self) -> JsonableDict:
+        with self._lock:
+            return dict(requests=self.requests, statuses={str(k): v for k, v in sorted(self.statuses.items())}, bytes_sent=self.bytes_sent)
+
+def fixture_responses() -> Dict[str, bytes]:
+    """The recorded fixtures as response bodies, by canonical wiki URL."""
+    return {
+        get_url_filename(f"{FACTORYTOWN_WIKI}/{page}?action=edit"): read_fixture(f"{page}.edit.html").encode('utf-8')
+        for page in FIXTURE_PAGES
+      }
+
+class WikiReplayServer:
+    """A local HTTP server that replays wiki pages at the same URL shapes as the real wiki, so the scraper
+       can be pointed at it with set_wiki_base_url(server.base_url).
+
+       A request for /wiki/<page>[?query] is answered with the response recorded for
+       FACTORYTOWN_WIKI/<page>[?query]: first from the given responses (by default the recorded
+       fixtures), then from the HTTP scrape cache directory, if one is given. Other requests get a 404.
+    """
+    config: ReplayConfig
+    stats: ReplayStats
+    cache_dir: Optional[str]
+    responses: Dict[str, bytes]
+    """Response bodies by cache filename (see get_url_filename)."""
+
+    _server: ThreadingHTTPServer
+    _thread: Optional[threading.Thread] = None
+    _rng: random.Random
+    _rng_lock: threading.Lock
+
+    def __init__(
+            self,
+            config: ReplayConfig=ReplayConfig(),
+            cache_dir: Optional[str]=None,
+            responses: Optional[Mapping[str, bytes]]=None,
+            host: str="127.0.0.1",
+            port: int=0,
+          ):
+        self.config = config
+        self.stats = ReplayStats()
+        self.cache_dir = cache_dir
+        self.responses = fixture_responses() if responses is None else dict(responses)
+        self._rng = random.Random(config.seed)
+        self._rng_lock = threading.Lock()
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                replay._handle(self)
+
+            def log_message(self, format, *args):
+                logger.debug(f"replay server: {format % args}")
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/wiki"
+
+    def start(self) -> Self:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="wiki-replay-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Replaying wiki at {self.base_url}")
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        # shutdown() waits for serve_forever() to return, so it would block forever if the server was never
+        # started in a thread (serve_forever() called directly has already returned when stop() is called).
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self) -> Self:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        self.stop()
+
+    def lookup(self, path: str) -> Optional[bytes]:
+        """Returns the recorded body for a request path, or None."""
+        parts = urlsplit(path)
+        if not parts.path.startswith("/wiki/"):
+            return None
+        url = f"{FACTORYTOWN_WIKI}/{parts.path[len('/wiki/'):]}"
+        if parts.query != "":
+            url += f"?{parts.query}"
+        # The scraper requests page names as they are (the HTTP client percent-encodes them on the
+        # wire), but image URLs already percent-encoded, and the cache is keyed by the URL it was given.
+        for candidate in dict.fromkeys([unquote(url), url]):
+            filename = get_url_filename(candidate)
+            body = self.responses.get(filename)
+            if body is None and self.cache_dir is not None:
+                cache_path = os.path.join(self.cache_dir, filename)
+                if os.path.exists(cache_path):
+                    with open(cache_path, 'rb') as f:
+                        body = f.read()
+            if body is not None:
+                return body
+        return None
+
+    def _random(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    def _handle(self, request: BaseHTTPRequestHandler):
+        config = self.config
+        delay = config.latency + config.latency_jitter * self._random()
+        if delay > 0:
+            time.sleep(delay)
+        roll = self._random()
+        if roll < config.throttle_rate:
+            self._send_error(request, 429)
+            return
+        if roll < config.throttle_rate + config.error_rate:
+            with self._rng_lock:
+                status = self._rng.choice(config.error_statuses)
+            self._send_error(request, status)
+            return
+        body = self.lookup(request.path)
+        if body is None:
+            self._send_error(request, 404)
+            return
+        request.send_response(200)
+        request.send_header("Content-Type", "text/html; charset=utf-8")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        self._write_body(request, body)
+        self.stats.record(200, len(body))
+
+    def _send_error(self, request: BaseHTTPRequestHandler, status: int):
+        body = f"Injected or missing response: {status}\n".encode('utf-8')
+        request.send_response(status)
+        if status in (429, 503) and self.config.retry_after is not None:
+            request.send_header("Retry-After", f"{self.config.retry_after:g}")
+        request.send_header("Content-Type", "text/plain; charset=utf-8")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+        self.stats.record(status, len(body))
+
+    def _write_body(self, request: BaseHTTPRequestHandler, body: bytes):
+        bandwidth = self.config.bandwidth
+        if bandwidth is None or bandwidth <= 0:
+            request.wfile.write(body)
+            return
+        # Send in chunks of about 1/20 s worth of data, sleeping to hold the average rate.
+        chunk_size = max(1, int(bandwidth / 20))
+        start = time.perf_counter()
+        for offset in range(0, len(body), chunk_size):
+            request.wfile.write(body[offset:offset + chunk_size])
+            sent = min(len(body), offset + chunk_size)
+            ahead = sent / bandwidth - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+class LoadTestResult(NamedTuple):
+    requests: int
+    succeeded: int
+    errors: Dict[str, int]
+    """Failed requests by exception description."""
+
+    seconds: float
+    bytes_received: int
+    latency: Optional[TimingStats]
+    """Latency of successful requests."""
+
+    server: JsonableDict
+    fetcher: JsonableDict
+    """The fetch scheduler's stats at the end of the test (see FetchScheduler.stats)."""
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.succeeded / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes_received / self.seconds if self.seconds > 0 else 0.0
+
+    def to_jsonable(self) -> JsonableDict:
+        return dict(
+            requests=self.requests,
+            succeeded=self.succeeded,
+            errors=dict(self.errors),
+            seconds=self.seconds,
+            requests_per_second=self.requests_per_second,
+            bytes_per_second=self.bytes_per_second,
+            latency=None if self.latency is None else self.latency.to_jsonable(),
+            server=self.server,
+            fetcher=self.fetcher,
+          )
+
+@contextmanager
+def replay_wiki(server: WikiReplayServer) -> Generator[WikiReplayServer, None, None]:
+    """Points the scraper at a running replay server and at an empty temporary scrape cache, so every
+       fetch reaches the server, for the duration of the context."""
+    previous_url = os.environ.get('FACTORYTOWN_WIKI')
+    with temporary_cache():
+        set_wiki_base_url(server.base_url)
+        try:
+            yield server
+        finally:
+            set_wiki_base_url(previous_url)
+
+def run_fetch_load_test(
+        server: WikiReplayServer,
+        pages: Sequence[str]=FIXTURE_PAGES,
+        n_requests: int=200,
+        concurrency: int=8,
+        scheduler: Optional[FetchScheduler]=None,
+      ) -> LoadTestResult:
+    """Fetches edit pages from a running replay server with get_page_html(force=True), from concurrency
+       threads, n_requests times in total, cycling through pages. The fetches go through scheduler, or a
+       new FetchScheduler with no rate limit if None, which decides how many are in flight at once."""
+    if scheduler is None:
+        scheduler = FetchScheduler(rate=None)
+    errors: Dict[str, int] = {}
+    latencies: List[float] = []
+    received = [0]
+    lock = threading.Lock()
+
+    def fetch(i: int):
+        page = pages[i % len(pages)]
+        start = time.perf_counter()
+        try:
+            html = get_page_html(f"{page}?action=edit", force=True)
+        except Exception as ex:
+            with lock:
+                key = f"{ex.__class__.__name__}: {str(ex).split(' for url')[0]}"
+                errors[key] = errors.get(key, 0) + 1
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            received[0] += len(html.encode('utf-8'))
+
+    previous = get_fetch_scheduler()
+    set_fetch_scheduler(scheduler)
+    try:
+        with replay_wiki(server):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(fetch, range(n_requests)))
+            seconds = time.perf_counter() - start
+    finally:
+        set_fetch_scheduler(previous)
+    return LoadTestResult(
+        requests=n_requests,
+        succeeded=len(latencies),
+        errors=errors,
+        seconds=seconds,
+        bytes_received=received[0],
+        latency=None if len(latencies) == 0 else TimingStats.from_samples("fetch", latencies),
+        server=server.stats.to_jsonable(),
+        fetcher=scheduler.stats(),
+      )
+
+def run_scrape_test(server: WikiReplayServer, jobs: Optional[int]=1) -> Tuple[FactoryTownModel, float]:
+    """Scrapes the model end to end from a running replay server, starting with an empty cache. Returns
+       the model and the elapsed seconds.
+
+    Raises:
+        FactoryTownError: If the wikitext extraction tool is not built, since the extract script would
+            otherwise try to download and build it.
+    """
+    from ..model_scrape import scrape_model
+    reason = extraction_skip_reason()
+    if reason is not None:
+        raise FactoryTownError(f"Cannot scrape from the replay server: {reason}")
+    with replay_wiki(server):
+        start = time.perf_counter()
+        model = scrape_model(force=True, jobs=jobs)
+        return model, time.perf_counter() - start
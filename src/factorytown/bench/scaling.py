@@ -0,0 +1,125 @@
+from ..internal_types import *
+from ..mdparse import get_table_parser_backend
+from ..model import FactoryTownModel, CompactModel, Item
+from ..model_scrape.util import StreamingTableReader
+from ..model_scrape.buildings import scrape_buildings, BUILDING_COLUMNS, BUILDING_CONVERTERS
+from ..planning import Scenario, evaluate_requirements
+from .bench import fixture_cache
+from .synthetic import generate_buildings_page, generate_recipe_model, BUILDINGS_PAGE_TABLES
+
+import gc
+import time
+import tracemalloc
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_SCALING_SIZES = [1000, 10000, 100000]
+
+class ScalingResult(NamedTuple):
+    """The cost of one stage at one size. seconds is the best of the timed runs; peak_bytes is the peak
+       traced allocation during a separate traced run, and retained_bytes what was still allocated after
+       it, including the stage's result."""
+    name: str
+    size: int
+    seconds: float
+    peak_bytes: int
+    retained_bytes: int
+
+    def to_jsonable(self) -> JsonableDict:
+        return self._asdict()
+
+    def __str__(self):
+        mb = lambda x: f"{x / 1e6:9.2f}"
+        return f"{self.name:28} size={self.size:<8} {self.seconds * 1000:10.2f} ms  peak={mb(self.peak_bytes)} MB  retained={mb(self.retained_bytes)} MB"
+
+def measure(name: str, size: int, run: Callable[[], Any], repeat: int=1) -> ScalingResult:
+    """Times run() repeat times, then runs it once more under tracemalloc to measure memory. Timed runs
+       are not traced, since tracing slows allocation-heavy code several times over."""
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = run()
+        current, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return ScalingResult(name, size, best, peak - before, current - before)
+
+def page_scaling_stages(size: int, seed: int=0) -> Tuple[List[Tuple[str, Callable[[], Any]]], str]:
+    """Stages over a synthetic Buildings page with size building rows. Returns the stages and the page,
+       which must be installed in the scrape cache (see fixture_cache()) for the scrape stage."""
+    markdown = generate_buildings_page(size, n_items=max(10, size // 10), seed=seed)
+    backend = get_table_parser_backend()
+    tables = backend.parse_tables(markdown)
+
+    def stream_tables():
+        return [
+            list(StreamingTableReader(tables[i], name, BUILDING_COLUMNS, BUILDING_CONVERTERS))
+            for i, name in enumerate(BUILDINGS_PAGE_TABLES)
+          ]
+
+    def scrape():
+        model = FactoryTownModel()
+        scrape_buildings(model)
+        return model
+
+    return [
+        ("page/generate", lambda: generate_buildings_page(size, n_items=max(10, size // 10), seed=seed)),
+        (f"page/parse/{backend.name}", lambda: backend.parse_tables(markdown)),
+        ("page/streaming-table-reader", stream_tables),
+        ("page/scrape-buildings", scrape),
+      ], markdown
+
+def model_scaling_stages(size: int, depth: int=12, max_ingredients: int=2, n_targets: int=10, seed: int=0) -> List[Tuple[str, Callable[[], Any]]]:
+    """Stages over a synthetic model with size items in a recipe DAG of the given depth."""
+    model, info = generate_recipe_model(size, depth=depth, max_ingredients=max_ingredients, seed=seed)
+    cm = CompactModel.from_model(model)
+    targets = info.top_items[:n_targets]
+    names = list(model.records.referenced_keys())
+
+    def evaluate():
+        return [evaluate_requirements(cm, Scenario(targets=((x, 1.0),))) for x in targets]
+
+    def lookup():
+        for name in names:
+            model.records.get_ref(name)
+
+    return [
+        ("model/generate", lambda: generate_recipe_model(size, depth=depth, max_ingredients=max_ingredients, seed=seed)),
+        ("model/get-ref", lookup),
+        ("model/values", lambda: model.records.values(Item)),
+        ("model/compact", lambda: CompactModel.from_model(model)),
+        (f"model/evaluate/{len(targets)}", evaluate),
+      ]
+
+def run_scaling_benchmarks(
+        sizes: Sequence[int]=DEFAULT_SCALING_SIZES,
+        repeat: int=1,
+        depth: int=12,
+        max_ingredients: int=2,
+        seed: int=0,
+        stage_filter: Optional[Callable[[str], bool]]=None,
+      ) -> Iterator[ScalingResult]:
+    """Runs the page and model stages at each size, yielding results as they are measured, so slow large
+       sizes can be watched (or interrupted) as they run."""
+    for size in sizes:
+        page_stages, markdown = page_scaling_stages(size, seed=seed)
+        with fixture_cache({"Buildings": markdown}):
+            for name, run in page_stages:
+                if stage_filter is None or stage_filter(name):
+                    yield measure(name, size, run, repeat)
+        del page_stages, markdown
+        model_stages = model_scaling_stages(size, depth=depth, max_ingredients=max_ingredients, seed=seed)
+        for name, run in model_stages:
+            if stage_filter is None or stage_filter(name):
+                yield measure(name, size, run, repeat)
+        del model_stages
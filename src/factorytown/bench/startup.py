@@ -0,0 +1,140 @@
+from ..internal_types import *
+from .bench import TimingStats
+
+import os
+import subprocess
+import sys
+import time
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_STARTUP_COMMANDS: List[List[str]] = [["version"], ["scrape", "--help"]]
+"""CLI invocations that should start quickly: they need nothing beyond argument parsing."""
+
+HEAVY_MODULES = [
+    "requests",
+    "wikitextparser",
+    "mwparserfromhell",
+    "numpy",
+    "factorytown.model",
+    "factorytown.model_scrape",
+    "factorytown.mdparse",
+    "factorytown.raw_scrape",
+    "factorytown.planning",
+    "factorytown.layout",
+  ]
+"""Packages that the default startup commands must not import."""
+
+DEFAULT_STARTUP_BUDGET = 0.1
+"""Seconds of factorytown import time allowed for each startup command, as reported by -X importtime."""
+
+class ImportTime(NamedTuple):
+    """One line of python -X importtime output."""
+    module: str
+    self_seconds: float
+    cumulative_seconds: float
+    depth: int
+    """Nesting level; 0 for modules imported directly by the program rather than by another import."""
+
+def parse_importtime(stderr: str) -> List[ImportTime]:
+    """Parses the output of python -X importtime, ignoring any other lines."""
+    results: List[ImportTime] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        module = name.lstrip()
+        depth = (len(name) - len(module) - 1) // 2
+        results.append(ImportTime(module, int(fields[0]) / 1e6, int(fields[1]) / 1e6, depth))
+    return results
+
+class StartupResult(NamedTuple):
+    """Startup cost of one CLI invocation."""
+    command: List[str]
+    wall: TimingStats
+    """Wall-clock time of the whole process, including interpreter startup."""
+
+    import_seconds: float
+    """Median total cumulative time of the top-level imports the interpreter does not make on its own."""
+
+    imports: List[ImportTime]
+    """The imports the interpreter does not make on its own, from the last run."""
+
+    heavy_modules: List[str]
+    """Modules from HEAVY_MODULES (or their submodules) that were imported."""
+
+    def top_imports(self, n: int=10) -> List[ImportTime]:
+        return sorted(self.imports, key=lambda x: -x.self_seconds)[:n]
+
+    def to_jsonable(self) -> JsonableDict:
+        return dict(
+            command=self.command,
+            wall=self.wall.to_jsonable(),
+            import_seconds=self.import_seconds,
+            heavy_modules=self.heavy_modules,
+            top_imports=[x._asdict() for x in self.top_imports()],
+          )
+
+    def __str__(self):
+        return f"{' '.join(self.command):32} imports={self.import_seconds * 1000:8.2f} ms  wall p50={self.wall.p50 * 1000:8.2f} ms"
+
+def _run_importtime(args: List[str], python: str) -> Tuple[float, List[ImportTime]]:
+    env = dict(os.environ)
+    env.pop('PYTHONPROFILEIMPORTTIME', None)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [python, "-X", "importtime", *args],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        env=env,
+        text=True,
+        check=False,
+      )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise FactoryTownError(f"{' '.join(args)} exited with status {result.returncode}: {result.stderr[-2000:]}")
+    return wall, parse_importtime(result.stderr)
+
+def measure_startup(
+        command: Sequence[str],
+        repeat: int=5,
+        python: str=sys.executable,
+        heavy_modules: Sequence[str]=HEAVY_MODULES,
+      ) -> StartupResult:
+    """Runs `python -X importtime -m factorytown <command>` repeat times and summarizes its startup cost.
+       Imports that a bare interpreter also makes (site, encodings, and anything pulled in by .pth files)
+       are excluded from the import time, so the result reflects only this package's import structure."""
+    _, baseline = _run_importtime(["-c", "pass"], python)
+    interpreter_modules = set(x.module for x in baseline)
+    walls: List[float] = []
+    import_times: List[float] = []
+    imports: List[ImportTime] = []
+    for _ in range(max(1, repeat)):
+        wall, all_imports = _run_importtime(["-m", "factorytown", *command], python)
+        imports = [x for x in all_imports if x.module not in interpreter_modules]
+        walls.append(wall)
+        import_times.append(sum(x.cumulative_seconds for x in imports if x.depth == 0))
+    imported = set(x.module for x in imports)
+    heavy = [m for m in heavy_modules if any(x == m or x.startswith(m + ".") for x in imported)]
+    return StartupResult(
+        command=list(command),
+        wall=TimingStats.from_samples(" ".join(command), walls),
+        import_seconds=sorted(import_times)[len(import_times) // 2],
+        imports=imports,
+        heavy_modules=heavy,
+      )
+
+def check_startup_budget(result: StartupResult, budget: float=DEFAULT_STARTUP_BUDGET) -> List[str]:
+    """Returns descriptions of the ways result exceeds the startup budget, or an empty list."""
+    problems: List[str] = []
+    if result.import_seconds > budget:
+        problems.append(f"{' '.join(result.command)}: imports took {result.import_seconds * 1000:.2f} ms, over the budget of {budget * 1000:.2f} ms")
+    if len(result.heavy_modules) > 0:
+        problems.append(f"{' '.join(result.command)}: imported {', '.join(result.heavy_modules)}")
+    return problems
@@ -0,0 +1,169 @@
+from ..internal_types import *
+from ..model import FactoryTownModel, Building, Item, Research, Recipe, GridDim
+from ..model.recipe import CountedGameObjectRef
+
+import random
+
+BUILDINGS_PAGE_TABLES = ["Storage", "Production", "Market"]
+
+BUILDINGS_PAGE_HEADERS: Dict[str, List[str]] = {
+    "Storage": ["Building", "Size", "Tech Lv.", "Research<br>Required", "Shared<br>Inventory", "Capacity", "Ingredients"],
+    "Production": ["Building", "Size", "Tech Lv.", "Research<br>Required", "Ingredients"],
+    "Market": ["Building", "Size", "Tech Lv.", "Research<br>Required", "Ingredients"],
+}
+"""The raw column headers of each table on the Buildings page, as they appear in the wikitext."""
+
+def format_wikitable(headers: List[str], rows: List[List[str]]) -> str:
+    """Formats a sortable wikitable with one cell per line, as the wiki's pages do."""
+    lines = ['{| class="wikitable sortable"']
+    lines.extend("!" + h for h in headers)
+    for row in rows:
+        lines.append("|-")
+        lines.extend("|" + cell for cell in row)
+    lines.append("|}")
+    return "\n".join(lines)
+
+def _ingredients_cell(rng: random.Random, items: List[str], max_ingredients: int) -> str:
+    chosen = rng.sample(items, min(len(items), rng.randint(1, max_ingredients)))
+    parts: List[str] = []
+    for item in chosen:
+        quantity = rng.randint(1, 40)
+        parts.append("{{Item|%s}}" % item if quantity == 1 else "%dx {{Item|%s}}" % (quantity, item))
+    return " + ".join(parts)
+
+def generate_buildings_page(
+        n_buildings: int,
+        n_items: int=100,
+        n_research: int=20,
+        max_ingredients: int=3,
+        seed: int=0,
+      ) -> str:
+    """Generates wikitext in the format of the wiki's Buildings page, with Storage, Production and Market
+       tables holding n_buildings rows in total (roughly 10%, 80% and 10% respectively). The result can be
+       scraped by scrape_buildings().
+
+    Args:
+        n_buildings: Total number of building rows.
+        n_items: Number of distinct items used as building ingredients.
+        n_research: Number of distinct researches buildings may require.
+        max_ingredients: Maximum number of ingredients per building.
+        seed: Random seed. The same arguments always produce the same page.
+    """
+    rng = random.Random(seed)
+    items = [f"Synthetic Item {i}" for i in range(max(1, n_items))]
+    researches = [f"Synthetic Research {i}" for i in range(n_research)]
+    n_storage = max(1, n_buildings // 10)
+    n_market = max(1, n_buildings // 10)
+    counts = {
+        "Storage": n_storage,
+        "Production": max(0, n_buildings - n_storage - n_market),
+        "Market": n_market,
+      }
+    sections: List[str] = ["The '''buildings''' of [[Factory Town]] (synthetic).", "", "__TOC__", ""]
+    building_index = 0
+    for table_name in BUILDINGS_PAGE_TABLES:
+        rows: List[List[str]] = []
+        for _ in range(counts[table_name]):
+            tech_level = rng.randint(1, 5)
+            research = "N/A" if tech_level == 1 or len(researches) == 0 else rng.choice(researches)
+            row = [
+                "{{Item|Synthetic %s %d}}" % (table_name, building_index),
+                f"{rng.randint(1, 4)}x{rng.randint(1, 4)}",
+                str(tech_level),
+                research,
+              ]
+            if table_name == "Storage":
+                row.append(rng.choice(["Yes", "No"]))
+                row.append(f"{rng.randint(1, 20) * 10} per item<br>+{rng.randint(1, 10) * 10} with upgrade")
+            row.append(_ingredients_cell(rng, items, max_ingredients))
+            rows.append(row)
+            building_index += 1
+        sections.append(f"== {table_name} ==")
+        sections.append(format_wikitable(BUILDINGS_PAGE_HEADERS[table_name], rows))
+        sections.append("")
+    sections.append("[[Category:Buildings]]")
+    return "\n".join(sections) + "\n"
+
+class SyntheticModelInfo(NamedTuple):
+    """Describes a model built by generate_recipe_model()."""
+    layers: List[List[str]]
+    """Item names by recipe depth. Layer 0 holds the raw items, which have no recipe; every item in layer k
+       has a recipe with at least one ingredient from layer k - 1."""
+
+    buildings: List[str]
+    researches: List[str]
+
+    @property
+    def top_items(self) -> List[str]:
+        return self.layers[-1]
+
+def generate_recipe_model(
+        n_items: int,
+        depth: int=12,
+        max_ingredients: int=2,
+        items_per_building: int=10,
+        n_research: int=50,
+        seed: int=0,
+        model: Optional[FactoryTownModel]=None,
+      ) -> Tuple[FactoryTownModel, SyntheticModelInfo]:
+    """Builds a model with a deep recipe DAG through the normal record APIs.
+
+       Items are split evenly into depth + 1 layers. Each non-raw item gets one production recipe in a
+       Production building, with one ingredient from the layer directly below it and up to
+       max_ingredients - 1 more from random lower layers, so every top-layer item has a chain of depth
+       recipes below it. Each building also gets its own construction recipe from raw items, a grid size,
+       a tech level and possibly a research requirement, as scrape_buildings() would set.
+
+    Returns:
+        The model, and the names of the generated items by layer, buildings and researches.
+    """
+    if model is None:
+        model = FactoryTownModel()
+    rng = random.Random(seed)
+    registry = model.records
+    depth = max(1, depth)
+    width = max(1, n_items // (depth + 1))
+    layers = [[f"Synthetic Item {k}-{i}" for i in range(width)] for k in range(depth + 1)]
+    for layer in layers:
+        for name in layer:
+            registry.create(name, Item)
+
+    researches = [Research.get_record_name(f"Synthetic Research {i}") for i in range(n_research)]
+    for name in researches:
+        registry.create(name, Research)
+
+    n_buildings = max(1, (width * depth) // max(1, items_per_building))
+    buildings = [f"Synthetic Building {i}" for i in range(n_buildings)]
+    raw = layers[0]
+    for name in buildings:
+        building = registry.create(name, Building)
+        building.building_type = "Production"
+        building.grid_size = GridDim(rng.randint(1, 4), rng.randint(1, 4))
+        building.tech_level = rng.randint(1, 5)
+        building.research = None if len(researches) == 0 or building.tech_level == 1 else rng.choice(researches)
+        building.shared_inventory = False
+        building.capacity_note = ""
+        recipe = registry.create(Recipe.create_record_name(None, name), Recipe)
+        recipe.ingredients = [
+            CountedGameObjectRef.create(registry, x, rng.randint(1, 40))
+            for x in rng.sample(raw, min(len(raw), rng.randint(1, 3)))
+          ]
+        recipe.set_product(building, 1)
+        recipe.work_units = 0
+        building.recipe = recipe
+
+    building_index = 0
+    for k in range(1, depth + 1):
+        for name in layers[k]:
+            producer = buildings[building_index % n_buildings]
+            building_index += 1
+            recipe = registry.create(Recipe.create_record_name(producer, name), Recipe)
+            ingredients = [rng.choice(layers[k - 1])]
+            for _ in range(rng.randint(0, max_ingredients - 1)):
+                ingredient = rng.choice(layers[rng.randrange(k)])
+                if ingredient not in ingredients:
+                    ingredients.append(ingredient)
+            recipe.ingredients = [CountedGameObjectRef.create(registry, x, rng.randint(1, 5)) for x in ingredients]
+            recipe.set_product(name, rng.randint(1, 3))
+            recipe.work_units = rng.randint(1, 20)
+    return model, SyntheticModelInfo(layers, buildings, researches)
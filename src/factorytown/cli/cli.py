@@ -22,9 +22,6 @@ from ..common import *
 from ..version import __version__
 from ..proj_dir import get_project_dir
 from ..version import __version__ as pkg_version
-from ..model_scrape import (
-    scrape_model, FactoryTownModel
-)
 
 PROGNAME = "factorytown"
 
@@ -52,6 +49,8 @@ class CommandHandler:
     _args: argparse.Namespace
     _provide_traceback: bool = True
     _project_dir: Optional[str] = None
+    _cprofile: Optional[Any] = None
+    _metrics_server: Optional[Any] = None
 
     def __init__(self, argv: Optional[Sequence[str]]=None):
         self._argv = None if argv is None else list(argv)
@@ -64,6 +63,51 @@ class CommandHandler:
     def get_build_dir(self) -> str:
         return os.path.join(self.get_project_dir(), "build")
 
+    def _start_profiling(self):
+        if self._args.profile or self._args.profile_json is not None:
+            from ..profiling import start_profiling
+            start_profiling()
+        if self._args.cprofile is not None:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def _finish_profiling(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self._args.cprofile)
+            self._cprofile = None
+        from ..profiling import stop_profiling
+        profiler = stop_profiling()
+        if profiler is not None:
+            print(profiler.format_tree(), file=sys.stderr)
+            if self._args.profile_json is not None:
+                with open(self._args.profile_json, 'w') as f:
+                    json.dump(profiler.to_jsonable(), f, indent=2)
+                    f.write("\n")
+
+    def _start_metrics(self):
+        if self._args.metrics_port is not None:
+            from ..metrics import METRICS
+            self._metrics_server = METRICS.start_http_server(self._args.metrics_port)
+
+    def _finish_metrics(self):
+        from ..metrics import METRICS
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+            self._metrics_server = None
+        # Only serialize the summary if something will show it.
+        if self._args.metrics_json is not None or logging.getLogger().isEnabledFor(logging.INFO):
+            summary = json.dumps(METRICS.to_jsonable(), indent=2)
+            logging.info(f"Metrics summary: {summary}")
+            if self._args.metrics_json == "-":
+                print(summary, file=sys.stderr)
+            elif self._args.metrics_json is not None:
+                with open(self._args.metrics_json, 'w') as f:
+                    f.write(summary + "\n")
+        if self._args.metrics_file is not None:
+            METRICS.write_prometheus_file(self._args.metrics_file)
+
     def cmd_bare(self) -> int:
         print("Error: A command is required\n", file=sys.stderr)
         self._args.subparser.print_help(sys.stderr)
@@ -72,7 +116,7 @@ class CommandHandler:
     def cmd_get_md(self) -> int:
         from ..raw_scrape import get_page_markdown
         page_name: str = self._args.page_name
-        force: bool = self._args.force, bool
+        force: bool = self._args.force
         md = get_page_markdown(page_name, force)
         print(md, end='')
         return 0
@@ -80,22 +124,493 @@ class CommandHandler:
     def cmd_get_html(self) -> int:
         from ..raw_scrape import get_page_html
         page_name: str = self._args.page_name
-        force: bool = self._args.force, bool
+        force: bool = self._args.force
         html = get_page_html(page_name, force)
         print(html, end='')
         return 0
 
     def cmd_scrape(self) -> int:
         from ..model_scrape import scrape_model, FactoryTownModel
-        force: bool = self._args.force, bool
-        model = scrape_model(force=force)
+        force: bool = self._args.force
+        jobs: Optional[int] = self._args.jobs or None
+        model = scrape_model(force=force, jobs=jobs)
         print(model)
         return 0
 
+    def cmd_crawl(self) -> int:
+        from ..model_scrape import scrape_model, crawl_model
+        from ..model import save_snapshot
+        args = self._args
+        model = scrape_model(force=args.force, jobs=args.jobs or None)
+        result = crawl_model(model, args.force, max_workers=args.crawl_jobs, max_pages=args.max_pages)
+        if args.snapshot is not None:
+            save_snapshot(model, args.snapshot)
+        if args.json:
+            print(json.dumps(result.to_jsonable(), indent=2))
+        else:
+            print(f"Crawled {result.pages} pages in {result.seconds:.3f} s: {result.recipes} recipes, "
+                  f"{result.items_created} new items, {result.assumed_quantities} assumed product quantities, "
+                  f"{result.remaining} pages left unfetched")
+            for name, error in sorted(result.failed.items()):
+                print(f"  failed: {name}: {error}")
+            print(model)
+        return 0
+
+    def cmd_sweep(self) -> int:
+        from ..model_scrape import scrape_model
+        from ..planning import Scenario, run_sweep
+        force: bool = self._args.force
+        scenarios_file: str = self._args.scenarios_file
+        jobs: Optional[int] = self._args.jobs
+        with open(scenarios_file, 'r') as f:
+            scenarios_data = json.load(f)
+        if not isinstance(scenarios_data, list):
+            raise FactoryTownError(f"Scenarios file {scenarios_file!r} must contain a JSON list")
+        scenarios = [Scenario.from_jsonable(x) for x in scenarios_data]
+        model = scrape_model(force=force)
+        for i, scenario, result in run_sweep(model, scenarios, max_workers=jobs):
+            print(json.dumps(dict(index=i, scenario=scenario.to_jsonable(), result=result.to_jsonable())), flush=True)
+        return 0
+
+    def cmd_layout(self) -> int:
+        from ..model_scrape import scrape_model
+        from ..layout import building_footprints, optimize_layout
+        force: bool = self._args.force
+        building_specs: List[str] = self._args.buildings
+        names: List[str] = []
+        for spec in building_specs:
+            name, _, count = spec.rpartition(":")
+            if name == "" or not count.isdigit():
+                name, count = spec, "1"
+            names.extend([name] * int(count))
+        model = scrape_model(force=force)
+        layout = optimize_layout(
+            building_footprints(model, names),
+            self._args.width,
+            self._args.height,
+            heuristic=self._args.heuristic,
+            allow_rotation=not self._args.no_rotate,
+            starts=self._args.starts,
+            iterations=self._args.iterations,
+            seed=self._args.seed,
+            max_workers=self._args.jobs,
+          )
+        if self._args.ascii:
+            print(layout.to_ascii())
+        else:
+            print(json.dumps(layout.to_jsonable(), indent=2))
+        return 0 if len(layout.unplaced) == 0 else 1
+
+    def cmd_research_plan(self) -> int:
+        from ..model_scrape import scrape_model
+        from ..planning import plan_research
+        force: bool = self._args.force
+        costs: Optional[Dict[str, float]] = None
+        prerequisites: Optional[Dict[str, List[str]]] = None
+        if self._args.research_data is not None:
+            with open(self._args.research_data, 'r') as f:
+                research_data = json.load(f)
+            costs = research_data.get("costs")
+            prerequisites = research_data.get("prerequisites")
+        model = scrape_model(force=force)
+        plan = plan_research(
+            model,
+            self._args.target,
+            costs=costs,
+            prerequisites=prerequisites,
+            researched=self._args.researched,
+          )
+        print(json.dumps(plan.to_jsonable(), indent=2))
+        return 0
+
+    def cmd_valuate(self) -> int:
+        from ..model_scrape import scrape_model
+        from ..planning import MarketPrices, get_market_valuation
+        force: bool = self._args.force
+        prices = MarketPrices.load(self._args.prices)
+        model = scrape_model(force=force)
+        valuation = get_market_valuation(model, prices)
+        ranking = valuation.rank(self._args.per, color=self._args.coin, market=self._args.market, top=self._args.top)
+        for entry in ranking:
+            print(json.dumps(entry._asdict()))
+        return 0
+
+    def cmd_snapshot(self) -> int:
+        from ..model_scrape import scrape_model
+        from ..model import save_snapshot
+        force: bool = self._args.force
+        model = scrape_model(force=force)
+        save_snapshot(model, self._args.output)
+        return 0
+
+    def cmd_diff(self) -> int:
+        from ..model import load_snapshot, diff_models
+        force: bool = self._args.force
+        old_model = load_snapshot(self._args.old)
+        if self._args.new is None:
+            from ..model_scrape import scrape_model
+            new_model = scrape_model(force=force)
+        else:
+            new_model = load_snapshot(self._args.new)
+        diff = diff_models(old_model, new_model)
+        print(json.dumps(diff.to_jsonable(), indent=2, sort_keys=True))
+        if self._args.exit_code and not diff.is_empty:
+            return 1
+        return 0
+
+    def cmd_export(self) -> int:
+        from ..model import load_snapshot, write_ndjson, write_npz, write_arrow
+        args = self._args
+        if args.snapshot is not None:
+            model = load_snapshot(args.snapshot)
+        else:
+            from ..model_scrape import scrape_model
+            model = scrape_model(force=args.force)
+        classes: Optional[List[str]] = args.record_class or None
+        output: Optional[str] = args.output
+        if args.format == "ndjson":
+            if output is None or output == "-":
+                write_ndjson(model, sys.stdout, classes)
+            else:
+                with open(output, 'w') as f:
+                    write_ndjson(model, f, classes)
+        elif output is None:
+            raise FactoryTownError(f"--output is required for --format {args.format}")
+        elif args.format == "npz":
+            write_npz(model, output, classes)
+        else:
+            for filename in write_arrow(model, output, classes):
+                print(filename)
+        return 0
+
+    def cmd_assets_sync(self) -> int:
+        from ..model import load_snapshot
+        from ..raw_scrape import AssetStore, get_model_image_names, sync_assets
+        args = self._args
+        if args.snapshot is not None:
+            model = load_snapshot(args.snapshot)
+        else:
+            from ..model_scrape import scrape_model
+            model = scrape_model(force=False)
+        from ..model import GameObject
+        from ..model_scrape import is_crawlable_name
+        from ..model_scrape.util import get_record_page
+        store = AssetStore(args.store)
+        # Images are fetched at the URLs the wiki's pages use for them: the list pages, and each game
+        # object's own page.
+        pages = ["Buildings"] + [
+            get_record_page(x.record_name) for x in model.records.values(GameObject) if is_crawlable_name(x.record_name)
+          ]
+        result = sync_assets(get_model_image_names(model), store, max_workers=args.jobs, force=args.force, pages=pages)
+        if args.json:
+            print(json.dumps(result.to_jsonable(), indent=2))
+        else:
+            usage = result.usage
+            print(f"{result.images} images at {result.urls} URLs: {result.cached} already stored, {result.downloaded} downloaded "
+                  f"({result.new_blobs} new content, {result.bytes_downloaded} bytes), {len(result.failed)} failed")
+            print(f"store {store.root}: {usage['urls']} URLs -> {usage['blobs']} blobs, "
+                  f"{usage['stored_bytes']} bytes stored of {usage['logical_bytes']}; "
+                  f"deduplication saved {usage['saved_bytes']} bytes")
+            for image_name, error in sorted(result.failed.items()):
+                print(f"  {image_name}: {error}")
+        return 0 if len(result.failed) == 0 else 1
+
+    def cmd_check_tables(self) -> int:
+        import time
+        from ..raw_scrape.fandom_scrape import get_markdown_cache_dir
+        from ..mdparse import (
+            compare_table_parsers, tokenize_tables, UnsupportedTableSyntax, TABLE_PARSER_BACKENDS,
+            get_table_parser_backend,
+          )
+        cache_dir = get_markdown_cache_dir()
+        # Skip the temporary files of cache writes in progress.
+        filenames = sorted(x for x in os.listdir(cache_dir) if not x.startswith(".")) if os.path.isdir(cache_dir) else []
+        if len(filenames) == 0:
+            raise FactoryTownError(f"No cached pages in {cache_dir!r}; run a scrape first")
+        pages: List[Tuple[str, str]] = []
+        for filename in filenames:
+            with open(os.path.join(cache_dir, filename), 'r') as f:
+                pages.append((filename, f.read()))
+        n_differences = 0
+        n_fallback = 0
+        reference = get_table_parser_backend("wikitextparser")
+        for filename, markdown in pages:
+            try:
+                tokenize_tables(markdown)
+            except UnsupportedTableSyntax as ex:
+                n_fallback += 1
+                print(f"{filename}: tokenizer falls back to wikitextparser: {ex}")
+            else:
+                for difference in compare_table_parsers(markdown):
+                    n_differences += 1
+                    print(f"{filename}: {difference}")
+            expected = [(t.caption, t.data()) for t in reference.parse_tables(markdown)]
+            for backend_name in TABLE_PARSER_BACKENDS:
+                if backend_name in ("tokenizer", reference.name):
+                    continue
+                actual = [(t.caption, t.data()) for t in get_table_parser_backend(backend_name).parse_tables(markdown)]
+                if actual != expected:
+                    n_differences += 1
+                    print(f"{filename}: {backend_name} tables differ from {reference.name}")
+        n_bytes = sum(len(md.encode('utf-8')) for _, md in pages)
+        repeat: int = self._args.repeat
+        timings: Dict[str, float] = {}
+        for backend_name in TABLE_PARSER_BACKENDS:
+            backend = get_table_parser_backend(backend_name)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for _, markdown in pages:
+                    backend.parse_tables(markdown)
+            timings[backend_name] = time.perf_counter() - start
+        for backend_name, elapsed in timings.items():
+            mb_per_sec = n_bytes * repeat / elapsed / 1e6 if elapsed > 0 else float('inf')
+            print(f"{backend_name}: {elapsed:.3f}s for {len(pages)} pages x {repeat}, {mb_per_sec:.2f} MB/s")
+        print(f"{len(pages)} pages, {n_fallback} fall back, {n_differences} differences")
+        return 0 if n_differences == 0 else 1
+
     def cmd_version(self) -> int:
         print(pkg_version)
         return 0
     
+    def cmd_bench(self) -> int:
+        from ..bench import run_benchmarks, compare_to_baseline, BenchReport
+        stage_patterns: List[str] = self._args.stage
+        baseline_file: Optional[str] = self._args.baseline
+        baseline = None if baseline_file is None else BenchReport.load(baseline_file)
+        report = run_benchmarks(
+            repeat=self._args.repeat,
+            warmup=self._args.warmup,
+            stage_filter=None if len(stage_patterns) == 0 else lambda name: any(p in name for p in stage_patterns),
+            registry_size=self._args.registry_size,
+          )
+        if self._args.json:
+            print(json.dumps(report.to_jsonable(), indent=2))
+        else:
+            for result in report.results:
+                print(result)
+            for name, reason in report.skipped.items():
+                print(f"{name:32} skipped: {reason}")
+        if self._args.save_baseline is not None:
+            report.save(self._args.save_baseline)
+        if baseline is not None:
+            regressions = compare_to_baseline(report, baseline, tolerance=self._args.tolerance, statistic=self._args.statistic)
+            for regression in regressions:
+                print(f"REGRESSION: {regression}", file=sys.stderr)
+            if len(regressions) > 0:
+                return 1
+        return 0
+
+    def cmd_bench_scale(self) -> int:
+        from ..bench import run_scaling_benchmarks
+        sizes = [int(x) for x in self._args.sizes.split(",")]
+        stage_patterns: List[str] = self._args.stage
+        results = run_scaling_benchmarks(
+            sizes,
+            repeat=self._args.repeat,
+            depth=self._args.depth,
+            max_ingredients=self._args.max_ingredients,
+            seed=self._args.seed,
+            stage_filter=None if len(stage_patterns) == 0 else lambda name: any(p in name for p in stage_patterns),
+          )
+        for result in results:
+            print(json.dumps(result.to_jsonable()) if self._args.json else result, flush=True)
+        return 0
+
+    def cmd_bench_startup(self) -> int:
+        from ..bench import DEFAULT_STARTUP_COMMANDS, measure_startup, check_startup_budget
+        import shlex
+        commands = [shlex.split(x) for x in self._args.command] if len(self._args.command) > 0 else DEFAULT_STARTUP_COMMANDS
+        budget: float = self._args.budget_ms / 1000
+        problems: List[str] = []
+        results = []
+        for command in commands:
+            result = measure_startup(command, repeat=self._args.repeat)
+            results.append(result)
+            problems.extend(check_startup_budget(result, budget))
+            if not self._args.json:
+                print(result, flush=True)
+                for x in result.top_imports(self._args.top):
+                    print(f"    {x.self_seconds * 1000:8.2f} ms self {x.cumulative_seconds * 1000:8.2f} ms cumulative  {x.module}")
+        if self._args.json:
+            print(json.dumps([r.to_jsonable() for r in results], indent=2))
+        for problem in problems:
+            print(f"OVER BUDGET: {problem}", file=sys.stderr)
+        return 1 if len(problems) > 0 else 0
+
+    def cmd_synth_page(self) -> int:
+        from ..bench import generate_buildings_page
+        print(generate_buildings_page(
+            self._args.buildings,
+            n_items=self._args.items,
+            n_research=self._args.research,
+            seed=self._args.seed,
+          ), end='')
+        return 0
+
+    def _replay_config(self) -> 'ReplayConfig':
+        from ..bench import ReplayConfig
+        args = self._args
+        return ReplayConfig(
+            latency=args.latency,
+            latency_jitter=args.latency_jitter,
+            bandwidth=args.bandwidth,
+            throttle_rate=args.throttle_rate,
+            retry_after=args.retry_after,
+            error_rate=args.error_rate,
+            seed=args.seed,
+          )
+
+    def _replay_cache_dir(self) -> Optional[str]:
+        from ..raw_scrape.fandom_scrape import get_http_cache_dir
+        cache_dir: Optional[str] = self._args.cache_dir
+        if cache_dir is None:
+            return get_http_cache_dir()
+        return None if cache_dir == "" else cache_dir
+
+    def cmd_replay_server(self) -> int:
+        from ..bench import WikiReplayServer
+        server = WikiReplayServer(self._replay_config(), cache_dir=self._replay_cache_dir(), port=self._args.port)
+        print(f"Replaying wiki at {server.base_url}; point the scraper at it with FACTORYTOWN_WIKI={server.base_url}", file=sys.stderr, flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+            print(json.dumps(server.stats.to_jsonable()), file=sys.stderr)
+        return 0
+
+    def cmd_load_test(self) -> int:
+        from ..bench import WikiReplayServer, FIXTURE_PAGES, run_fetch_load_test, run_scrape_test, extraction_skip_reason
+        args = self._args
+        pages: List[str] = args.page if len(args.page) > 0 else FIXTURE_PAGES
+        from ..raw_scrape.fetch_scheduler import FetchScheduler, DEFAULT_FETCH_CONCURRENCY
+        scheduler = FetchScheduler(
+            rate=None if args.fetch_rate is None or args.fetch_rate <= 0 else args.fetch_rate,
+            max_concurrency=DEFAULT_FETCH_CONCURRENCY if args.fetch_concurrency is None else args.fetch_concurrency,
+          )
+        with WikiReplayServer(self._replay_config(), cache_dir=self._replay_cache_dir()) as server:
+            result = run_fetch_load_test(server, pages, n_requests=args.requests, concurrency=args.concurrency, scheduler=scheduler)
+            output: JsonableDict = dict(fetch=result.to_jsonable())
+            if args.scrape:
+                reason = extraction_skip_reason()
+                if reason is None:
+                    _, seconds = run_scrape_test(server, jobs=args.jobs)
+                    output.update(scrape=dict(seconds=seconds))
+                else:
+                    output.update(scrape=dict(skipped=reason))
+        if args.json:
+            print(json.dumps(output, indent=2))
+        else:
+            print(f"{result.succeeded}/{result.requests} requests succeeded in {result.seconds:.3f} s: "
+                  f"{result.requests_per_second:.1f} requests/s, {result.bytes_per_second / 1e6:.2f} MB/s")
+            if result.latency is not None:
+                print(result.latency)
+            for error, count in sorted(result.errors.items()):
+                print(f"  {count:6} x {error}")
+            print(f"server: {json.dumps(result.server)}")
+            print(f"fetcher: {json.dumps(result.fetcher)}")
+            if 'scrape' in output:
+                scrape = cast(JsonableDict, output['scrape'])
+                print(f"scrape: skipped: {scrape['skipped']}" if 'skipped' in scrape else f"scrape: {scrape['seconds']:.3f} s")
+        exit_code = 0
+        if args.min_throughput is not None and result.requests_per_second < args.min_throughput:
+            print(f"Throughput {result.requests_per_second:.1f} requests/s is below the minimum of {args.min_throughput:g}", file=sys.stderr)
+            exit_code = 1
+        if args.error_rate == 0 and args.throttle_rate == 0 and len(result.errors) > 0:
+            print(f"{result.requests - result.succeeded} requests failed with no faults injected", file=sys.stderr)
+            exit_code = 1
+        return exit_code
+
+    def cmd_serve(self) -> int:
+        from ..service import ModelSource, ModelServer
+        args = self._args
+        source = ModelSource(snapshot=args.snapshot, jobs=args.jobs or None, force=args.force)
+        server = ModelServer(
+            source,
+            host=args.host,
+            port=args.port,
+            cache_size=args.cache_size,
+            reload_interval=args.reload_interval if args.reload_interval > 0 else None,
+          )
+        print(f"Serving model queries at {server.url}; point queries at it with FACTORYTOWN_SERVER={server.url}", file=sys.stderr, flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+        return 0
+
+    def cmd_query(self) -> int:
+        from ..service import ModelClient, ModelSource, QueryEngine, get_server_url
+        args = self._args
+        op: str = args.op
+        requests: List[JsonableDict] = []
+        if op in ("record", "chain"):
+            if len(args.names) == 0:
+                raise FactoryTownError(f"Query {op!r} requires at least one record name")
+            for name in args.names:
+                request: JsonableDict = dict(op=op, name=name)
+                if op == "chain":
+                    request.update(max_depth=args.depth)
+                requests.append(request)
+        elif op == "records":
+            request = dict(op=op)
+            for key, value in (("class_name", args.record_class), ("tag", args.tag), ("prefix", args.prefix)):
+                if value is not None:
+                    request[key] = value
+            requests.append(request)
+        elif op == "requirements":
+            targets: Dict[str, Jsonable] = {}
+            for spec in args.names:
+                name, _, rate = spec.rpartition(":")
+                if name == "":
+                    name, rate = spec, "1"
+                targets[name] = float(rate)
+            requests.append(dict(op=op, targets=targets, tech_level=args.tech_level, excluded_buildings=args.exclude))
+        elif op != "status":
+            requests.append(dict(op=op))
+        server_url: Optional[str] = args.server or get_server_url()
+        if server_url is not None:
+            client = ModelClient(server_url)
+            results: List[Jsonable] = [client.status()] if op == "status" else [client.query(r) for r in requests]
+        else:
+            engine = QueryEngine(ModelSource(snapshot=args.snapshot, force=args.force).load())
+            results = [engine.status()] if op == "status" else [engine.query(r) for r in requests]
+        for result in results:
+            print(json.dumps(result, indent=2))
+        return 0
+
+    def cmd_batch(self) -> int:
+        from ..service import ModelClient, ModelSource, QueryEngine, get_server_url, run_batch
+        args = self._args
+        server_url: Optional[str] = args.server or get_server_url()
+        target: Union[QueryEngine, ModelClient]
+        if server_url is not None:
+            target = ModelClient(server_url)
+        else:
+            target = QueryEngine(ModelSource(snapshot=args.snapshot, force=args.force).load())
+        jobs: Optional[int] = args.jobs or None
+        responses = run_batch(
+            target,
+            sys.stdin,
+            ordered=not args.unordered,
+            max_workers=jobs,
+            chunk_size=args.chunk_size,
+          )
+        n_errors = 0
+        for response in responses:
+            if "error" in response:
+                n_errors += 1
+            sys.stdout.write(json.dumps(response) + "\n")
+            if jobs == 1:
+                sys.stdout.flush()
+        sys.stdout.flush()
+        if n_errors > 0:
+            logging.warning(f"{n_errors} batch queries failed")
+        return 0
+
     def cmd_test(self) -> int:
         from ..test import do_test
         #do_test()
@@ -129,6 +644,27 @@ class CommandHandler:
         parser.add_argument('--log-level', '-l', type=str.lower, dest='log_level', default='warning',
                             choices=['debug', 'infos', 'warning', 'error', 'critical'],
                             help='''The logging level to use. Default: warning''')
+        parser.add_argument('--md-backend', default=None,
+                            choices=['tokenizer', 'wikitextparser', 'mwparserfromhell'],
+                            help='''The wikitext table parser to use when scraping. Default: $FACTORYTOWN_MD_BACKEND, or tokenizer''')
+        parser.add_argument('--profile', action='store_true', default=False,
+                            help='''Print a hierarchical timing tree of the command's scraping and parsing stages to stderr''')
+        parser.add_argument('--profile-json', default=None,
+                            help='''Write the timing tree to this file as JSON. Implies --profile''')
+        parser.add_argument('--cprofile', default=None,
+                            help='''Also run the command under cProfile and dump its stats to this file, for use with pstats''')
+        parser.add_argument('--metrics-file', default=None,
+                            help='''Write metrics in Prometheus text format to this file when the command finishes''')
+        parser.add_argument('--metrics-port', type=int, default=None,
+                            help='''Serve metrics in Prometheus text format on this localhost port while the command runs''')
+        parser.add_argument('--metrics-json', default=None,
+                            help='''Write a JSON summary of the metrics to this file ("-" for stderr) when the command finishes''')
+        parser.add_argument('--cache-stats', action='store_true', default=False,
+                            help='''Print the scrape cache's lookups and hit ratio by tier (memory, http, md) to stderr as JSON when the command finishes''')
+        parser.add_argument('--fetch-rate', type=float, default=None,
+                            help='''Maximum wiki requests per second, per process; 0 for no limit. Default: $FACTORYTOWN_FETCH_RATE, or 20 (no limit for load-test)''')
+        parser.add_argument('--fetch-concurrency', type=int, default=None,
+                            help='''Maximum concurrent wiki requests, per process. The scheduler adapts up to this limit, backing off on 429/503 responses and rising latency. Default: $FACTORYTOWN_FETCH_CONCURRENCY, or 32''')
         parser.set_defaults(func=self.cmd_bare, subparser=parser)
 
         subparsers = parser.add_subparsers(
@@ -162,8 +698,361 @@ class CommandHandler:
                                 description='''Scrape the Factory Tow wiki for the entire model.''')
         sp.add_argument("--force", "-f", action="store_true",
                             help="Force refresh of cache")
+        sp.add_argument("--jobs", "-j", type=int, default=1,
+                            help="Number of worker processes for page scrapers. 0 uses the CPU count. Default: 1")
         sp.set_defaults(func=self.cmd_scrape, subparser=sp)
 
+        # ======================= crawl
+
+        sp = subparsers.add_parser('crawl',
+                                description='''Scrape the model, then crawl the per-item and per-building pages it links to for recipes, work units and items.''')
+        sp.add_argument("--force", "-f", action="store_true",
+                            help="Force refresh of cache")
+        sp.add_argument("--jobs", "-j", type=int, default=1,
+                            help="Number of worker processes for the initial page scrapers. 0 uses the CPU count. Default: 1")
+        sp.add_argument("--crawl-jobs", type=int, default=8,
+                            help="Number of pages fetched and parsed at once. Default: 8")
+        sp.add_argument("--max-pages", type=int, default=None,
+                            help="Stop after fetching this many pages. Default: unlimited")
+        sp.add_argument("--snapshot", default=None,
+                            help="Save the crawled model as a snapshot to this file.")
+        sp.add_argument("--json", action="store_true",
+                            help="Print the crawl results as JSON instead of the model.")
+        sp.set_defaults(func=self.cmd_crawl, subparser=sp)
+
+        # ======================= sweep
+
+        sp = subparsers.add_parser('sweep',
+                                description='''Evaluate a JSON list of planning scenarios in parallel, writing one JSON result per line.''')
+        sp.add_argument("--force", "-f", action="store_true",
+                            help="Force refresh of cache")
+        sp.add_argument("--jobs", "-j", type=int, default=None,
+                            help="Number of worker processes. Default: CPU count")
+        sp.add_argument("scenarios_file",
+                            help="JSON file containing a list of scenarios")
+        sp.set_defaults(func=self.cmd_sweep, subparser=sp)
+
+        # ======================= layout
+
+        sp = subparsers.add_parser('layout',
+                                description='''Pack a set of buildings onto a bounded grid using their footprints.''')
+        sp.add_argument("--force", "-f", action="store_true",
+                            help="Force refresh of cache")
+        sp.add_argument("--width", "-W", type=int, required=True,
+                            help="Grid width")
+        sp.add_argument("--height", "-H", type=int, required=True,
+                            help="Grid height")
+        sp.add_argument("--heuristic", default="top-left", choices=["top-left", "contact"],
+                            help="Placement heuristic. Default: top-left")
+        sp.add_argument("--no-rotate", action="store_true",
+                            help="Do not rotate buildings")
+        sp.add_argument("--starts", type=int, default=8,
+                            help="Number of local search starts. Default: 8")
+        sp.add_argument("--iterations", type=int, default=200,
+                            help="Local search moves per start. Default: 200")
+        sp.add_argument("--seed", type=int, default=0,
+                            help="Random seed. Default: 0")
+        sp.add_argument("--jobs", "-j", type=int, default=1,
+                            help="Number of worker processes for the local search. Default: 1")
+        sp.add_argument("--ascii", action="store_true",
+                            help="Print the layout as an ASCII grid instead of JSON")
+        sp.add_argument("buildings", nargs="+",
+                            help="Building names, optionally suffixed with ':<count>'")
+        sp.set_defaults(func=self.cmd_layout, subparser=sp)
+
+        # ======================= research-plan
+
+        sp = subparsers.add_parser('research-plan',
+                                description='''Find a research order that unlocks a building, recipe or item, choosing each item's recipe greedily (not guaranteed minimal).''')
+        sp.add_argument("--force", "-f", action="store_true",
+                            help="Force refresh of cache")
+        sp.add_argument("--researched", "-r", action="append", default=[],
+                            help="A research that is already done. May be repeated")
+        sp.add_argument("--research-data", default=None,
+                            help='JSON file with optional "costs" ({research: cost}) and "prerequisites" ({research: [research, ...]})')
+        sp.add_argument("target",
+                            help="The record name of the building, recipe or item to unlock")
+        sp.set_defaults(func=self.cmd_research_plan, subparser=sp)
+
+        # ======================= valuate
+
+        sp = subparsers.add_parser('valuate',
+                                description='''Rank the coin yield of selling items at markets, per unit sold, per upstream work unit or per upstream raw input.''')
+        sp.add_argument("--force", "-f", action="store_true",
+                            help="Force refresh of cache")
+        sp.add_argument("--prices", required=True,
+                            help='JSON price file: {market: {item: {coin color: amount}}}')
+        sp.add_argument("--per", default="unit", choices=["unit", "work", "raw"],
+                            help="Yield measure to rank by. Default: unit")
+        sp.add_argument("--coin", default=None,
+                            help="Only rank yields in this coin color")
+        sp.add_argument("--market", default=None,
+                            help="Only rank yields at this market")
+        sp.add_argument("--top", type=int, default=None,
+                            help="Only show the best N entries")
+        sp.set_defaults(func=self.cmd_valuate, subparser=sp)
+
+        # ======================= snapshot
+
+        sp = subparsers.add_parser('snapshot',
+                                description='''Scrape the model and save it to a JSON snapshot file for later diffing.''')
+        sp.add_argument("--force", "-f", action="store_true",
+                            help="Force refresh of cache")
+        sp.add_argument("output",
+                            help="The snapshot file to write")
+        sp.set_defaults(func=self.cmd_snapshot, subparser=sp)
+
+        # ======================= diff
+
+        sp = subparsers.add_parser('diff',
+                                description='''Compare two model snapshots, or a snapshot and the current scraped model, and print the differences as JSON.''')
+        sp.add_argument("--force", "-f", action="store_true",
+                            help="Force refresh of cache when scraping the current model")
+        sp.add_argument("--exit-code", action="store_true",
+                            help="Exit with status 1 if there are differences")
+        sp.add_argument("old",
+                            help="The old snapshot file")
+        sp.add_argument("new", nargs="?", default=None,
+                            help="The new snapshot file. Default: the current scraped model")
+        sp.set_defaults(func=self.cmd_diff, subparser=sp)
+
+        # ======================= export
+
+        sp = subparsers.add_parser('export',
+                                description='''Export every model record with a fixed set of columns per record class, as NDJSON, NumPy .npz arrays or Arrow IPC tables.''')
+        sp.add_argument("--format", choices=["ndjson", "npz", "arrow"], default="ndjson",
+                            help="ndjson: one JSON object per record. npz: one typed array per class and column (requires numpy). arrow: one <class>.arrow file per class in the output directory (requires pyarrow). Default: ndjson")
+        sp.add_argument("--output", "-o", default=None,
+                            help="The output file (a directory for arrow). Default for ndjson: stdout")
+        sp.add_argument("--class", dest="record_class", action="append", default=[],
+                            help="Only export records of this class (e.g., Recipe). May be repeated.")
+        sp.add_argument("--snapshot", default=None,
+                            help="Export a model snapshot file instead of scraping.")
+        sp.add_argument("--force", "-f", action="store_true",
+                            help="Force refresh of cache")
+        sp.set_defaults(func=self.cmd_export, subparser=sp)
+
+        # ======================= assets
+
+        sp = subparsers.add_parser('assets',
+                                description='''Manage the deduplicating store of wiki images.''')
+        sp.set_defaults(func=self.cmd_bare, subparser=sp)
+        asset_subparsers = sp.add_subparsers(
+                            title='Asset commands',
+                            description='Valid asset commands',
+                            help='Additional help available with "factorytown assets <command> -h"')
+
+        asp = asset_subparsers.add_parser('sync',
+                                description='''Download the images of every game object in the model, at each original and thumbnail URL the wiki's pages use for them, that are not already stored, concurrently, storing each distinct content once by content hash.''')
+        asp.add_argument("--jobs", "-j", type=int, default=8,
+                            help="Number of concurrent downloads. Default: 8")
+        asp.add_argument("--force", "-f", action="store_true",
+                            help="Download images even if they are already stored")
+        asp.add_argument("--store", default=None,
+                            help="The asset store directory. Default: assets in the scrape cache directory")
+        asp.add_argument("--snapshot", default=None,
+                            help="Take image names from a model snapshot file instead of scraping.")
+        asp.add_argument("--json", action="store_true",
+                            help="Print the results as JSON.")
+        asp.set_defaults(func=self.cmd_assets_sync, subparser=asp)
+
+        # ======================= check-tables
+
+        sp = subparsers.add_parser('check-tables',
+                                description='''Compare every table parser backend against wikitextparser on every cached page, and benchmark them.''')
+        sp.add_argument("--repeat", type=int, default=5,
+                            help="Number of times to parse each page when benchmarking. Default: 5")
+        sp.set_defaults(func=self.cmd_check_tables, subparser=sp)
+
+        # ======================= bench
+
+        sp = subparsers.add_parser('bench',
+                                description='''Time each scraping stage offline against recorded wiki page fixtures, optionally comparing with a saved baseline.''')
+        sp.add_argument("--repeat", "-n", type=int, default=20,
+                            help="Number of timed samples per stage. Default: 20")
+        sp.add_argument("--warmup", type=int, default=1,
+                            help="Number of untimed runs per stage before sampling. Default: 1")
+        sp.add_argument("--stage", "-s", action="append", default=[],
+                            help="Only run stages whose name contains this string. May be repeated.")
+        sp.add_argument("--registry-size", type=int, default=2000,
+                            help="Number of record names used by the registry stages. Default: 2000")
+        sp.add_argument("--baseline", "-b", default=None,
+                            help="A report saved with --save-baseline. Exits with 1 if any stage is slower than the baseline by more than the tolerance.")
+        sp.add_argument("--save-baseline", default=None,
+                            help="Save the report to this file, for use with --baseline.")
+        sp.add_argument("--tolerance", type=float, default=0.25,
+                            help="Allowed slowdown relative to the baseline, as a fraction. Default: 0.25")
+        sp.add_argument("--statistic", default="p50", choices=["min", "p50", "p90", "p99", "mean"],
+                            help="The statistic compared with the baseline. Default: p50")
+        sp.add_argument("--json", action="store_true",
+                            help="Print the report as JSON.")
+        sp.set_defaults(func=self.cmd_bench, subparser=sp)
+
+        # ======================= bench-scale
+
+        sp = subparsers.add_parser('bench-scale',
+                                description='''Measure time and memory of page parsing, scraping and model operations on synthetic data of increasing size.''')
+        sp.add_argument("--sizes", default="1000,10000,100000",
+                            help="Comma-separated sizes: building rows on the synthetic Buildings page, and items in the synthetic model. Default: 1000,10000,100000")
+        sp.add_argument("--repeat", "-n", type=int, default=1,
+                            help="Number of timed runs per stage; the best is reported. Default: 1")
+        sp.add_argument("--depth", type=int, default=12,
+                            help="Depth of the synthetic recipe DAG. Default: 12")
+        sp.add_argument("--max-ingredients", type=int, default=2,
+                            help="Maximum ingredients per synthetic recipe. Default: 2")
+        sp.add_argument("--seed", type=int, default=0,
+                            help="Random seed for the synthetic data. Default: 0")
+        sp.add_argument("--stage", "-s", action="append", default=[],
+                            help="Only run stages whose name contains this string. May be repeated.")
+        sp.add_argument("--json", action="store_true",
+                            help="Print one JSON object per result.")
+        sp.set_defaults(func=self.cmd_bench_scale, subparser=sp)
+
+        # ======================= bench-startup
+
+        sp = subparsers.add_parser('bench-startup',
+                                description='''Measure CLI startup import time with python -X importtime, and fail if it exceeds a budget or imports heavy packages.''')
+        sp.add_argument("--command", "-c", action="append", default=[],
+                            help="A factorytown command line to measure, e.g. 'version'. May be repeated. Default: 'version' and 'scrape --help'")
+        sp.add_argument("--repeat", "-n", type=int, default=5,
+                            help="Number of runs per command; the median import time is used. Default: 5")
+        sp.add_argument("--budget-ms", type=float, default=100.0,
+                            help="Maximum factorytown import time per command, in milliseconds. Default: 100")
+        sp.add_argument("--top", type=int, default=10,
+                            help="Number of most expensive imports to show per command. Default: 10")
+        sp.add_argument("--json", action="store_true",
+                            help="Print the results as JSON.")
+        sp.set_defaults(func=self.cmd_bench_startup, subparser=sp)
+
+        # ======================= synth-page
+
+        sp = subparsers.add_parser('synth-page',
+                                description='''Print a synthetic page in the format of the wiki's Buildings page.''')
+        sp.add_argument("--buildings", type=int, default=1000,
+                            help="Number of building rows. Default: 1000")
+        sp.add_argument("--items", type=int, default=100,
+                            help="Number of distinct ingredient items. Default: 100")
+        sp.add_argument("--research", type=int, default=20,
+                            help="Number of distinct researches. Default: 20")
+        sp.add_argument("--seed", type=int, default=0,
+                            help="Random seed. Default: 0")
+        sp.set_defaults(func=self.cmd_synth_page, subparser=sp)
+
+        # ======================= replay-server
+
+        def add_replay_arguments(sp: argparse.ArgumentParser):
+            sp.add_argument("--latency", type=float, default=0.0,
+                                help="Seconds to delay each response. Default: 0")
+            sp.add_argument("--latency-jitter", type=float, default=0.0,
+                                help="Up to this many seconds are added to each delay, at random. Default: 0")
+            sp.add_argument("--bandwidth", type=float, default=None,
+                                help="Maximum bytes per second for each response body. Default: unlimited")
+            sp.add_argument("--throttle-rate", type=float, default=0.0,
+                                help="Fraction of requests answered with 429 Too Many Requests. Default: 0")
+            sp.add_argument("--error-rate", type=float, default=0.0,
+                                help="Fraction of requests answered with a 500, 502 or 503 error. Default: 0")
+            sp.add_argument("--retry-after", type=float, default=1.0,
+                                help="Retry-After seconds sent with 429 and 503 responses. Default: 1")
+            sp.add_argument("--seed", type=int, default=None,
+                                help="Random seed for delays and injected faults. Default: unseeded")
+            sp.add_argument("--cache-dir", default=None,
+                                help="An HTTP scrape cache directory to replay pages from, in addition to the recorded fixtures, "
+                                     "or \"\" for none. Default: data/cache/scrape/http in the project (or $FACTORYTOWN_CACHE_DIR/http)")
+
+        sp = subparsers.add_parser('replay-server',
+                                description='''Serve recorded wiki pages locally, with injected latency and errors, until interrupted.''')
+        add_replay_arguments(sp)
+        sp.add_argument("--port", type=int, default=8080,
+                            help="The port to listen on. Default: 8080")
+        sp.set_defaults(func=self.cmd_replay_server, subparser=sp)
+
+        # ======================= load-test
+
+        sp = subparsers.add_parser('load-test',
+                                description='''Fetch pages concurrently from a local replay server, with injected latency and errors, and report throughput.''')
+        add_replay_arguments(sp)
+        sp.add_argument("--requests", "-n", type=int, default=200,
+                            help="Total number of page fetches. Default: 200")
+        sp.add_argument("--concurrency", "-c", type=int, default=8,
+                            help="Number of concurrent fetching threads. Default: 8")
+        sp.add_argument("--page", "-p", action="append", default=[],
+                            help="A page to fetch. May be repeated. Default: the recorded fixture pages")
+        sp.add_argument("--scrape", action="store_true",
+                            help="Also scrape the model end to end from the replay server. Skipped unless the extraction tool is built.")
+        sp.add_argument("--jobs", "-j", type=int, default=1,
+                            help="Worker processes for --scrape. Default: 1")
+        sp.add_argument("--min-throughput", type=float, default=None,
+                            help="Exit with status 1 if fewer successful requests per second than this are made.")
+        sp.add_argument("--json", action="store_true",
+                            help="Print the results as JSON.")
+        sp.set_defaults(func=self.cmd_load_test, subparser=sp)
+
+        # ======================= serve
+
+        sp = subparsers.add_parser('serve',
+                                description='''Load the model once and answer JSON queries on it over HTTP on a local port, reloading it when the scrape cache or snapshot changes.''')
+        sp.add_argument("--host", default="127.0.0.1",
+                            help="The address to listen on. Default: 127.0.0.1")
+        sp.add_argument("--port", type=int, default=8765,
+                            help="The port to listen on. Default: 8765")
+        sp.add_argument("--snapshot", default=None,
+                            help="Serve a model snapshot file instead of scraping from the cache.")
+        sp.add_argument("--force", "-f", action="store_true",
+                            help="Force refresh of cache on the first load")
+        sp.add_argument("--jobs", "-j", type=int, default=1,
+                            help="Worker processes for scraping. 0 means one per CPU. Default: 1")
+        sp.add_argument("--cache-size", type=int, default=4096,
+                            help="Number of query results to cache. Default: 4096")
+        sp.add_argument("--reload-interval", type=float, default=2.0,
+                            help="Seconds between checks for changes to the model source; 0 disables reloading. Default: 2")
+        sp.set_defaults(func=self.cmd_serve, subparser=sp)
+
+        # ======================= query
+
+        sp = subparsers.add_parser('query',
+                                description='''Query the model: from a running `factorytown serve` if --server or FACTORYTOWN_SERVER is set, otherwise by loading the model in-process.''')
+        sp.add_argument("op", choices=["record", "records", "tags", "classes", "chain", "requirements", "status"],
+                            help="The query to make.")
+        sp.add_argument("names", nargs="*",
+                            help="Record names for record and chain; name[:rate] targets for requirements.")
+        sp.add_argument("--class", dest="record_class", default=None,
+                            help="For records: only records of this class (e.g., Item).")
+        sp.add_argument("--tag", default=None,
+                            help="For records: only records with this tag.")
+        sp.add_argument("--prefix", default=None,
+                            help="For records: only names starting with this string.")
+        sp.add_argument("--depth", type=int, default=6,
+                            help="For chain: maximum number of recipes deep to expand. Default: 6")
+        sp.add_argument("--tech-level", type=int, default=None,
+                            help="For requirements: the highest tech level that may be used.")
+        sp.add_argument("--exclude", action="append", default=[],
+                            help="For requirements: a building that may not be used. May be repeated.")
+        sp.add_argument("--server", default=None,
+                            help="URL of a running `factorytown serve`. Default: $FACTORYTOWN_SERVER")
+        sp.add_argument("--snapshot", default=None,
+                            help="Without a server: query a model snapshot file instead of scraping from the cache.")
+        sp.add_argument("--force", "-f", action="store_true",
+                            help="Without a server: force refresh of cache")
+        sp.set_defaults(func=self.cmd_query, subparser=sp)
+
+        # ======================= batch
+
+        sp = subparsers.add_parser('batch',
+                                description='''Load the model once, read JSON queries (as for `query`, e.g. {"op": "record", "name": "Farm"}) from stdin one per line, and write one JSON response per line to stdout.''')
+        sp.add_argument("--unordered", action="store_true",
+                            help="Write responses as they complete rather than in input order. Each response has the input line's index, and its id if the query has one.")
+        sp.add_argument("--jobs", "-j", type=int, default=1,
+                            help="Worker processes (or threads, with a server). 0 means one per CPU. With 1, each line is answered as soon as it is read. Default: 1")
+        sp.add_argument("--chunk-size", type=int, default=64,
+                            help="Lines sent to a worker per task when --jobs is not 1. Default: 64")
+        sp.add_argument("--server", default=None,
+                            help="URL of a running `factorytown serve`. Default: $FACTORYTOWN_SERVER")
+        sp.add_argument("--snapshot", default=None,
+                            help="Without a server: query a model snapshot file instead of scraping from the cache.")
+        sp.add_argument("--force", "-f", action="store_true",
+                            help="Without a server: force refresh of cache")
+        sp.set_defaults(func=self.cmd_batch, subparser=sp)
+
         # ======================= test
 
         sp = subparsers.add_parser('test',
@@ -197,9 +1086,26 @@ class CommandHandler:
                 level=log_level,
             )
             self._args = args
+            if args.md_backend is not None:
+                from ..mdparse import set_default_table_parser_backend
+                set_default_table_parser_backend(args.md_backend)
+            # Passed by environment so scrape worker processes get the same limits.
+            if args.fetch_rate is not None:
+                os.environ['FACTORYTOWN_FETCH_RATE'] = f"{args.fetch_rate:g}"
+            if args.fetch_concurrency is not None:
+                os.environ['FACTORYTOWN_FETCH_CONCURRENCY'] = str(args.fetch_concurrency)
             func: Callable[[], int] = args.func
             logging.debug(f"Running command {func.__name__}, tb = {traceback}")
-            rc = func()
+            self._start_profiling()
+            self._start_metrics()
+            try:
+                rc = func()
+            finally:
+                self._finish_profiling()
+                self._finish_metrics()
+                if args.cache_stats:
+                    from ..raw_scrape.fandom_scrape import get_scrape_cache_stats
+                    print(json.dumps(get_scrape_cache_stats(), indent=2), file=sys.stderr)
             logging.debug(f"Command {func.__name__} returned {rc}")
         except Exception as ex:
             is_exit_error = isinstance(ex, CmdExitError)
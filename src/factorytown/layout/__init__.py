@@ -0,0 +1,20 @@
+from .occupancy import OccupancyGrid
+from .packer import (
+    Footprint,
+    Placement,
+    PlacementHeuristic,
+    TopLeftHeuristic,
+    ContactHeuristic,
+    HEURISTICS,
+    Layout,
+    LayoutPacker,
+    building_footprints,
+    optimize_layout,
+)
+from .routing import (
+    GridRouter,
+    RouterStats,
+    UNREACHABLE,
+    placement_keys,
+    recipe_edges,
+)
@@ -0,0 +1,97 @@
+from ..internal_types import *
+
+class OccupancyGrid:
+    """A bounded grid of occupied/free cells, stored as one Python int bitset per row.
+
+       Bit x of rows[y] is set if cell (x, y) is occupied. Checking or updating a w x h rectangle costs
+       one masked AND/OR per row, independent of w.
+    """
+    width: int
+    height: int
+    rows: List[int]
+    _full: int
+
+    def __init__(self, width: int, height: int, rows: Optional[List[int]]=None):
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Grid dimensions must be positive, got {width}x{height}")
+        self.width = width
+        self.height = height
+        self._full = (1 << width) - 1
+        self.rows = [0] * height if rows is None else list(rows)
+        assert len(self.rows) == height
+
+    def copy(self) -> 'OccupancyGrid':
+        return OccupancyGrid(self.width, self.height, self.rows)
+
+    def in_bounds(self, x: int, y: int, w: int=1, h: int=1) -> bool:
+        return x >= 0 and y >= 0 and x + w <= self.width and y + h <= self.height
+
+    def is_occupied(self, x: int, y: int) -> bool:
+        return (self.rows[y] >> x) & 1 == 1
+
+    def fits(self, x: int, y: int, w: int, h: int) -> bool:
+        """Returns True if the w x h rectangle at (x, y) is in bounds and entirely free."""
+        if not self.in_bounds(x, y, w, h):
+            return False
+        mask = ((1 << w) - 1) << x
+        rows = self.rows
+        for yy in range(y, y + h):
+            if rows[yy] & mask:
+                return False
+        return True
+
+    def fill(self, x: int, y: int, w: int, h: int):
+        """Marks the w x h rectangle at (x, y) occupied. The rectangle must fit."""
+        assert self.fits(x, y, w, h)
+        mask = ((1 << w) - 1) << x
+        for yy in range(y, y + h):
+            self.rows[yy] |= mask
+
+    def clear(self, x: int, y: int, w: int, h: int):
+        """Marks the w x h rectangle at (x, y) free."""
+        assert self.in_bounds(x, y, w, h)
+        mask = ~(((1 << w) - 1) << x)
+        for yy in range(y, y + h):
+            self.rows[yy] &= mask
+
+    def free_starts(self, y: int, w: int, h: int) -> int:
+        """Returns a bitset of the x positions at which a w x h rectangle with top row y fits."""
+        if w > self.width or y < 0 or y + h > self.height:
+            return 0
+        occupied = 0
+        for yy in range(y, y + h):
+            occupied |= self.rows[yy]
+        starts = ~occupied & self._full
+        # Shift-and-AND by doubling run lengths: after this, bit x is set iff bits x..x+w-1 were all free.
+        run = 1
+        while run < w:
+            step = min(run, w - run)
+            starts &= starts >> step
+            run += step
+        return starts & ((1 << (self.width - w + 1)) - 1)
+
+    def occupied_count(self) -> int:
+        return sum(row.bit_count() for row in self.rows)
+
+    def bounding_box(self) -> Optional[Tuple[int, int, int, int]]:
+        """Returns (x, y, w, h) of the smallest rectangle containing all occupied cells, or None if empty."""
+        used = [y for y, row in enumerate(self.rows) if row]
+        if len(used) == 0:
+            return None
+        combined = 0
+        for y in used:
+            combined |= self.rows[y]
+        x0 = (combined & -combined).bit_length() - 1
+        x1 = combined.bit_length()
+        return (x0, used[0], x1 - x0, used[-1] - used[0] + 1)
+
+    def to_ascii(self, occupied: str="#", free: str=".") -> str:
+        return "\n".join(
+            "".join(occupied if (row >> x) & 1 else free for x in range(self.width)) for row in self.rows
+          )
+
+    def __str__(self):
+        return f"OccupancyGrid({self.width}x{self.height}, occupied={self.occupied_count()})"
+
+    def __repr__(self):
+        return str(self)
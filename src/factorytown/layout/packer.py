@@ -0,0 +1,306 @@
+from ..internal_types import *
+from ..model import FactoryTownModel, Building, GridDim
+from .occupancy import OccupancyGrid
+
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+import random
+
+logger = getLogger(__name__)
+
+class Footprint(NamedTuple):
+    """A named rectangle to be placed on the grid."""
+    name: str
+    size: GridDim
+
+class Placement(NamedTuple):
+    """A footprint placed at (x, y), the top-left cell. w and h are after any rotation."""
+    name: str
+    x: int
+    y: int
+    w: int
+    h: int
+    rotated: bool = False
+
+    @property
+    def size(self) -> GridDim:
+        return GridDim(self.w, self.h)
+
+    def to_jsonable(self) -> JsonableDict:
+        return dict(name=self.name, x=self.x, y=self.y, w=self.w, h=self.h, rotated=self.rotated)
+
+class PlacementHeuristic:
+    """Chooses where on a grid to put the next w x h rectangle. Subclasses override find_position."""
+
+    def find_position(self, grid: OccupancyGrid, w: int, h: int) -> Optional[Tuple[int, int]]:
+        raise NotImplementedError()
+
+    def __str__(self):
+        return self.__class__.__name__
+
+class TopLeftHeuristic(PlacementHeuristic):
+    """Places each rectangle at the free position with the lowest y, then the lowest x."""
+
+    def find_position(self, grid: OccupancyGrid, w: int, h: int) -> Optional[Tuple[int, int]]:
+        for y in range(grid.height - h + 1):
+            starts = grid.free_starts(y, w, h)
+            if starts:
+                return ((starts & -starts).bit_length() - 1, y)
+        return None
+
+class ContactHeuristic(PlacementHeuristic):
+    """Places each rectangle where it touches the most occupied cells or grid edges, which keeps
+       layouts compact. Ties go to the lowest y, then the lowest x."""
+
+    def find_position(self, grid: OccupancyGrid, w: int, h: int) -> Optional[Tuple[int, int]]:
+        if w > grid.width or h > grid.height:
+            return None
+        best: Optional[Tuple[int, int, int]] = None
+        rows = grid.rows
+        full = (1 << grid.width) - 1
+        for y in range(grid.height - h + 1):
+            # Only positions that touch a wall or an occupied cell on some side are scored. This loses
+            # nothing: a free position touching nothing can slide left until it touches something, staying
+            # free, so some touching position always scores at least as high.
+            side = 0
+            for yy in range(y, y + h):
+                side |= rows[yy]
+            left_blocked = (side << 1) | 1
+            right_blocked = (side >> w) | (1 << (grid.width - w))
+            top_blocked = full if y == 0 else self._spread(rows[y - 1], w)
+            bottom_blocked = full if y + h == grid.height else self._spread(rows[y + h], w)
+            starts = grid.free_starts(y, w, h) & (left_blocked | right_blocked | top_blocked | bottom_blocked)
+            while starts:
+                low = starts & -starts
+                x = low.bit_length() - 1
+                starts ^= low
+                score = self._contact(grid, x, y, w, h)
+                if best is None or score > best[0]:
+                    best = (score, x, y)
+        return None if best is None else (best[1], best[2])
+
+    @staticmethod
+    def _spread(row: int, w: int) -> int:
+        """Sets bit x wherever any of bits x..x+w-1 of row is set."""
+        spread = row
+        covered = 1
+        while covered < w:
+            step = min(covered, w - covered)
+            spread |= spread >> step
+            covered += step
+        return spread
+
+    @staticmethod
+    def _contact(grid: OccupancyGrid, x: int, y: int, w: int, h: int) -> int:
+        rows = grid.rows
+        span = ((1 << w) - 1) << x
+        score = 0
+        score += w if y == 0 else (rows[y - 1] & span).bit_count()
+        score += w if y + h == grid.height else (rows[y + h] & span).bit_count()
+        for yy in range(y, y + h):
+            score += 1 if x == 0 else (rows[yy] >> (x - 1)) & 1
+            score += 1 if x + w == grid.width else (rows[yy] >> (x + w)) & 1
+        return score
+
+HEURISTICS: Dict[str, Type[PlacementHeuristic]] = {
+    "top-left": TopLeftHeuristic,
+    "contact": ContactHeuristic,
+}
+
+class Layout(NamedTuple):
+    """The result of packing a set of footprints onto a grid."""
+    width: int
+    height: int
+    placements: List[Placement]
+    unplaced: List[Footprint]
+    grid: OccupancyGrid
+
+    @property
+    def score(self) -> Tuple[int, int]:
+        """A sort key where larger is better: (placed area, -bounding box area)."""
+        placed_area = sum(p.w * p.h for p in self.placements)
+        bbox = self.grid.bounding_box()
+        bbox_area = 0 if bbox is None else bbox[2] * bbox[3]
+        return (placed_area, -bbox_area)
+
+    def to_ascii(self) -> str:
+        cells = [["."] * self.width for _ in range(self.height)]
+        for i, p in enumerate(self.placements):
+            mark = chr(ord("A") + i % 26)
+            for yy in range(p.y, p.y + p.h):
+                for xx in range(p.x, p.x + p.w):
+                    cells[yy][xx] = mark
+        return "\n".join("".join(row) for row in cells)
+
+    def to_jsonable(self) -> JsonableDict:
+        return dict(
+            width=self.width,
+            height=self.height,
+            placements=[p.to_jsonable() for p in self.placements],
+            unplaced=[dict(name=f.name, size=str(f.size)) for f in self.unplaced],
+          )
+
+class LayoutPacker:
+    """Packs footprints onto a bounded grid, one at a time, using a placement heuristic."""
+    width: int
+    height: int
+    heuristic: PlacementHeuristic
+    allow_rotation: bool
+
+    def __init__(self, width: int, height: int, heuristic: Optional[PlacementHeuristic]=None, allow_rotation: bool=True):
+        self.width = width
+        self.height = height
+        self.heuristic = TopLeftHeuristic() if heuristic is None else heuristic
+        self.allow_rotation = allow_rotation
+
+    def place_one(self, grid: OccupancyGrid, footprint: Footprint, prefer_rotated: bool=False) -> Optional[Placement]:
+        """Places a single footprint on the grid, updating the grid. Returns None if it does not fit."""
+        w, h = footprint.size
+        orientations = [(w, h, False)]
+        if self.allow_rotation and w != h:
+            orientations.append((h, w, True))
+            if prefer_rotated:
+                orientations.reverse()
+        for ow, oh, rotated in orientations:
+            pos = self.heuristic.find_position(grid, ow, oh)
+            if pos is not None:
+                x, y = pos
+                grid.fill(x, y, ow, oh)
+                return Placement(footprint.name, x, y, ow, oh, rotated)
+        return None
+
+    def pack(
+            self,
+            footprints: Iterable[Footprint],
+            *,
+            presorted: bool=False,
+            rotations: Optional[Sequence[bool]]=None,
+            grid: Optional[OccupancyGrid]=None,
+          ) -> Layout:
+        """Packs footprints onto the grid.
+
+        Args:
+            footprints: The footprints to place.
+            presorted: If False (the default), footprints are placed largest area first.
+            rotations: Optional per-footprint preference for trying the rotated orientation first.
+            grid: Optional starting grid with pre-occupied cells. Not modified.
+
+        Returns:
+            Layout: The placed and unplaced footprints.
+        """
+        items = list(footprints)
+        if not presorted:
+            items.sort(key=lambda f: (-f.size.w * f.size.h, f.name))
+        grid = OccupancyGrid(self.width, self.height) if grid is None else grid.copy()
+        placements: List[Placement] = []
+        unplaced: List[Footprint] = []
+        for i, footprint in enumerate(items):
+            prefer_rotated = False if rotations is None else rotations[i]
+            placement = self.place_one(grid, footprint, prefer_rotated)
+            if placement is None:
+                unplaced.append(footprint)
+            else:
+                placements.append(placement)
+        return Layout(self.width, self.height, placements, unplaced, grid)
+
+def building_footprints(model: FactoryTownModel, building_names: Iterable[str]) -> List[Footprint]:
+    """Returns the footprints of the named buildings, from Building.grid_size. Repeat a name to place it
+       more than once."""
+    result: List[Footprint] = []
+    for name in building_names:
+        building = model.records.try_get(name, Building)
+        if building is None:
+            raise FactoryTownError(f"Building {name!r} does not exist in the model")
+        result.append(Footprint(name, building.grid_size))
+    return result
+
+def _local_search(
+        packer: LayoutPacker,
+        footprints: List[Footprint],
+        seed: int,
+        iterations: int,
+      ) -> Layout:
+    """Searches over placement order and orientation preferences from one random start, keeping any
+       single swap or rotation flip that does not make the layout worse."""
+    rng = random.Random(seed)
+    order = list(footprints)
+    if seed != 0:
+        rng.shuffle(order)
+    else:
+        order.sort(key=lambda f: (-f.size.w * f.size.h, f.name))
+    rotations = [rng.random() < 0.5 for _ in order] if seed != 0 else [False] * len(order)
+    best = packer.pack(order, presorted=True, rotations=rotations)
+    n = len(order)
+    if n < 2:
+        return best
+    for _ in range(iterations):
+        i = rng.randrange(n)
+        if rng.random() < 0.5:
+            j = rng.randrange(n)
+            order[i], order[j] = order[j], order[i]
+            candidate = packer.pack(order, presorted=True, rotations=rotations)
+            if candidate.score >= best.score:
+                best = candidate
+            else:
+                order[i], order[j] = order[j], order[i]
+        else:
+            rotations[i] = not rotations[i]
+            candidate = packer.pack(order, presorted=True, rotations=rotations)
+            if candidate.score >= best.score:
+                best = candidate
+            else:
+                rotations[i] = not rotations[i]
+    return best
+
+def _local_search_task(args: Tuple[int, int, str, bool, List[Footprint], int, int]) -> Tuple[int, Layout]:
+    width, height, heuristic_name, allow_rotation, footprints, seed, iterations = args
+    packer = LayoutPacker(width, height, HEURISTICS[heuristic_name](), allow_rotation)
+    return seed, _local_search(packer, footprints, seed, iterations)
+
+def optimize_layout(
+        footprints: Iterable[Footprint],
+        width: int,
+        height: int,
+        *,
+        heuristic: str="top-left",
+        allow_rotation: bool=True,
+        starts: int=8,
+        iterations: int=200,
+        seed: int=0,
+        max_workers: Optional[int]=1,
+      ) -> Layout:
+    """Multi-start local search over packing order and orientation.
+
+       Start 0 is the deterministic largest-first packing; the others begin from random orders derived
+       from seed. Each start is improved independently, so starts can run across worker processes. The
+       best layout wins, with ties going to the lowest start, so the result does not depend on max_workers.
+
+    Args:
+        footprints: The footprints to place.
+        width, height: The grid dimensions.
+        heuristic: Name of a placement heuristic in HEURISTICS.
+        allow_rotation: Whether footprints may be rotated 90 degrees.
+        starts: Number of independent starts.
+        iterations: Number of local search moves per start.
+        seed: Base random seed.
+        max_workers: Number of worker processes. 1 (the default) runs in-process; None uses the CPU count.
+    """
+    if heuristic not in HEURISTICS:
+        raise FactoryTownError(f"Unknown placement heuristic {heuristic!r}; choose from {sorted(HEURISTICS)}")
+    items = list(footprints)
+    tasks = [
+        (width, height, heuristic, allow_rotation, items, 0 if i == 0 else seed * 1000003 + i, iterations)
+        for i in range(max(1, starts))
+      ]
+    if max_workers == 1:
+        results = [_local_search_task(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_local_search_task, tasks))
+    best: Optional[Layout] = None
+    for _, layout in results:
+        if best is None or layout.score > best.score:
+            best = layout
+    assert best is not None
+    logger.debug(f"Best layout score over {len(results)} starts: {best.score}")
+    return best
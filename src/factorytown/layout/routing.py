@@ -0,0 +1,374 @@
+from ..internal_types import *
+from ..model import FactoryTownModel, Recipe
+from .occupancy import OccupancyGrid
+from .packer import Layout, Placement
+
+from array import array
+from collections import deque
+from logging import getLogger
+import heapq
+
+logger = getLogger(__name__)
+
+UNREACHABLE = 1 << 30
+"""Distance value for cells that cannot reach the destination."""
+
+Cell = Tuple[int, int]
+"""An (x, y) grid cell."""
+
+class RouterStats(NamedTuple):
+    fields_computed: int
+    """Distance fields computed from scratch."""
+
+    field_hits: int
+    """Route requests answered from a cached distance field."""
+
+    fields_repaired: int
+    """Cached fields repaired in place after a building moved."""
+
+    fields_dropped: int
+    """Cached fields discarded because their destination moved."""
+
+    cells_reset: int
+    """Cells whose distances were recomputed during repairs."""
+
+class _DistanceField:
+    dist: array
+    seeds: Set[int]
+
+    def __init__(self, dist: array, seeds: Set[int]):
+        self.dist = dist
+        self.seeds = seeds
+
+class GridRouter:
+    """Routes conveyors between placed buildings on a grid.
+
+       Buildings are obstacles; routes run through free cells with 4-connected moves, from a free cell
+       next to the source building to a free cell next to the destination building.
+
+       For each destination (or set of destinations) the router caches a BFS distance field, so routing
+       many sources to the same hub is one BFS plus a downhill walk per route. When a building moves,
+       cached fields are repaired in place: only cells whose shortest path may have used a newly blocked
+       cell are reset and recomputed, and newly freed cells are relaxed outward. Fields whose destination
+       moved are discarded.
+    """
+    width: int
+    height: int
+    _blocked: bytearray
+    _terrain: bytearray
+    _placements: Dict[str, Placement]
+    _fields: Dict[Tuple[str, ...], _DistanceField]
+    _fields_computed: int = 0
+    _field_hits: int = 0
+    _fields_repaired: int = 0
+    _fields_dropped: int = 0
+    _cells_reset: int = 0
+
+    def __init__(
+            self,
+            width: int,
+            height: int,
+            placements: Optional[Mapping[str, Placement]]=None,
+            terrain: Optional[OccupancyGrid]=None,
+          ):
+        """Creates a router.
+
+        Args:
+            width, height: The grid dimensions.
+            placements: Buildings on the grid, by a unique key.
+            terrain: Optional grid of additional permanently blocked cells.
+        """
+        self.width = width
+        self.height = height
+        self._terrain = bytearray(width * height)
+        if terrain is not None:
+            assert terrain.width == width and terrain.height == height
+            for y, row in enumerate(terrain.rows):
+                for x in range(width):
+                    if (row >> x) & 1:
+                        self._terrain[y * width + x] = 1
+        self._blocked = bytearray(self._terrain)
+        self._placements = {}
+        self._fields = {}
+        if placements is not None:
+            for key, placement in placements.items():
+                self._add(key, placement)
+
+    @classmethod
+    def from_layout(cls, layout: Layout, terrain: Optional[OccupancyGrid]=None) -> Self:
+        """Creates a router for a packed layout, keyed by placement_keys(layout)."""
+        return cls(layout.width, layout.height, placement_keys(layout), terrain)
+
+    @property
+    def placements(self) -> Mapping[str, Placement]:
+        return self._placements
+
+    @property
+    def stats(self) -> RouterStats:
+        return RouterStats(
+            self._fields_computed, self._field_hits, self._fields_repaired, self._fields_dropped, self._cells_reset
+          )
+
+    def _cells(self, p: Placement) -> List[int]:
+        return [y * self.width + x for y in range(p.y, p.y + p.h) for x in range(p.x, p.x + p.w)]
+
+    def _add(self, key: str, placement: Placement):
+        if key in self._placements:
+            raise FactoryTownError(f"Building {key!r} is already placed")
+        if placement.x < 0 or placement.y < 0 or placement.x + placement.w > self.width or placement.y + placement.h > self.height:
+            raise FactoryTownError(f"Building {key!r} at {placement} is out of bounds")
+        cells = self._cells(placement)
+        if any(self._blocked[c] for c in cells):
+            raise FactoryTownError(f"Building {key!r} at {placement} overlaps an obstacle")
+        for c in cells:
+            self._blocked[c] = 1
+        self._placements[key] = placement
+
+    def _access_cells(self, placement: Placement) -> Set[int]:
+        """Free cells 4-adjacent to a building footprint."""
+        w, h = self.width, self.height
+        result: Set[int] = set()
+        for x in range(placement.x, placement.x + placement.w):
+            for y in (placement.y - 1, placement.y + placement.h):
+                if 0 <= y < h and not self._blocked[y * w + x]:
+                    result.add(y * w + x)
+        for y in range(placement.y, placement.y + placement.h):
+            for x in (placement.x - 1, placement.x + placement.w):
+                if 0 <= x < w and not self._blocked[y * w + x]:
+                    result.add(y * w + x)
+        return result
+
+    def _seeds(self, keys: Tuple[str, ...]) -> Set[int]:
+        seeds: Set[int] = set()
+        for key in keys:
+            seeds |= self._access_cells(self._placements[key])
+        return seeds
+
+    def _neighbors(self, c: int) -> Iterator[int]:
+        w = self.width
+        x = c % w
+        if x > 0:
+            yield c - 1
+        if x < w - 1:
+            yield c + 1
+        if c >= w:
+            yield c - w
+        if c + w < len(self._blocked):
+            yield c + w
+
+    def _bfs(self, seeds: Set[int]) -> array:
+        dist = array('i', [UNREACHABLE]) * (self.width * self.height)
+        blocked = self._blocked
+        queue = deque(sorted(seeds))
+        for c in queue:
+            dist[c] = 0
+        while queue:
+            c = queue.popleft()
+            d = dist[c] + 1
+            for n in self._neighbors(c):
+                if not blocked[n] and dist[n] > d:
+                    dist[n] = d
+                    queue.append(n)
+        return dist
+
+    def _field_key(self, destinations: str|Iterable[str]) -> Tuple[str, ...]:
+        keys = (destinations,) if isinstance(destinations, str) else tuple(sorted(set(destinations)))
+        for key in keys:
+            if key not in self._placements:
+                raise FactoryTownError(f"Unknown building {key!r}")
+        return keys
+
+    def distance_field(self, destinations: str|Iterable[str]) -> array:
+        """Returns the distance from every cell to the nearest access cell of any of the destinations, as
+           a flat array indexed by y * width + x. Blocked or unreachable cells hold UNREACHABLE. The result
+           is cached; do not modify it."""
+        keys = self._field_key(destinations)
+        field = self._fields.get(keys)
+        if field is None:
+            seeds = self._seeds(keys)
+            field = _DistanceField(self._bfs(seeds), seeds)
+            self._fields[keys] = field
+            self._fields_computed += 1
+        else:
+            self._field_hits += 1
+        return field.dist
+
+    def distance(self, source: str, destinations: str|Iterable[str]) -> Optional[int]:
+        """Returns the route length in cells from source to the nearest destination, or None if unreachable."""
+        dist = self.distance_field(destinations)
+        starts = self._access_cells(self._placements[source])
+        best = min((dist[c] for c in starts), default=UNREACHABLE)
+        return None if best >= UNREACHABLE else best + 1
+
+    def route(self, source: str, destinations: str|Iterable[str]) -> Optional[List[Cell]]:
+        """Returns the cells of a shortest route from a cell next to source to a cell next to the nearest
+           destination, or None if there is no route."""
+        dist = self.distance_field(destinations)
+        starts = self._access_cells(self._placements[source])
+        if len(starts) == 0:
+            return None
+        c = min(starts, key=lambda s: (dist[s], s))
+        if dist[c] >= UNREACHABLE:
+            return None
+        w = self.width
+        path = [c]
+        while dist[c] > 0:
+            c = min((n for n in self._neighbors(c) if dist[n] == dist[c] - 1))
+            path.append(c)
+        return [(c % w, c // w) for c in path]
+
+    def route_many(self, edges: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Optional[List[Cell]]]:
+        """Routes many (source, destination) edges. Edges sharing a destination share one distance field."""
+        return {(src, dst): self.route(src, dst) for src, dst in edges}
+
+    def add_building(self, key: str, placement: Placement):
+        """Adds a building, repairing cached distance fields."""
+        self._apply_change(key, None, placement, lambda: self._add(key, placement))
+
+    def remove_building(self, key: str):
+        """Removes a building, repairing cached distance fields."""
+        old = self._placements[key]
+        def change():
+            del self._placements[key]
+            for c in self._cells(old):
+                self._blocked[c] = self._terrain[c]
+        self._apply_change(key, old, None, change)
+
+    def move_building(self, key: str, x: int, y: int, rotated: Optional[bool]=None):
+        """Moves (and optionally rotates) a building, repairing cached distance fields."""
+        old = self._placements[key]
+        w, h = old.w, old.h
+        if rotated is not None and rotated != old.rotated:
+            w, h = h, w
+        new = Placement(old.name, x, y, w, h, old.rotated if rotated is None else rotated)
+        def change():
+            del self._placements[key]
+            for c in self._cells(old):
+                self._blocked[c] = self._terrain[c]
+            try:
+                self._add(key, new)
+            except FactoryTownError:
+                self._add(key, old)
+                raise
+        self._apply_change(key, old, new, change)
+
+    def _apply_change(self, key: str, old: Optional[Placement], new: Optional[Placement], change: Callable[[], None]):
+        candidates: Set[int] = set()
+        for p in (old, new):
+            if p is not None and p.x >= 0 and p.y >= 0 and p.x + p.w <= self.width and p.y + p.h <= self.height:
+                candidates.update(self._cells(p))
+        before = {c: self._blocked[c] for c in candidates}
+        change()
+        after = self._blocked
+        newly_blocked = sorted(c for c, b in before.items() if after[c] and not b)
+        newly_freed = sorted(c for c, b in before.items() if b and not after[c])
+        for keys in list(self._fields):
+            if key in keys:
+                del self._fields[keys]
+                self._fields_dropped += 1
+                continue
+            field = self._fields[keys]
+            if self._repair(field, self._seeds(keys), newly_blocked, newly_freed):
+                self._fields_repaired += 1
+
+    def _repair(self, field: _DistanceField, seeds: Set[int], newly_blocked: List[int], newly_freed: List[int]) -> bool:
+        """Repairs a distance field in place after cells changed. Returns False if it was unaffected."""
+        dist = field.dist
+        blocked = self._blocked
+        new_seeds = seeds - field.seeds
+        affected_blocks = [c for c in newly_blocked if dist[c] < UNREACHABLE]
+        affected_frees = [c for c in newly_freed if any(dist[n] < UNREACHABLE for n in self._neighbors(c))]
+        if len(affected_blocks) == 0 and len(affected_frees) == 0 and len(new_seeds) == 0 and seeds == field.seeds:
+            return False
+
+        # Distances can only increase for cells whose shortest path might pass through a newly blocked
+        # cell: those reachable from it by steps that increase the distance by exactly one.
+        reset: Set[int] = set()
+        stack = list(affected_blocks)
+        for c in affected_blocks:
+            reset.add(c)
+        while stack:
+            c = stack.pop()
+            d = dist[c] + 1
+            for n in self._neighbors(c):
+                if n not in reset and dist[n] == d:
+                    reset.add(n)
+                    stack.append(n)
+        for c in reset:
+            dist[c] = UNREACHABLE
+        for c in newly_freed:
+            dist[c] = UNREACHABLE
+        self._cells_reset += len(reset)
+
+        # Re-relax from the boundary of the reset region, the freed cells, and any new seeds.
+        heap: List[Tuple[int, int]] = [(0, c) for c in new_seeds]
+        for c in new_seeds:
+            dist[c] = 0
+        for c in seeds & reset:
+            dist[c] = 0
+            heap.append((0, c))
+        frontier: Set[int] = set()
+        for c in list(reset) + newly_freed:
+            for n in self._neighbors(c):
+                if not blocked[n] and dist[n] < UNREACHABLE:
+                    frontier.add(n)
+        heap.extend((dist[c], c) for c in frontier)
+        heapq.heapify(heap)
+        while heap:
+            d, c = heapq.heappop(heap)
+            if d > dist[c] or blocked[c]:
+                continue
+            for n in self._neighbors(c):
+                if not blocked[n] and dist[n] > d + 1:
+                    dist[n] = d + 1
+                    heapq.heappush(heap, (d + 1, n))
+        field.seeds = seeds
+        return True
+
+    def __str__(self):
+        return f"GridRouter({self.width}x{self.height}, buildings={len(self._placements)}, fields={len(self._fields)})"
+
+    def __repr__(self):
+        return str(self)
+
+def placement_keys(layout: Layout) -> Dict[str, Placement]:
+    """Assigns a unique key to each placement in a layout: the building name, with "#<n>" appended from the
+       second occurrence on."""
+    result: Dict[str, Placement] = {}
+    counts: Dict[str, int] = {}
+    for p in layout.placements:
+        n = counts.get(p.name, 0) + 1
+        counts[p.name] = n
+        result[p.name if n == 1 else f"{p.name}#{n}"] = p
+    return result
+
+def recipe_edges(model: FactoryTownModel, placements: Mapping[str, Placement]) -> List[Tuple[str, str]]:
+    """Returns the (producer key, consumer key) transport edges implied by the model's recipes: a placed
+       building that runs a recipe producing an item feeds every placed building that runs a recipe
+       consuming it. User recipes, which have no building, do not produce edges."""
+    keys_by_building: Dict[str, List[str]] = {}
+    for key, p in sorted(placements.items()):
+        keys_by_building.setdefault(p.name, []).append(key)
+    producers: Dict[str, Set[str]] = {}
+    consumers: Dict[str, Set[str]] = {}
+    for recipe in model.records.values(Recipe):
+        if recipe._building is None or isinstance(recipe._building, UnsetType):
+            continue
+        building_name = recipe._building.record_name
+        if building_name not in keys_by_building:
+            continue
+        if not isinstance(recipe._product_refs, UnsetType):
+            for product in recipe._product_refs:
+                producers.setdefault(product.obj_ref.record_name, set()).add(building_name)
+        if not isinstance(recipe._ingredient_refs, UnsetType):
+            for ingredient in recipe._ingredient_refs:
+                consumers.setdefault(ingredient.obj_ref.record_name, set()).add(building_name)
+    edges: Set[Tuple[str, str]] = set()
+    for item, producing in producers.items():
+        for consumer in consumers.get(item, ()):
+            for producer in producing:
+                for src in keys_by_building[producer]:
+                    for dst in keys_by_building[consumer]:
+                        if src != dst:
+                            edges.add((src, dst))
+    return sorted(edges)
@@ -4,3 +4,23 @@ from .mdparse import (
     WikiText,
     Table
 )
+from .table_tokenizer import (
+    TokenizedTable,
+    TemplateToken,
+    CellToken,
+    UnsupportedTableSyntax,
+    tokenize_tables,
+    parse_tables,
+    split_cell_templates,
+    compare_table_parsers,
+)
+from .backends import (
+    TableParserBackend,
+    TokenizerBackend,
+    WikitextparserBackend,
+    MwparserfromhellBackend,
+    TABLE_PARSER_BACKENDS,
+    MD_BACKEND_ENV_VAR,
+    get_table_parser_backend,
+    set_default_table_parser_backend,
+)
@@ -0,0 +1,93 @@
+from ..internal_types import *
+from .table_tokenizer import TokenizedTable, parse_tables
+
+import os
+import wikitextparser as wtp
+import mwparserfromhell
+
+MD_BACKEND_ENV_VAR = "FACTORYTOWN_MD_BACKEND"
+"""Environment variable that selects the default table parser backend. Setting it (rather than only a
+   module global) lets the choice carry over to scraper worker processes."""
+
+DEFAULT_MD_BACKEND = "tokenizer"
+
+class TableParserBackend:
+    """Extracts the top-level tables of a wikitext page. Every backend returns TokenizedTables, which is
+       the table interface TableReader and StreamingTableReader consume."""
+    name: str = ""
+
+    def parse_tables(self, markdown: str) -> List[TokenizedTable]:
+        raise NotImplementedError()
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.name!r})"
+
+    def __repr__(self):
+        return str(self)
+
+class TokenizerBackend(TableParserBackend):
+    """The fast single-pass tokenizer, falling back to wikitextparser for syntax it does not handle."""
+    name = "tokenizer"
+
+    def parse_tables(self, markdown: str) -> List[TokenizedTable]:
+        return parse_tables(markdown)
+
+class WikitextparserBackend(TableParserBackend):
+    """The pure-Python wikitextparser package."""
+    name = "wikitextparser"
+
+    def parse_tables(self, markdown: str) -> List[TokenizedTable]:
+        return [TokenizedTable.from_wikitextparser(t) for t in wtp.parse(markdown).tables if t.nesting_level == 0]
+
+class MwparserfromhellBackend(TableParserBackend):
+    """The mwparserfromhell package, which uses a C tokenizer when its extension is available."""
+    name = "mwparserfromhell"
+
+    def parse_tables(self, markdown: str) -> List[TokenizedTable]:
+        code = mwparserfromhell.parse(markdown)
+        tables: List[TokenizedTable] = []
+        for table in code.filter_tags(recursive=False, matches=lambda n: str(n.tag).strip().lower() == "table"):
+            # Cells before the first "|-" are direct children of the table rather than of a row.
+            rows: List[List[str]] = [[]]
+            caption: Optional[str] = None
+            for child in table.contents.filter_tags(recursive=False):
+                tag = str(child.tag).strip().lower()
+                if tag == "tr":
+                    rows.append([
+                        str(cell.contents) for cell in child.contents.filter_tags(recursive=False)
+                        if str(cell.tag).strip().lower() in ("td", "th")
+                      ])
+                elif tag in ("td", "th"):
+                    text = str(child.contents)
+                    # mwparserfromhell does not know captions; "|+ caption" parses as a cell starting with "+".
+                    if tag == "td" and child.wiki_markup == "|" and text.startswith("+") and len(rows) == 1 and len(rows[0]) == 0:
+                        caption = text[1:].strip()
+                    else:
+                        rows[0].append(text)
+            tables.append(TokenizedTable.from_rows(rows, caption))
+        return tables
+
+TABLE_PARSER_BACKENDS: Dict[str, Type[TableParserBackend]] = {
+    cls.name: cls for cls in (TokenizerBackend, WikitextparserBackend, MwparserfromhellBackend)
+}
+
+_backends: Dict[str, TableParserBackend] = {}
+
+def get_table_parser_backend(name: Optional[str]=None) -> TableParserBackend:
+    """Returns a table parser backend by name. If name is None, the backend named by the
+       FACTORYTOWN_MD_BACKEND environment variable is used, defaulting to the tokenizer."""
+    if name is None:
+        name = os.environ.get(MD_BACKEND_ENV_VAR) or DEFAULT_MD_BACKEND
+    backend = _backends.get(name)
+    if backend is None:
+        backend_class = TABLE_PARSER_BACKENDS.get(name)
+        if backend_class is None:
+            raise FactoryTownError(f"Unknown markdown parser backend {name!r}; choose from {sorted(TABLE_PARSER_BACKENDS)}")
+        backend = backend_class()
+        _backends[name] = backend
+    return backend
+
+def set_default_table_parser_backend(name: str):
+    """Selects the default table parser backend for this process and its child processes."""
+    get_table_parser_backend(name)
+    os.environ[MD_BACKEND_ENV_VAR] = name
@@ -0,0 +1,246 @@
+from ..internal_types import *
+
+import re
+import wikitextparser as wtp
+
+class UnsupportedTableSyntax(FactoryTownError):
+    """Raised by the fast tokenizer for wikitext it does not handle; callers fall back to wikitextparser."""
+    pass
+
+class TemplateToken(NamedTuple):
+    """A non-nested template such as {{Item|Wood}}, split into its name and arguments."""
+    name: str
+    args: Tuple[str, ...]
+
+    def __str__(self):
+        return "{{" + "|".join((self.name,) + self.args) + "}}"
+
+CellToken = Union[TemplateToken, str]
+"""A cell is tokenized into templates and the plain text between them."""
+
+_template_re = re.compile(r"\{\{([^{}|]*)((?:\|[^{}]*)?)\}\}")
+_unsupported_re = re.compile(r"<!--|<nowiki|<pre|rowspan|colspan", re.IGNORECASE)
+
+def split_cell_templates(cell: str) -> Optional[List[CellToken]]:
+    """Splits a cell into template tokens and the stripped, non-empty text between them. Returns None if
+       the cell has nested templates, which are not pre-split."""
+    if "{{" not in cell:
+        text = cell.strip()
+        return [] if text == "" else [text]
+    result: List[CellToken] = []
+    pos = 0
+    for m in _template_re.finditer(cell):
+        text = cell[pos:m.start()].strip()
+        if text != "":
+            result.append(text)
+        args = m.group(2)
+        result.append(TemplateToken(m.group(1).strip(), tuple(args[1:].split("|")) if args else ()))
+        pos = m.end()
+    tail = cell[pos:]
+    if "{{" in tail or "}}" in tail:
+        return None
+    tail = tail.strip()
+    if tail != "":
+        result.append(tail)
+    return result
+
+def _split_top_level(s: str, sep: str) -> List[str]:
+    """Splits s on sep, ignoring separators inside {{...}} and [[...]]."""
+    if sep not in s:
+        return [s]
+    parts: List[str] = []
+    depth = 0
+    start = 0
+    i = 0
+    n = len(s)
+    m = len(sep)
+    while i < n:
+        two = s[i:i + 2]
+        if two == "{{" or two == "[[":
+            depth += 1
+            i += 2
+            continue
+        if (two == "}}" or two == "]]") and depth > 0:
+            depth -= 1
+            i += 2
+            continue
+        if depth == 0 and s.startswith(sep, i):
+            parts.append(s[start:i])
+            i += m
+            start = i
+            continue
+        i += 1
+    parts.append(s[start:])
+    return parts
+
+def _strip_cell_attributes(cell: str) -> str:
+    """Removes a leading 'attributes |' from a cell."""
+    parts = _split_top_level(cell, "|")
+    if len(parts) == 1:
+        return cell
+    if len(parts) == 2:
+        return parts[1]
+    raise UnsupportedTableSyntax(f"Ambiguous table cell: {cell!r}")
+
+_CELL_TRAILING_WHITESPACE = " \t\n\r"
+
+def _strip_cell(cell: str) -> str:
+    return cell.lstrip(" ").rstrip(_CELL_TRAILING_WHITESPACE)
+
+class TokenizedTable:
+    """A wikitable reduced to its cell text, with template tokens pre-split.
+
+       Provides data() with the same shape as wikitextparser's Table.data() (header row first, stripped
+       cells, short rows padded with None) and iter_rows() for StreamingTableReader.
+    """
+    caption: Optional[str]
+    rows: List[List[Optional[str]]]
+    """All rows, header row first."""
+
+    _tokens: Optional[List[List[Optional[List[CellToken]]]]] = None
+
+    def __init__(self, rows: List[List[Optional[str]]], caption: Optional[str]=None):
+        self.rows = rows
+        self.caption = caption
+
+    @classmethod
+    def from_rows(cls, rows: List[List[str]], caption: Optional[str]=None) -> Self:
+        """Creates a table from raw cell text, dropping empty rows, stripping cells and padding short
+           rows with None, as wikitextparser's Table.data() does. Like it, only leading spaces are
+           stripped, so a cell whose content starts on the next line keeps that line break."""
+        rows = [r for r in rows if len(r) > 0]
+        width = max((len(r) for r in rows), default=0)
+        return cls([[_strip_cell(c) for c in r] + [None] * (width - len(r)) for r in rows], caption)
+
+    @classmethod
+    def from_wikitextparser(cls, table: wtp.Table) -> Self:
+        caption = table.caption
+        return cls(table.data(), None if caption is None else caption.strip())
+
+    @property
+    def headers(self) -> List[Optional[str]]:
+        return self.rows[0] if len(self.rows) > 0 else []
+
+    def data(self) -> List[List[Optional[str]]]:
+        return self.rows
+
+    def iter_rows(self) -> Iterator[List[Optional[str]]]:
+        return iter(self.rows)
+
+    def cell_tokens(self, row: int, col: int) -> Optional[List[CellToken]]:
+        """Returns the template tokens of a cell (row 0 is the header row), or None for cells that are
+           missing or have nested templates."""
+        if self._tokens is None:
+            self._tokens = [
+                [None if cell is None else split_cell_templates(cell) for cell in r] for r in self.rows
+              ]
+        r = self._tokens[row]
+        return r[col] if col < len(r) else None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __str__(self):
+        return f"TokenizedTable(rows={len(self.rows)}, cols={len(self.headers)})"
+
+    def __repr__(self):
+        return str(self)
+
+def _finish_table(rows: List[List[str]], caption: Optional[str]) -> TokenizedTable:
+    for r in rows:
+        for c in r:
+            if c.count("{{") != c.count("}}") or c.count("[[") != c.count("]]"):
+                raise UnsupportedTableSyntax(f"Unbalanced template or link in table cell: {c!r}")
+    return TokenizedTable.from_rows(rows, caption)
+
+def tokenize_tables(markdown: str) -> List[TokenizedTable]:
+    """Extracts the top-level tables of a page in a single pass over its lines.
+
+       Handles the table shapes the scraped pages use: '!' and '|' cell lines, '!!' and '||' inline
+       cell separators, '|-' row separators, captions, multi-line cells and cell attributes.
+
+    Raises:
+        UnsupportedTableSyntax: For nested tables, row or column spans, comments, nowiki or pre blocks,
+            or anything else that might be interpreted differently by a full parser.
+    """
+    tables: List[TokenizedTable] = []
+    template_depth = 0
+    rows: Optional[List[List[str]]] = None
+    caption: Optional[str] = None
+    cell_open = False
+    for line in markdown.split("\n"):
+        stripped = line.strip()
+        if rows is None:
+            if template_depth == 0 and stripped.startswith("{|"):
+                rows = [[]]
+                caption = None
+                cell_open = False
+            else:
+                template_depth += line.count("{{") - line.count("}}")
+                if template_depth < 0:
+                    template_depth = 0
+            continue
+        if _unsupported_re.search(line):
+            raise UnsupportedTableSyntax(f"Unsupported table content: {line!r}")
+        if stripped.startswith("{|"):
+            raise UnsupportedTableSyntax("Nested tables are not supported")
+        if stripped.startswith("|}"):
+            tables.append(_finish_table(rows, caption))
+            rows = None
+            if stripped[2:].strip() != "":
+                raise UnsupportedTableSyntax(f"Content after table end: {line!r}")
+            continue
+        if stripped.startswith("|-"):
+            rows.append([])
+            cell_open = False
+            continue
+        if stripped.startswith("|+"):
+            caption = _strip_cell_attributes(stripped[2:]).strip()
+            cell_open = False
+            continue
+        if stripped.startswith("!"):
+            cells = _split_top_level(stripped[1:], "!!")
+            if len(cells) == 1:
+                cells = _split_top_level(stripped[1:], "||")
+        elif stripped.startswith("|"):
+            cells = _split_top_level(stripped[1:], "||")
+        else:
+            if cell_open:
+                row = rows[-1]
+                row[-1] = row[-1] + "\n" + line
+            elif stripped != "":
+                raise UnsupportedTableSyntax(f"Unexpected table content: {line!r}")
+            continue
+        rows[-1].extend(_strip_cell_attributes(c) for c in cells)
+        cell_open = True
+    if rows is not None:
+        raise UnsupportedTableSyntax("Unterminated table")
+    return tables
+
+def parse_tables(markdown: str) -> List[TokenizedTable]:
+    """Returns the top-level tables of a page, using the fast tokenizer when it supports the page's
+       syntax and wikitextparser otherwise."""
+    try:
+        return tokenize_tables(markdown)
+    except UnsupportedTableSyntax:
+        return [TokenizedTable.from_wikitextparser(t) for t in wtp.parse(markdown).tables if t.nesting_level == 0]
+
+def compare_table_parsers(markdown: str) -> List[str]:
+    """Compares the fast tokenizer with wikitextparser on a page. Returns a description of each
+       difference; pages the tokenizer declines to handle have none."""
+    try:
+        fast = tokenize_tables(markdown)
+    except UnsupportedTableSyntax:
+        return []
+    reference = [t.data() for t in wtp.parse(markdown).tables if t.nesting_level == 0]
+    differences: List[str] = []
+    if len(fast) != len(reference):
+        differences.append(f"table count: tokenizer={len(fast)}, wikitextparser={len(reference)}")
+    for i, (a, b) in enumerate(zip(fast, reference)):
+        a_rows = a.data()
+        if len(a_rows) != len(b):
+            differences.append(f"table {i}: row count: tokenizer={len(a_rows)}, wikitextparser={len(b)}")
+        for j, (ra, rb) in enumerate(zip(a_rows, b)):
+            if ra != rb:
+                differences.append(f"table {i} row {j}: tokenizer={ra!r}, wikitextparser={rb!r}")
+    return differences
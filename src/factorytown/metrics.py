@@ -0,0 +1,403 @@
+"""
+Process-wide metrics: counters, gauges and histograms, exported in Prometheus text format or as JSON.
+
+Metrics are always collected; updating one costs a lock acquisition and an addition. For hot paths, bind
+the label values once with labels() and keep the returned child; for the hottest, counted one at a time,
+use a counter's fast_labels(), whose increments take no lock. Metrics updated in worker processes are not
+merged into the parent process.
+"""
+
+from .internal_types import *
+
+import itertools
+import json
+import math
+import os
+import threading
+import time
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_LATENCY_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+"""Histogram bucket upper bounds, in seconds. A +Inf bucket is always added."""
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]]=None) -> str:
+    pairs = [f'{n}="{_escape_label_value(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "" if len(pairs) == 0 else "{" + ",".join(pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class Metric:
+    """Base class of metrics. A metric with label names holds one value per combination of label
+       values."""
+    name: str
+    help: str
+    label_names: Tuple[str, ...]
+    type_name: str = ""
+    _lock: threading.Lock
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str]=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Mapping[str, Any]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise FactoryTownError(f"Metric {self.name!r} takes labels {list(self.label_names)}, got {sorted(labels)}")
+        return tuple(str(labels[n]) for n in self.label_names)
+
+    def prometheus_lines(self) -> List[str]:
+        raise NotImplementedError()
+
+    def to_jsonable(self) -> JsonableDict:
+        raise NotImplementedError()
+
+    def reset(self):
+        raise NotImplementedError()
+
+class _BoundValue:
+    __slots__ = ("metric", "key")
+
+    def __init__(self, metric: 'Counter|Gauge', key: LabelValues):
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount: float=1):
+        metric = self.metric
+        with metric._lock:
+            metric._values[self.key] = metric._values.get(self.key, 0) + amount
+
+    def set(self, value: float):
+        metric = self.metric
+        with metric._lock:
+            metric._values[self.key] = value
+
+class _FastCount:
+    """A counter child whose inc() adds 1 without taking a lock: it is the __next__ of an itertools.count,
+       which is atomic. Reading the count takes one more step of it, which is remembered and subtracted."""
+    __slots__ = ("inc", "_count", "_offset")
+
+    def __init__(self):
+        self._count = itertools.count()
+        self.inc = self._count.__next__
+        self._offset = 0
+
+    def read(self) -> int:
+        # Called with the metric's lock held, so reads do not race each other.
+        value = next(self._count) - self._offset
+        self._offset += 1
+        return value
+
+    def reset(self):
+        self._offset = next(self._count) + 1
+
+class Counter(Metric):
+    """A monotonically increasing count."""
+    type_name = "counter"
+    _values: Dict[LabelValues, float]
+    _fast: Dict[LabelValues, _FastCount]
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str]=()):
+        super().__init__(name, help, label_names)
+        self._values = {}
+        self._fast = {}
+
+    def labels(self, **labels: Any) -> _BoundValue:
+        return _BoundValue(self, self._label_values(labels))
+
+    def fast_labels(self, **labels: Any) -> _FastCount:
+        """Returns a child for the given label values whose inc() adds 1 without locking, for the hottest
+           paths. Its count is added to the metric's value for the labels when read."""
+        key = self._label_values(labels)
+        with self._lock:
+            child = self._fast.get(key)
+            if child is None:
+                child = self._fast[key] = _FastCount()
+        return child
+
+    def inc(self, amount: float=1, **labels: Any):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _items(self) -> List[Tuple[LabelValues, float]]:
+        """The metric's values by label values, sorted. Called with the lock held."""
+        values = dict(self._values)
+        for key, child in self._fast.items():
+            values[key] = values.get(key, 0) + child.read()
+        return sorted(values.items())
+
+    def get(self, **labels: Any) -> float:
+        key = self._label_values(labels)
+        with self._lock:
+            child = self._fast.get(key)
+            return self._values.get(key, 0) + (0 if child is None else child.read())
+
+    def prometheus_lines(self) -> List[str]:
+        with self._lock:
+            items = self._items()
+        if len(items) == 0 and len(self.label_names) == 0:
+            items = [((), 0)]
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in items]
+
+    def to_jsonable(self) -> JsonableDict:
+        with self._lock:
+            items = self._items()
+        return dict(
+            type=self.type_name,
+            values=[dict(labels=dict(zip(self.label_names, k)), value=v) for k, v in items],
+          )
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            for child in self._fast.values():
+                child.reset()
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+    type_name = "gauge"
+
+    def set(self, value: float, **labels: Any):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+class _HistogramValue:
+    __slots__ = ("bucket_counts", "sum", "count")
+
+    def __init__(self, n_buckets: int):
+        self.bucket_counts = [0] * n_buckets
+        self.sum = 0.0
+        self.count = 0
+
+class _BoundHistogram:
+    __slots__ = ("metric", "key")
+
+    def __init__(self, metric: 'Histogram', key: LabelValues):
+        self.metric = metric
+        self.key = key
+
+    def observe(self, value: float):
+        self.metric._observe(self.key, value)
+
+    def time(self) -> 'HistogramTimer':
+        return HistogramTimer(self)
+
+class HistogramTimer:
+    """A context manager that observes its elapsed time, in seconds."""
+    __slots__ = ("target", "start")
+
+    def __init__(self, target: '_BoundHistogram'):
+        self.target = target
+
+    def __enter__(self) -> Self:
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        self.target.observe(time.perf_counter() - self.start)
+
+class Histogram(Metric):
+    """Counts observations into cumulative buckets by upper bound, and tracks their sum and count."""
+    type_name = "histogram"
+    buckets: Tuple[float, ...]
+    _values: Dict[LabelValues, _HistogramValue]
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str]=(), buckets: Sequence[float]=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, help, label_names)
+        bounds = sorted(float(b) for b in buckets)
+        if len(bounds) == 0 or bounds[-1] != math.inf:
+            bounds.append(math.inf)
+        self.buckets = tuple(bounds)
+        self._values = {}
+
+    def labels(self, **labels: Any) -> _BoundHistogram:
+        return _BoundHistogram(self, self._label_values(labels))
+
+    def observe(self, value: float, **labels: Any):
+        self._observe(self._label_values(labels), value)
+
+    def time(self, **labels: Any) -> HistogramTimer:
+        return HistogramTimer(self.labels(**labels))
+
+    def _observe(self, key: LabelValues, value: float):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = _HistogramValue(len(self.buckets))
+                self._values[key] = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry.bucket_counts[i] += 1
+                    break
+            entry.sum += value
+            entry.count += 1
+
+    def _snapshot(self) -> List[Tuple[LabelValues, List[int], float, int]]:
+        with self._lock:
+            return [(k, list(v.bucket_counts), v.sum, v.count) for k, v in sorted(self._values.items())]
+
+    def prometheus_lines(self) -> List[str]:
+        lines: List[str] = []
+        for key, bucket_counts, total, count in self._snapshot():
+            cumulative = 0
+            for bound, n in zip(self.buckets, bucket_counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+    def to_jsonable(self) -> JsonableDict:
+        values: List[JsonableDict] = []
+        for key, bucket_counts, total, count in self._snapshot():
+            values.append(dict(
+                labels=dict(zip(self.label_names, key)),
+                count=count,
+                sum=total,
+                mean=None if count == 0 else total / count,
+                buckets={_format_value(b): n for b, n in zip(self.buckets, bucket_counts)},
+              ))
+        return dict(type=self.type_name, values=values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+M = TypeVar('M', bound=Metric)
+
+class MetricsRegistry:
+    """A named collection of metrics."""
+    _metrics: Dict[str, Metric]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: M) -> M:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise FactoryTownError(f"Metric {metric.name!r} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label_names: Sequence[str]=()) -> Counter:
+        return self.register(Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, label_names: Sequence[str]=()) -> Gauge:
+        return self.register(Gauge(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names: Sequence[str]=(), buckets: Sequence[float]=DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, label_names, buckets))
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def __iter__(self) -> Iterator[Metric]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return iter(sorted(metrics, key=lambda m: m.name))
+
+    def reset(self):
+        for metric in self:
+            metric.reset()
+
+    def to_prometheus_text(self) -> str:
+        lines: List[str] = []
+        for metric in self:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.prometheus_lines())
+        return "\n".join(lines) + "\n"
+
+    def to_jsonable(self) -> JsonableDict:
+        return {metric.name: metric.to_jsonable() for metric in self}
+
+    def write_prometheus_file(self, filename: str):
+        """Writes the metrics in Prometheus text format. The file is replaced atomically, so a collector
+           (e.g. the node_exporter textfile collector) never reads a partial file."""
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, 'w') as f:
+            f.write(self.to_prometheus_text())
+        os.replace(tmp_filename, filename)
+
+    def start_http_server(self, port: int, host: str="127.0.0.1") -> Any:
+        """Serves the metrics in Prometheus text format at http://host:port/metrics from a daemon thread.
+           Returns the server; call shutdown() on it to stop serving."""
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"metrics server: {format % args}")
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+        thread.start()
+        logger.info(f"Serving metrics at http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+METRICS = MetricsRegistry()
+"""The process-wide metrics registry."""
+
+HTTP_REQUESTS = METRICS.counter(
+    "factorytown_http_requests_total", "HTTP requests made, by response status.", ["status"])
+HTTP_RESPONSE_BYTES = METRICS.counter(
+    "factorytown_http_response_bytes_total", "Bytes received in HTTP response bodies.")
+HTTP_REQUEST_SECONDS = METRICS.histogram(
+    "factorytown_http_request_seconds", "HTTP request latency, including reading the body.")
+CACHE_REQUESTS = METRICS.counter(
+    "factorytown_cache_requests_total", "Cache lookups by tier (memory, http, md, derived, query, asset) and result (hit, miss, or shared: filled by another thread or process while waiting for its lock).",
+    ["tier", "result"])
+EXTRACT_CALLS = METRICS.counter(
+    "factorytown_extract_subprocess_total", "Wikitext extraction subprocess invocations.")
+EXTRACT_SECONDS = METRICS.histogram(
+    "factorytown_extract_subprocess_seconds", "Wikitext extraction subprocess latency.")
+REGISTRY_LOOKUPS = METRICS.counter(
+    "factorytown_registry_lookups_total", "RecordRegistry lookups, by operation.", ["op"])
+REGISTRY_REF_ALLOCATIONS = METRICS.counter(
+    "factorytown_registry_ref_allocations_total", "Record names newly referenced before being instantiated.")
+REGISTRY_RECORDS_CREATED = METRICS.counter(
+    "factorytown_registry_records_created_total", "Records instantiated.")
+REGISTRY_DANGLING_REFS = METRICS.gauge(
+    "factorytown_registry_dangling_refs", "Names referenced but never instantiated in the last scraped model.")
+QUERY_SECONDS = METRICS.histogram(
+    "factorytown_query_seconds", "Model query latency in the query engine, by operation.", ["op"])
+MODEL_RELOADS = METRICS.counter(
+    "factorytown_model_reloads_total", "Model reloads by the query server, by result (ok, error).", ["result"])
+FETCH_RETRIES = METRICS.counter(
+    "factorytown_fetch_retries_total", "HTTP requests retried by the fetch scheduler, by reason (status or error).", ["reason"])
+FETCH_CONCURRENCY_LIMIT = METRICS.gauge(
+    "factorytown_fetch_concurrency_limit", "The fetch scheduler's current adaptive concurrency limit.")
+MEMORY_CACHE_BYTES = METRICS.gauge(
+    "factorytown_memory_cache_bytes", "Bytes held by the in-memory scrape cache tier.")
+REQUESTS_COALESCED = METRICS.counter(
+    "factorytown_requests_coalesced_total", "Scrape cache requests answered by another thread's in-flight request, by tier.", ["tier"])
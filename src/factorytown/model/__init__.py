@@ -13,3 +13,37 @@ from .game_object import GameObject
 from .util import get_record_name
 from .grid_dim import GridDim
 from .coins import Coins
+from .compact import CompactModel, NO_ID
+from .changeset import (
+    ChangeSet,
+    RecordChange,
+    MergeConflict,
+    ModelMergeError,
+    RECORD_CLASSES,
+    record_fields,
+    encode_field_value,
+    decode_field_value,
+    merge_change_sets,
+)
+from .diff import (
+    ModelDiff,
+    RecordDiff,
+    FieldChange,
+    diff_models,
+    diff_records,
+    record_content_hash,
+)
+from .snapshot import save_snapshot, load_snapshot
+from .export import (
+    ExportColumn,
+    COMMON_COLUMNS,
+    GAME_OBJECT_COLUMNS,
+    EXPORT_SCHEMA,
+    EXPORT_FORMATS,
+    export_row,
+    iter_export_records,
+    write_ndjson,
+    columnar_export,
+    write_npz,
+    write_arrow,
+)
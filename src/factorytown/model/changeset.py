@@ -0,0 +1,183 @@
+from ..internal_types import *
+from .registry import Record, RecordRef, RecordRegistry
+from .model import FactoryTownModel
+from .grid_dim import GridDim
+from .game_object import GameObject
+from .building import Building
+from .item import Item
+from .research import Research
+from .recipe import Recipe, CountedGameObjectRef
+from .coins import Coins
+
+RECORD_CLASSES: Dict[str, Type[Record]] = {
+    cls.__name__: cls for cls in (Record, GameObject, Building, Item, Research, Recipe, Coins)
+}
+"""Record classes by class name, used to decode record classes and refs."""
+
+def encode_field_value(value: Any) -> Jsonable:
+    """Encodes a record field value as JSON-serializable data. Refs and GridDims are encoded as tagged
+       dicts so they can be decoded against another registry."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, GridDim):
+        return {"$type": "GridDim", "value": str(value)}
+    if isinstance(value, RecordRef):
+        return {"$type": "RecordRef", "class": value.record_class.__name__, "name": value.record_name}
+    if isinstance(value, CountedGameObjectRef):
+        return {
+            "$type": "CountedRef",
+            "class": value.obj_ref.record_class.__name__,
+            "name": value.obj_ref.record_name,
+            "quantity": value.quantity,
+          }
+    if isinstance(value, (list, tuple)):
+        return [encode_field_value(x) for x in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(encode_field_value(x) for x in value)
+    raise TypeError(f"Cannot encode record field value of type {type(value).__name__}: {value!r}")
+
+def decode_field_value(registry: RecordRegistry, value: Jsonable) -> Any:
+    """Decodes a value created by encode_field_value, binding refs to registry."""
+    if isinstance(value, list):
+        return [decode_field_value(registry, x) for x in value]
+    if isinstance(value, dict):
+        type_name = value.get("$type")
+        if type_name == "GridDim":
+            return GridDim.parse(value["value"])
+        if type_name == "RecordRef":
+            return registry.get_ref(value["name"], RECORD_CLASSES[value["class"]])
+        if type_name == "CountedRef":
+            ref = registry.get_ref(value["name"], RECORD_CLASSES[value["class"]])
+            return CountedGameObjectRef(ref, value["quantity"])
+        raise ValueError(f"Unknown encoded field value type {type_name!r}")
+    return value
+
+def record_fields(record: Record) -> JsonableDict:
+    """Returns the content of a record as a dict of encoded field values, by field name (the attribute
+       name without its leading underscore). Only fields that have been assigned are included; transient
+       fields derived from the record name or cached from other fields are excluded."""
+    transient = record._transient_fields
+    result: JsonableDict = {}
+    for attr, value in sorted(vars(record).items()):
+        if attr in transient or isinstance(value, UnsetType):
+            continue
+        result[attr.lstrip("_")] = encode_field_value(value)
+    return result
+
+class RecordChange(NamedTuple):
+    """The content of one record, independent of any registry."""
+    class_name: str
+    record_name: str
+    fields: JsonableDict
+
+    @classmethod
+    def from_record(cls, record: Record) -> Self:
+        return cls(record.__class__.__name__, record.record_name, record_fields(record))
+
+    def to_jsonable(self) -> JsonableDict:
+        return {"class": self.class_name, "name": self.record_name, "fields": self.fields}
+
+    @classmethod
+    def from_jsonable(cls, data: JsonableDict) -> Self:
+        return cls(data["class"], data["name"], data["fields"])
+
+class MergeConflict(NamedTuple):
+    """A field that a change set would set to a different value than the registry already holds."""
+    source: str
+    record_name: str
+    field: str
+    existing: Jsonable
+    incoming: Jsonable
+
+    def __str__(self):
+        return f"{self.source}: {self.record_name!r}.{self.field}: existing={self.existing!r}, incoming={self.incoming!r}"
+
+class ModelMergeError(FactoryTownError):
+    """Raised when merging change sets produces conflicts. All non-conflicting changes have been applied."""
+    conflicts: List[MergeConflict]
+
+    def __init__(self, conflicts: List[MergeConflict]):
+        lines = "\n  ".join(str(c) for c in conflicts)
+        super().__init__(f"{len(conflicts)} conflict(s) merging model changes:\n  {lines}")
+        self.conflicts = conflicts
+
+class ChangeSet(NamedTuple):
+    """A registry-independent set of record contents, e.g. the output of one page scraper, which can be
+       pickled to another process or saved to a file and merged into a registry."""
+    source: str
+    records: List[RecordChange]
+    """Instantiated records, in record-name order."""
+
+    references: List[str]
+    """Names that are referenced but not instantiated, in order."""
+
+    @classmethod
+    def from_model(cls, model: FactoryTownModel, source: str="") -> Self:
+        registry = model.records
+        records: List[RecordChange] = []
+        references: List[str] = []
+        for name, record in sorted(registry.referenced_items()):
+            if record is None:
+                references.append(name)
+            else:
+                records.append(RecordChange.from_record(record))
+        return cls(source, records, references)
+
+    def to_jsonable(self) -> JsonableDict:
+        return {
+            "source": self.source,
+            "records": [x.to_jsonable() for x in self.records],
+            "references": list(self.references),
+          }
+
+    @classmethod
+    def from_jsonable(cls, data: JsonableDict) -> Self:
+        return cls(
+            data.get("source", ""),
+            [RecordChange.from_jsonable(x) for x in data["records"]],
+            list(data.get("references", [])),
+          )
+
+    def merge_into(self, registry: RecordRegistry) -> List[MergeConflict]:
+        """Applies the change set to registry with the same write-once semantics as the record setters:
+           a field may be set if unset, or "set" again to an equal value. Tags are unioned. Returns the
+           conflicts; conflicting fields keep their existing values."""
+        conflicts: List[MergeConflict] = []
+        for change in self.records:
+            record_class = RECORD_CLASSES.get(change.class_name)
+            if record_class is None:
+                raise FactoryTownError(f"Unknown record class {change.class_name!r} in change set {self.source!r}")
+            existing = registry.try_get(change.record_name)
+            if existing is not None and type(existing) is not record_class:
+                conflicts.append(MergeConflict(
+                    self.source, change.record_name, "class", existing.__class__.__name__, change.class_name))
+                continue
+            record = registry.get_or_create(change.record_name, record_class)
+            assigned = vars(record)
+            for field, encoded in change.fields.items():
+                attr = f"_{field}"
+                if attr in record._transient_fields:
+                    continue
+                value = decode_field_value(registry, encoded)
+                if field == "tags":
+                    record.add_tags(value)
+                    continue
+                current = assigned.get(attr, UNSET)
+                if isinstance(current, UnsetType):
+                    setattr(record, attr, value)
+                elif current != value:
+                    conflicts.append(MergeConflict(
+                        self.source, change.record_name, field, encode_field_value(current), encoded))
+            record.invalidate_cached_fields()
+        for name in self.references:
+            registry.get_ref(name)
+        return conflicts
+
+def merge_change_sets(registry: RecordRegistry, change_sets: Iterable[ChangeSet]):
+    """Merges change sets into registry in order. Raises ModelMergeError listing every conflict after all
+       change sets have been applied."""
+    conflicts: List[MergeConflict] = []
+    for change_set in change_sets:
+        conflicts.extend(change_set.merge_into(registry))
+    if len(conflicts) > 0:
+        raise ModelMergeError(conflicts)
@@ -5,6 +5,8 @@ from .registry import RecordRegistry
 class Coins(GameObject):
     _color: str
     
+    _transient_fields = GameObject._transient_fields + ("_color",)
+    
     def __init__(self, registry: RecordRegistry, record_name: str):
         super().__init__(registry, record_name)
         parts = record_name.split(" ", 1)
@@ -0,0 +1,276 @@
+from ..internal_types import *
+from .model import FactoryTownModel
+from .building import Building
+from .recipe import Recipe, CountedGameObjectRef
+
+from array import array
+import json
+import struct
+
+CountedIdList = Tuple[Tuple[int, int], ...]
+"""A tuple of (record id, quantity) pairs."""
+
+NO_ID = -1
+"""Placeholder used in the dense per-record columns when a record has no value for a field."""
+
+class _GridSizeColumn(Sequence[Optional[Tuple[int, int]]]):
+    """A read-only grid_sizes column over width and height columns, with NO_ID for no size."""
+    _widths: Sequence[int]
+    _heights: Sequence[int]
+
+    def __init__(self, widths: Sequence[int], heights: Sequence[int]):
+        self._widths = widths
+        self._heights = heights
+
+    def __len__(self) -> int:
+        return len(self._widths)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        w = self._widths[i]
+        return None if w == NO_ID else (w, self._heights[i])
+
+class _CountedIdColumn(Sequence[CountedIdList]):
+    """A read-only products or ingredients column over flat id and quantity columns. The pairs of record
+       i are at offsets[i] to offsets[i + 1]."""
+    _offsets: Sequence[int]
+    _ids: Sequence[int]
+    _quantities: Sequence[int]
+    _n: int
+
+    def __init__(self, offsets: Sequence[int], ids: Sequence[int], quantities: Sequence[int]):
+        self._offsets = offsets
+        self._ids = ids
+        self._quantities = quantities
+        self._n = len(offsets) - 1
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        offsets = self._offsets
+        start = offsets[i]
+        end = offsets[i + 1]
+        # Slicing a memoryview costs more than indexing it, and most recipes have one or two entries.
+        if end - start == 0:
+            return ()
+        if end - start == 1:
+            return ((self._ids[start], self._quantities[start]),)
+        return tuple(zip(self._ids[start:end], self._quantities[start:end]))
+
+    def __iter__(self) -> Iterator[CountedIdList]:
+        for i in range(len(self)):
+            yield self[i]
+
+class CompactModel:
+    """A flat, read-only snapshot of a FactoryTownModel with dense integer record ids.
+
+       Every record name that is instantiated or referenced in the registry is assigned an id in
+       record-name order, so two snapshots of the same model always agree on ids. Per-record fields
+       are stored as parallel columns indexed by id, with NO_ID for fields that do not apply.
+
+       Unlike the record graph, a CompactModel packs into a small self-contained buffer (see to_bytes),
+       which makes it cheap to share with worker processes: a CompactModel read back with from_bytes reads
+       its integer columns in place from the buffer, and only decodes the table of names, classes and
+       tags.
+    """
+    names: List[str]
+    """Record name for each id."""
+
+    classes: List[str]
+    """Record class name for each id, or "" for records that are referenced but not instantiated."""
+
+    tags: List[Tuple[str, ...]]
+    """Sorted tags for each id."""
+
+    tech_levels: Sequence[int]
+    """Building tech level for each id, or NO_ID."""
+
+    research: Sequence[int]
+    """Id of the Research required by a building, or NO_ID."""
+
+    grid_sizes: Sequence[Optional[Tuple[int, int]]]
+    """Building (w, h) footprint for each id, or None."""
+
+    building_recipes: Sequence[int]
+    """Id of the Recipe used to construct a building, or NO_ID."""
+
+    recipe_buildings: Sequence[int]
+    """Id of the Building that produces a recipe, or NO_ID for user recipes and non-recipes."""
+
+    work_units: Sequence[int]
+    """Recipe work units for each id, or NO_ID."""
+
+    products: Sequence[CountedIdList]
+    """Recipe products for each id; empty for non-recipes."""
+
+    ingredients: Sequence[CountedIdList]
+    """Recipe ingredients for each id; empty for non-recipes."""
+
+    _index: Dict[str, int]
+    _producers: Optional[Dict[int, List[int]]] = None
+
+    _COLUMNS = (
+        "names", "classes", "tags", "tech_levels", "research", "grid_sizes",
+        "building_recipes", "recipe_buildings", "work_units", "products", "ingredients",
+      )
+
+    _INT_COLUMNS = ("tech_levels", "research", "building_recipes", "recipe_buildings", "work_units")
+    _COUNTED_COLUMNS = ("products", "ingredients")
+    _STRING_COLUMNS = ("names", "classes", "tags")
+
+    _MAGIC = b"FTCM\x00\x00\x00\x01"
+    _HEADER = struct.Struct("=8sqqqq")
+    """Magic, length of the JSON string table, number of records, and total products and ingredients."""
+
+    def __init__(self, columns: Mapping[str, Sequence[Any]]):
+        for column in self._COLUMNS:
+            setattr(self, column, columns[column])
+        self._index = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def from_model(cls, model: FactoryTownModel) -> Self:
+        registry = model.records
+        names = sorted(registry.referenced_keys())
+        index = {name: i for i, name in enumerate(names)}
+        n = len(names)
+
+        def ref_id(ref: Any) -> int:
+            if ref is None or isinstance(ref, UnsetType):
+                return NO_ID
+            return index[ref.record_name]
+
+        def counted_ids(refs: List[CountedGameObjectRef]|UnsetType) -> CountedIdList:
+            if isinstance(refs, UnsetType):
+                return ()
+            return tuple((index[x.obj_ref.record_name], x.quantity) for x in refs)
+
+        columns: Dict[str, List[Any]] = {
+            "names": names,
+            "classes": [""] * n,
+            "tags": [()] * n,
+            "tech_levels": [NO_ID] * n,
+            "research": [NO_ID] * n,
+            "grid_sizes": [None] * n,
+            "building_recipes": [NO_ID] * n,
+            "recipe_buildings": [NO_ID] * n,
+            "work_units": [NO_ID] * n,
+            "products": [()] * n,
+            "ingredients": [()] * n,
+          }
+        for i, name in enumerate(names):
+            record = registry.try_get(name)
+            if record is None:
+                continue
+            columns["classes"][i] = record.__class__.__name__
+            columns["tags"][i] = tuple(sorted(record.tags))
+            if isinstance(record, Building):
+                if not isinstance(record._tech_level, UnsetType):
+                    columns["tech_levels"][i] = record._tech_level
+                if not isinstance(record._grid_size, UnsetType):
+                    columns["grid_sizes"][i] = (record._grid_size.w, record._grid_size.h)
+                columns["research"][i] = ref_id(record._research)
+                columns["building_recipes"][i] = ref_id(record._recipe)
+            elif isinstance(record, Recipe):
+                columns["recipe_buildings"][i] = ref_id(record._building)
+                if not isinstance(record._work_units, UnsetType):
+                    columns["work_units"][i] = record._work_units
+                columns["products"][i] = counted_ids(record._product_refs)
+                columns["ingredients"][i] = counted_ids(record._ingredient_refs)
+        return cls(columns)
+
+    def to_bytes(self) -> bytes:
+        """Packs the snapshot into a self-contained buffer: a header, the names, classes and tags as JSON,
+           and then each integer column as an int64 array in native byte order (the buffer is meant for processes
+           on the same machine), aligned to 8 bytes. Grid sizes are
+           stored as width and height columns, and products and ingredients as offsets into id and quantity
+           columns."""
+        n = len(self.names)
+        strings = json.dumps(
+            {column: getattr(self, column) for column in self._STRING_COLUMNS}, separators=(",", ":")
+          ).encode("utf-8")
+        ints: List[array] = [array('q', getattr(self, column)) for column in self._INT_COLUMNS]
+        ints.append(array('q', (NO_ID if x is None else x[0] for x in self.grid_sizes)))
+        ints.append(array('q', (NO_ID if x is None else x[1] for x in self.grid_sizes)))
+        totals: List[int] = []
+        for column in self._COUNTED_COLUMNS:
+            offsets = array('q', [0])
+            ids = array('q')
+            quantities = array('q')
+            for counted in getattr(self, column):
+                for record_id, quantity in counted:
+                    ids.append(record_id)
+                    quantities.append(quantity)
+                offsets.append(len(ids))
+            ints += [offsets, ids, quantities]
+            totals.append(len(ids))
+        header = self._HEADER.pack(self._MAGIC, len(strings), n, totals[0], totals[1])
+        padding = b"\0" * (-(len(header) + len(strings)) % 8)
+        return b"".join([header, strings, padding] + [x.tobytes() for x in ints])
+
+    @classmethod
+    def from_bytes(cls, data: bytes|memoryview) -> Self:
+        """Reads a snapshot packed with to_bytes(). The integer columns are read-only views into data,
+           not copies, so data (e.g. a shared memory buffer) must stay open while the snapshot is used."""
+        buf = memoryview(data).cast('B')
+        magic, strings_size, n, n_products, n_ingredients = cls._HEADER.unpack_from(buf)
+        if magic != cls._MAGIC:
+            raise FactoryTownError("Not a packed CompactModel")
+        offset = cls._HEADER.size
+        columns: Dict[str, Sequence[Any]] = json.loads(bytes(buf[offset:offset + strings_size]).decode("utf-8"))
+        columns["tags"] = [tuple(x) for x in columns["tags"]]
+        offset += strings_size
+        offset += -offset % 8
+
+        def take(count: int) -> memoryview:
+            nonlocal offset
+            view = buf[offset:offset + 8 * count].cast('q')
+            offset += 8 * count
+            return view
+
+        for column in cls._INT_COLUMNS:
+            columns[column] = take(n)
+        columns["grid_sizes"] = _GridSizeColumn(take(n), take(n))
+        for column, total in zip(cls._COUNTED_COLUMNS, (n_products, n_ingredients)):
+            columns[column] = _CountedIdColumn(take(n + 1), take(total), take(total))
+        return cls(columns)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def id_of(self, record_name: str) -> int:
+        """Returns the dense id of a record name. Raises KeyError if the name is unknown."""
+        return self._index[record_name]
+
+    def try_id_of(self, record_name: str) -> int:
+        """Returns the dense id of a record name, or NO_ID if the name is unknown."""
+        return self._index.get(record_name, NO_ID)
+
+    def has_tag(self, record_id: int, tag: str) -> bool:
+        return tag in self.tags[record_id]
+
+    def ids_of_class(self, class_name: str) -> List[int]:
+        return [i for i, c in enumerate(self.classes) if c == class_name]
+
+    def producers(self, record_id: int) -> List[int]:
+        """Returns the ids of all recipes that produce the given record, in id order."""
+        if self._producers is None:
+            producers: Dict[int, List[int]] = {}
+            for recipe_id, products in enumerate(self.products):
+                for product_id, _ in products:
+                    producers.setdefault(product_id, []).append(recipe_id)
+            self._producers = producers
+        return self._producers.get(record_id, [])
+
+    def __str__(self):
+        return f"CompactModel(n_records={len(self)})"
+
+    def __repr__(self):
+        return str(self)
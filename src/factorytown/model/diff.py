@@ -0,0 +1,123 @@
+from ..internal_types import *
+from .model import FactoryTownModel
+from .changeset import RecordChange
+
+import hashlib
+import json
+
+def record_content_hash(change: RecordChange) -> str:
+    """A hash of a record's class and field content. Records with equal hashes are unchanged."""
+    canonical = json.dumps([change.class_name, change.fields], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _record_changes(model: FactoryTownModel) -> Dict[str, RecordChange]:
+    return {
+        name: RecordChange.from_record(record)
+        for name, record in model.records.referenced_items() if record is not None
+    }
+
+class FieldChange(NamedTuple):
+    """A field whose value differs between two versions of a record. old or new is None if the field is
+       unset in that version. For counted ref lists (recipe products and ingredients), details breaks the
+       change down by referenced record."""
+    field: str
+    old: Jsonable
+    new: Jsonable
+    details: Optional[JsonableDict] = None
+
+    def to_jsonable(self) -> JsonableDict:
+        result: JsonableDict = dict(field=self.field, old=self.old, new=self.new)
+        if self.details is not None:
+            result["details"] = self.details
+        return result
+
+class RecordDiff(NamedTuple):
+    class_name: str
+    record_name: str
+    old_class_name: str
+    fields: List[FieldChange]
+
+    def to_jsonable(self) -> JsonableDict:
+        result: JsonableDict = {"class": self.class_name, "name": self.record_name}
+        if self.old_class_name != self.class_name:
+            result["old_class"] = self.old_class_name
+        result["fields"] = [f.to_jsonable() for f in self.fields]
+        return result
+
+class ModelDiff(NamedTuple):
+    added: List[RecordChange]
+    removed: List[RecordChange]
+    changed: List[RecordDiff]
+    unchanged_count: int
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self.added) == 0 and len(self.removed) == 0 and len(self.changed) == 0
+
+    def to_jsonable(self) -> JsonableDict:
+        return dict(
+            added=[{"class": x.class_name, "name": x.record_name} for x in self.added],
+            removed=[{"class": x.class_name, "name": x.record_name} for x in self.removed],
+            changed=[x.to_jsonable() for x in self.changed],
+            unchanged_count=self.unchanged_count,
+          )
+
+def _is_counted_ref_list(value: Jsonable) -> bool:
+    return isinstance(value, list) and all(isinstance(x, dict) and x.get("$type") == "CountedRef" for x in value)
+
+def _counted_ref_details(old: Jsonable, new: Jsonable) -> JsonableDict:
+    old_q = {} if old is None else {x["name"]: x["quantity"] for x in old}
+    new_q = {} if new is None else {x["name"]: x["quantity"] for x in new}
+    return dict(
+        added=[{"name": k, "quantity": v} for k, v in new_q.items() if k not in old_q],
+        removed=[{"name": k, "quantity": v} for k, v in old_q.items() if k not in new_q],
+        quantity_changed=[
+            {"name": k, "old": old_q[k], "new": v} for k, v in new_q.items() if k in old_q and old_q[k] != v
+          ],
+        reordered=(
+            [k for k in (x["name"] for x in old or []) if k in new_q] !=
+            [k for k in (x["name"] for x in new or []) if k in old_q]
+          ),
+      )
+
+def diff_records(old: RecordChange, new: RecordChange) -> RecordDiff:
+    """Compares two versions of a record field by field."""
+    changes: List[FieldChange] = []
+    for field in sorted(set(old.fields) | set(new.fields)):
+        old_value = old.fields.get(field)
+        new_value = new.fields.get(field)
+        if old_value == new_value:
+            continue
+        details = None
+        if (old_value is None or _is_counted_ref_list(old_value)) and (new_value is None or _is_counted_ref_list(new_value)):
+            details = _counted_ref_details(old_value, new_value)
+        changes.append(FieldChange(field, old_value, new_value, details))
+    return RecordDiff(new.class_name, new.record_name, old.class_name, changes)
+
+def diff_models(old: FactoryTownModel, new: FactoryTownModel) -> ModelDiff:
+    """Compares two models record by record, by record name.
+
+       Each record's content is hashed once, and only records whose hashes differ are compared field by
+       field, so the cost is linear in model size plus the size of the changes.
+    """
+    old_records = _record_changes(old)
+    new_records = _record_changes(new)
+    old_hashes = {name: record_content_hash(x) for name, x in old_records.items()}
+    added: List[RecordChange] = []
+    changed: List[RecordDiff] = []
+    unchanged = 0
+    for name, new_record in new_records.items():
+        old_hash = old_hashes.get(name)
+        if old_hash is None:
+            added.append(new_record)
+        elif old_hash == record_content_hash(new_record):
+            unchanged += 1
+        else:
+            changed.append(diff_records(old_records[name], new_record))
+    removed = [x for name, x in old_records.items() if name not in new_records]
+    return ModelDiff(
+        added=sorted(added, key=lambda x: x.record_name),
+        removed=sorted(removed, key=lambda x: x.record_name),
+        changed=sorted(changed, key=lambda x: x.record_name),
+        unchanged_count=unchanged,
+      )
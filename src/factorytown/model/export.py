@@ -0,0 +1,252 @@
+"""
+Export of model records to flat formats for analysis outside factorytown.
+
+Every record is exported with a fixed set of columns for its class (see EXPORT_SCHEMA), so the layout does
+not depend on which fields a particular scrape happened to fill in. Missing values are null in NDJSON;
+in .npz files, which have no nulls, missing strings are "", and missing integers and booleans are -1.
+
+List columns (tags, and the counted product and ingredient lists of recipes) are stored in the columnar
+formats the way Arrow stores them: a flat array of values, plus an offsets array with one more entry than
+there are rows, so row i's values are values[offsets[i]:offsets[i + 1]].
+"""
+
+from ..internal_types import *
+from .model import FactoryTownModel
+from .registry import Record, RecordRef
+from .game_object import GameObject
+from .coins import Coins
+from .recipe import CountedGameObjectRef
+
+import json
+import os
+
+class ExportColumn(NamedTuple):
+    name: str
+    kind: str
+    """One of "str", "int", "bool", "str_list" or "counted_list"."""
+
+COMMON_COLUMNS: List[ExportColumn] = [
+    ExportColumn("name", "str"),
+    ExportColumn("display_name", "str"),
+    ExportColumn("tags", "str_list"),
+  ]
+"""Columns exported for every record."""
+
+GAME_OBJECT_COLUMNS: List[ExportColumn] = COMMON_COLUMNS + [
+    ExportColumn("image_name", "str"),
+  ]
+"""Columns exported for every game object (buildings, items and coins)."""
+
+EXPORT_SCHEMA: Dict[str, List[ExportColumn]] = {
+    "Building": GAME_OBJECT_COLUMNS + [
+        ExportColumn("building_type", "str"),
+        ExportColumn("grid_width", "int"),
+        ExportColumn("grid_height", "int"),
+        ExportColumn("tech_level", "int"),
+        ExportColumn("research", "str"),
+        ExportColumn("recipe", "str"),
+        ExportColumn("shared_inventory", "bool"),
+        ExportColumn("capacity_note", "str"),
+      ],
+    "Item": GAME_OBJECT_COLUMNS,
+    "Recipe": COMMON_COLUMNS + [
+        ExportColumn("building", "str"),
+        ExportColumn("work_units", "int"),
+        ExportColumn("products", "counted_list"),
+        ExportColumn("ingredients", "counted_list"),
+      ],
+    "Research": COMMON_COLUMNS,
+    "Coins": GAME_OBJECT_COLUMNS + [
+        ExportColumn("color", "str"),
+      ],
+    "GameObject": GAME_OBJECT_COLUMNS,
+  }
+"""The exported columns of each record class, by class name."""
+
+EXPORT_FORMATS = ("ndjson", "npz", "arrow")
+
+def _field(record: Record, attr: str) -> Any:
+    value = getattr(record, attr, None)
+    return None if isinstance(value, UnsetType) else value
+
+def _ref_name(ref: Optional[RecordRef]) -> Optional[str]:
+    return None if ref is None else ref.record_name
+
+def _counted(refs: Optional[List[CountedGameObjectRef]]) -> List[JsonableDict]:
+    return [] if refs is None else [dict(name=x.obj_ref.record_name, quantity=x.quantity) for x in refs]
+
+def export_row(record: Record) -> JsonableDict:
+    """Returns a record's exported columns (see EXPORT_SCHEMA), preceded by "class"."""
+    class_name = record.__class__.__name__
+    row: JsonableDict = dict(
+        {"class": class_name},
+        name=record.record_name,
+        display_name=record.display_name,
+        tags=sorted(record.tags),
+      )
+    if isinstance(record, GameObject):
+        row.update(image_name=record.image_name)
+    if isinstance(record, Coins):
+        row.update(color=record._color)
+    if class_name == "Building":
+        grid_size = _field(record, "_grid_size")
+        row.update(
+            building_type=_field(record, "_building_type"),
+            grid_width=None if grid_size is None else grid_size.w,
+            grid_height=None if grid_size is None else grid_size.h,
+            tech_level=_field(record, "_tech_level"),
+            research=_ref_name(_field(record, "_research")),
+            recipe=_ref_name(_field(record, "_recipe")),
+            shared_inventory=_field(record, "_shared_inventory"),
+            capacity_note=_field(record, "_capacity_note"),
+          )
+    elif class_name == "Recipe":
+        row.update(
+            building=_ref_name(_field(record, "_building")),
+            work_units=_field(record, "_work_units"),
+            products=_counted(_field(record, "_product_refs")),
+            ingredients=_counted(_field(record, "_ingredient_refs")),
+          )
+    return row
+
+def iter_export_records(model: FactoryTownModel, classes: Optional[Iterable[str]]=None) -> Iterator[Record]:
+    """Yields the instantiated records of a model in record-name order, optionally only those of the given
+       class names."""
+    wanted = None if classes is None else set(classes)
+    for _, record in sorted(model.records.referenced_items(), key=lambda x: x[0]):
+        if record is not None and (wanted is None or record.__class__.__name__ in wanted):
+            yield record
+
+def write_ndjson(model: FactoryTownModel, f: IO[str], classes: Optional[Iterable[str]]=None) -> int:
+    """Writes one JSON object per record (see export_row) to f, one record at a time. Returns the number of
+       records written."""
+    n = 0
+    for record in iter_export_records(model, classes):
+        f.write(json.dumps(export_row(record)) + "\n")
+        n += 1
+    return n
+
+_MISSING: Dict[str, Any] = {"str": "", "int": -1, "bool": -1}
+
+def columnar_export(
+        model: FactoryTownModel,
+        classes: Optional[Iterable[str]]=None,
+        fill_missing: bool=True,
+      ) -> Dict[str, Dict[str, List[Any]]]:
+    """Returns the exported records as plain-list columns, by class name and then column name.
+
+       A scalar column c becomes one list named c. A str_list column c becomes "c.offsets" and
+       "c.values"; a counted_list column c becomes "c.offsets", "c.name" and "c.quantity".
+
+       If fill_missing is True, missing scalars are replaced by "" or -1 and booleans are stored as 0 or 1,
+       for formats without nulls; otherwise they are left as None and bool.
+    """
+    result: Dict[str, Dict[str, List[Any]]] = {}
+    for record in iter_export_records(model, classes):
+        class_name = record.__class__.__name__
+        schema = EXPORT_SCHEMA.get(class_name, COMMON_COLUMNS)
+        columns = result.get(class_name)
+        if columns is None:
+            columns = {}
+            for column in schema:
+                if column.kind == "str_list":
+                    columns.update({f"{column.name}.offsets": [0], f"{column.name}.values": []})
+                elif column.kind == "counted_list":
+                    columns.update({f"{column.name}.offsets": [0], f"{column.name}.name": [], f"{column.name}.quantity": []})
+                else:
+                    columns[column.name] = []
+            result[class_name] = columns
+        row = export_row(record)
+        for column in schema:
+            value = row[column.name]
+            if column.kind == "str_list":
+                columns[f"{column.name}.values"].extend(value)
+                columns[f"{column.name}.offsets"].append(len(columns[f"{column.name}.values"]))
+            elif column.kind == "counted_list":
+                columns[f"{column.name}.name"].extend(x["name"] for x in value)
+                columns[f"{column.name}.quantity"].extend(x["quantity"] for x in value)
+                columns[f"{column.name}.offsets"].append(len(columns[f"{column.name}.name"]))
+            elif not fill_missing:
+                columns[column.name].append(value)
+            elif value is None:
+                columns[column.name].append(_MISSING[column.kind])
+            else:
+                columns[column.name].append(int(value) if column.kind == "bool" else value)
+    return result
+
+def _column_kind(class_name: str, key: str) -> str:
+    base, _, part = key.partition(".")
+    if part == "offsets":
+        return "offsets"
+    if part == "quantity":
+        return "int"
+    if part != "":
+        return "str"
+    for column in EXPORT_SCHEMA.get(class_name, COMMON_COLUMNS):
+        if column.name == base:
+            return column.kind
+    raise KeyError(key)
+
+def write_npz(model: FactoryTownModel, filename: str, classes: Optional[Iterable[str]]=None):
+    """Writes the columnar export (see columnar_export) to a NumPy .npz file, with one array per column
+       named "<class>.<column>". Strings are fixed-width unicode arrays, so the file loads without
+       pickling: numpy.load(filename)["Recipe.work_units"].
+
+    Raises:
+        FactoryTownError: If numpy is not installed.
+    """
+    try:
+        import numpy as np
+    except ImportError as ex:
+        raise FactoryTownError("Exporting to .npz requires numpy (pip install numpy)") from ex
+    dtypes = {"str": np.str_, "int": np.int64, "bool": np.int8, "offsets": np.int64}
+    arrays: Dict[str, Any] = {}
+    for class_name, columns in columnar_export(model, classes).items():
+        for key, values in columns.items():
+            arrays[f"{class_name}.{key}"] = np.array(values, dtype=dtypes[_column_kind(class_name, key)])
+    np.savez(filename, **arrays)
+
+def write_arrow(model: FactoryTownModel, directory: str, classes: Optional[Iterable[str]]=None) -> List[str]:
+    """Writes the columnar export to Arrow IPC files, one "<class>.arrow" table per record class in
+       directory, with list columns as native Arrow lists (counted lists as lists of
+       struct<name, quantity>). Returns the files written.
+
+    Raises:
+        FactoryTownError: If pyarrow is not installed.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+    except ImportError as ex:
+        raise FactoryTownError("Exporting to Arrow requires pyarrow (pip install pyarrow)") from ex
+    types = {"str": pa.string(), "int": pa.int64(), "bool": pa.bool_()}
+    os.makedirs(directory, exist_ok=True)
+    filenames: List[str] = []
+    for class_name, columns in columnar_export(model, classes, fill_missing=False).items():
+        arrays: List[Any] = []
+        names: List[str] = []
+        for column in EXPORT_SCHEMA.get(class_name, COMMON_COLUMNS):
+            if column.kind == "str_list":
+                offsets = pa.array(columns[f"{column.name}.offsets"], type=pa.int32())
+                array = pa.ListArray.from_arrays(offsets, pa.array(columns[f"{column.name}.values"], type=pa.string()))
+            elif column.kind == "counted_list":
+                offsets = pa.array(columns[f"{column.name}.offsets"], type=pa.int32())
+                entries = pa.StructArray.from_arrays(
+                    [
+                        pa.array(columns[f"{column.name}.name"], type=pa.string()),
+                        pa.array(columns[f"{column.name}.quantity"], type=pa.int64()),
+                    ],
+                    names=["name", "quantity"],
+                  )
+                array = pa.ListArray.from_arrays(offsets, entries)
+            else:
+                array = pa.array(columns[column.name], type=types[column.kind])
+            arrays.append(array)
+            names.append(column.name)
+        table = pa.Table.from_arrays(arrays, names=names)
+        filename = os.path.join(directory, f"{class_name}.arrow")
+        with pa.OSFile(filename, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        filenames.append(filename)
+    return filenames
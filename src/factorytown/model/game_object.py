@@ -7,7 +7,7 @@ class GameObject(Record):
     
     @property
     def default_image_name(self) -> str:
-        return self.name
+        return self.record_name
     
     @property
     def image_name(self) -> str:
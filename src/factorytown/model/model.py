@@ -1,7 +1,33 @@
+from ..internal_types import *
 from .registry import RecordRegistry
-    
+from ..metrics import CACHE_REQUESTS
+
+_derived_hits = CACHE_REQUESTS.labels(tier="derived", result="hit")
+_derived_misses = CACHE_REQUESTS.labels(tier="derived", result="miss")
+
 class FactoryTownModel:
     records: RecordRegistry
-    
+    _derived: Dict[Any, Tuple[int, Any]]
+    """Cache of data derived from the records, by key, with the registry generation it was built at."""
+
     def __init__(self):
         self.records = RecordRegistry(self, "model")
+        self._derived = {}
+
+    def get_derived(self, key: Any, factory: Callable[[], Any]) -> Any:
+        """Returns data derived from the model, computing it with factory() the first time and again
+           whenever records have been created or referenced since. Changes to fields of existing records
+           are not tracked; call invalidate_derived() after making them."""
+        generation = self.records.generation
+        cached = self._derived.get(key)
+        if cached is not None and cached[0] == generation:
+            _derived_hits.inc()
+            return cached[1]
+        _derived_misses.inc()
+        value = factory()
+        self._derived[key] = (generation, value)
+        return value
+
+    def invalidate_derived(self):
+        """Discards all cached derived data."""
+        self._derived.clear()
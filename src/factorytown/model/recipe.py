@@ -86,13 +86,15 @@ class Recipe(Record):
     _variant: Optional[str]
     _primary_product_name: str
     
+    _transient_fields = Record._transient_fields + ("_products", "_ingredients", "_variant", "_primary_product_name")
+    
     def __init__(self, registry: RecordRegistry, record_name: str):
         super().__init__(registry, record_name)
         building_name, product_name, variant = self.parse_record_name(record_name)
         self._primary_product_name = product_name
         self._variant = variant
         self.add_tag("Recipe")
-        self.building = None if building_name is None else self._registry.get_ref(building_name, Building)
+        self.building = building_name
     
     @classmethod
     def create_record_name(cls, building_id: Optional[RecordId], primary_product_id: RecordId, variant: Optional[str]=None) -> str:
@@ -221,6 +223,10 @@ class Recipe(Record):
         self._ingredient_refs = []
         self._ingredients = []
     
+    def invalidate_cached_fields(self):
+        self._products = UNSET
+        self._ingredients = UNSET
+    
     @property
     def building(self) -> Optional[Building]:
         assert not isinstance(self._building, UnsetType)
@@ -228,6 +234,8 @@ class Recipe(Record):
     
     @building.setter
     def building(self, building_id: Optional[RecordId]):
+        # Imported here rather than at module level because building.py imports this module.
+        from .building import Building
         building_ref = None if building_id is None else self._registry.get_ref(building_id, Building)
         assert isinstance(self._building, UnsetType) or self._building == building_ref
         self._building = building_ref
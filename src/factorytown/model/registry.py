@@ -1,9 +1,15 @@
 from ..internal_types import *
+from ..metrics import REGISTRY_LOOKUPS, REGISTRY_REF_ALLOCATIONS, REGISTRY_RECORDS_CREATED
 if TYPE_CHECKING:
     from .model import FactoryTownModel
 else:
     FactoryTownModel = Any
 
+_get_ref_lookups = REGISTRY_LOOKUPS.fast_labels(op="get_ref")
+_try_get_lookups = REGISTRY_LOOKUPS.fast_labels(op="try_get")
+_ref_allocations = REGISTRY_REF_ALLOCATIONS.labels()
+_records_created = REGISTRY_RECORDS_CREATED.labels()
+
 class Record:
     """Base class for a factorytown metadata record that can be stored in a registry."""
     _registry: 'RecordRegistry'
@@ -16,6 +22,10 @@ class Record:
     _tags: Set[str]
     """Set of tags for grouping records (e.g., "Building", etc.)"""
     
+    _transient_fields: Tuple[str, ...] = ("_registry", "_record_name")
+    """Instance attributes that are derived from the record name or cached, and are therefore not part
+       of the record's content (see changeset.record_fields)."""
+    
     def __init__(self, registry: 'RecordRegistry', record_name: str):
         if type(self) is Record:
             raise TypeError("Record is an abstract class and cannot be instantiated directly.")
@@ -55,6 +65,11 @@ class Record:
     def tags(self) -> Set[str]:
         return self._tags
     
+    def invalidate_cached_fields(self):
+        """Called after fields have been assigned directly (e.g., when merging a change set), to discard
+           any values cached from them."""
+        pass
+    
     def common_str(self) -> str:
         name_desc = f"name={self.record_name!r}" if self._display_name is None else f"record_name={self.record_name!r}, display_name={self.display_name!r}"
         return f"{name_desc}, tags={self.tags}"
@@ -174,6 +189,8 @@ class RecordRegistry:
        is referenced but has not been instantiated, the value is None."""
     _len: int = 0
     """The number of records in the registry (not including uninstantiated references)."""
+    _generation: int = 0
+    """Incremented whenever a record is created or a new name is referenced."""
     
     def __init__(self, model: 'FactoryTownModel', name: str):
         self.model = model
@@ -199,6 +216,8 @@ class RecordRegistry:
         record = RecordRef[T](self, record_name, record_class)._instantiate()
         self._registry[record_name] = record
         self._len += 1
+        self._generation += 1
+        _records_created.inc()
         return record
         
     def get_ref(self, id: RecordId, record_class: Type[T]=Record) -> RecordRef[T]:
@@ -206,8 +225,11 @@ class RecordRegistry:
            to it, or the record itself. If the record does not exist and is not already referenced,
            marks the record name as referenced--the record must be created later."""
         name = self.get_record_name(id)
+        _get_ref_lookups.inc()
         if not name in self._registry:
             self._registry[name] = None
+            self._generation += 1
+            _ref_allocations.inc()
         existing = self._registry.get(name)
         assert existing is None or isinstance(existing, record_class)
         ref = RecordRef[T](self, name, record_class, existing)
@@ -219,9 +241,12 @@ class RecordRegistry:
            None is returned."""
         name = self.get_record_name(id)        
         record = self._registry.get(name)
+        _try_get_lookups.inc()
         assert record is None or isinstance(record, record_class)
-        if record is None:
+        if record is None and not name in self._registry:
             self._registry[name] = None
+            self._generation += 1
+            _ref_allocations.inc()
         return record
     
     def get(self, id: RecordId, record_class: Type[T]=Record) -> T:
@@ -242,6 +267,12 @@ class RecordRegistry:
         record = self.get(record_name)
         return record
     
+    @property
+    def generation(self) -> int:
+        """A counter that changes whenever records are created or newly referenced. Used to
+           invalidate data derived from the registry."""
+        return self._generation
+
     def contains_ref(self, record_name: str) -> bool:
         """Returns True if the record exists or is referenced"""
         return record_name in self._registry
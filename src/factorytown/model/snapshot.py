@@ -0,0 +1,20 @@
+from ..internal_types import *
+from .model import FactoryTownModel
+from .changeset import ChangeSet, merge_change_sets
+
+import json
+
+def save_snapshot(model: FactoryTownModel, filename: str, source: str="snapshot"):
+    """Saves the content of a model to a JSON file that load_snapshot() can read back."""
+    change_set = ChangeSet.from_model(model, source=source)
+    with open(filename, 'w') as f:
+        json.dump(change_set.to_jsonable(), f, indent=1, sort_keys=True)
+        f.write("\n")
+
+def load_snapshot(filename: str) -> FactoryTownModel:
+    """Loads a model saved with save_snapshot()."""
+    with open(filename, 'r') as f:
+        data = json.load(f)
+    model = FactoryTownModel()
+    merge_change_sets(model.records, [ChangeSet.from_jsonable(data)])
+    return model
@@ -1 +1,12 @@
-from .model_scrape import scrape_model, FactoryTownModel
+from .model_scrape import scrape_model, scrape_change_set, PAGE_SCRAPERS, FactoryTownModel
+
+from .crawler import (
+    DEFAULT_CRAWL_WORKERS,
+    CrawlFrontier,
+    CrawlResult,
+    is_crawlable_name,
+    crawl_seeds,
+    fetch_item_page,
+    crawl_model,
+)
+from .item_pages import RECIPE_COLUMN_ALIASES, scrape_item_page, assume_product_quantities
@@ -9,12 +9,18 @@ from ..model import (
     Recipe,
 )
 
+from ..profiling import profiled
+
 from .util import (
     parse_page,
+    parse_page_tables,
     WikiText,
     Table,
     TableReader,
     TableRow,
+    StreamingTableReader,
+    ColumnConverter,
+    batch_converter,
     split_md_template,
     strip_md_template,
     strip_md_item_template,
@@ -26,13 +32,31 @@ from logging import getLogger
 
 logger = getLogger(__name__)
 
+BUILDING_COLUMNS = [
+    "Building",
+    "Size",
+    "Tech Lv.",
+    "Research Required",
+    "Shared Inventory",
+    "Capacity",
+    "Ingredients",
+  ]
+"""The Buildings page columns read by scrape_buildings. Not every table has every column."""
+
+BUILDING_CONVERTERS: Dict[str, ColumnConverter] = {
+    "Size": batch_converter(GridDim.parse),
+    "Tech Lv.": batch_converter(int),
+}
+
+@profiled()
 def scrape_buildings(model: FactoryTownModel, force: Optional[bool]=False) -> None:
-    wt = parse_page("Buildings", force)
-    storage = TableReader(wt.tables[0], "Storage")
-    production = TableReader(wt.tables[1], "Production")
-    market = TableReader(wt.tables[2], "Market")
+    tables = parse_page_tables("Buildings", force)
+    groups = [
+        StreamingTableReader(tables[i], name, BUILDING_COLUMNS, BUILDING_CONVERTERS)
+        for i, name in enumerate(["Storage", "Production", "Market"])
+      ]
     
-    for group in [storage, production, market]:
+    for group in groups:
         logger.debug(f"Processing group: {group.name}")
         logger.debug(f"Headers: {group.headers}")
         building_type = group.name
@@ -44,9 +68,9 @@ def scrape_buildings(model: FactoryTownModel, force: Optional[bool]=False) -> No
                 continue
             building: Building = model.records.get_or_create(name, Building)
             building.building_type = building_type
-            building.grid_size = GridDim.parse(row["Size"])
-            building.tech_level = int(row["Tech Lv."])
-            research_name = row["Research Required"].strip()
+            building.grid_size = row["Size"]
+            building.tech_level = row["Tech Lv."]
+            research_name = row["Research Required"]
             if research_name == "" or research_name == "N/A":
                 research_name = None
             research_record_name = None if research_name is None else Research.get_record_name(research_name)
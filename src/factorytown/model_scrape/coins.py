@@ -4,11 +4,13 @@ from ..model import (
     FactoryTownModel,
     Coins,
 )
+from ..profiling import profiled
 
 from logging import getLogger
 
 logger = getLogger(__name__)
 
+@profiled()
 def scrape_coins(model: FactoryTownModel, force: Optional[bool]=False) -> None:
     for color in ["Yellow", "Red", "Blue", "Purple", "Star"]:
         record_name = f"{color} Coins"
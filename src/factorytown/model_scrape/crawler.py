@@ -0,0 +1,228 @@
+"""
+A crawler that scrapes the wiki's per-item pages, following links as it finds them.
+
+The Buildings page names every building, and the ingredients it lists reference items that are not
+instantiated (RecordRegistry.missing_keys()). The crawler starts from those names, fetches each one's page
+(e.g. "Cactus_Fruit" for "Cactus Fruit"), adds the recipes on it (see scrape_item_page), and queues the
+names of the page's {{Item|...}} links and of any newly referenced records.
+
+Pages are fetched and their tables parsed by up to max_workers threads (the fetch scheduler limits the
+actual request rate), while the model is only changed from the calling thread, one page at a time and in
+the order the pages were taken from the frontier, so the result does not depend on which fetch finishes
+first.
+"""
+
+from ..internal_types import *
+
+from ..model import (
+    FactoryTownModel,
+    Building,
+    Item,
+    Recipe,
+)
+from ..mdparse import get_table_parser_backend, TokenizedTable
+from ..raw_scrape import get_page_markdown
+from ..profiling import profiled, span
+from ..metrics import REGISTRY_DANGLING_REFS
+
+from .item_pages import scrape_item_page, assume_product_quantities
+from .util import find_item_links, get_record_page
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque
+import heapq
+import time
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_CRAWL_WORKERS = 8
+
+def is_crawlable_name(record_name: str) -> bool:
+    """Returns True if a record name can be the name of a game object with its own page: research records
+       ("[Research]...") and recipes ("building.product.variant") cannot."""
+    return not record_name.startswith("[") and "." not in record_name
+
+class CrawlFrontier:
+    """A priority queue of record names to crawl. Names found closer to the seeds come first, and among
+       names at the same depth, those linked from more pages so far. Each name is taken at most once."""
+    _heap: List[Tuple[int, int, int, str]]
+    _depth: Dict[str, int]
+    _links: Dict[str, int]
+    _taken: Set[str]
+    _seq: int = 0
+
+    def __init__(self):
+        self._heap = []
+        self._depth = {}
+        self._links = {}
+        self._taken = set()
+
+    def add(self, record_name: str, depth: int, link: bool=True):
+        """Queues a name found at depth, counting it as one more link to the name if link is True. Names
+           already taken are ignored."""
+        if record_name in self._taken:
+            return
+        depth = min(depth, self._depth.get(record_name, depth))
+        links = self._links.get(record_name, 0) + (1 if link else 0)
+        if self._depth.get(record_name) == depth and self._links.get(record_name) == links:
+            return
+        self._depth[record_name] = depth
+        self._links[record_name] = links
+        # Entries are not updated in place; an outdated entry is skipped when it reaches the top.
+        heapq.heappush(self._heap, (depth, -links, self._seq, record_name))
+        self._seq += 1
+
+    def pop(self) -> Optional[Tuple[str, int]]:
+        """Takes the highest priority name and returns it with its depth, or returns None if none is
+           queued."""
+        while len(self._heap) > 0:
+            depth, neg_links, _, record_name = heapq.heappop(self._heap)
+            if record_name in self._taken or depth != self._depth[record_name] or -neg_links != self._links[record_name]:
+                continue
+            self._taken.add(record_name)
+            return record_name, depth
+        return None
+
+    def __contains__(self, record_name: str) -> bool:
+        """Returns True if the name has been queued or taken."""
+        return record_name in self._depth
+
+    def __len__(self) -> int:
+        """The number of names queued and not yet taken."""
+        return len(self._depth) - len(self._taken)
+
+class CrawlResult(NamedTuple):
+    pages: int
+    """Pages fetched and scraped."""
+
+    failed: Dict[str, str]
+    """Error description by record name, for pages that could not be fetched or parsed."""
+
+    recipes: int
+    """Distinct recipes added or confirmed by the crawled pages."""
+
+    items_created: int
+    assumed_quantities: int
+    """Recipes listed only on their products' pages, whose product quantity was assumed to be 1."""
+
+    remaining: int
+    """Names still queued when max_pages was reached."""
+
+    seconds: float
+
+    def to_jsonable(self) -> JsonableDict:
+        return self._asdict()
+
+def crawl_seeds(model: FactoryTownModel) -> List[str]:
+    """Returns the names the crawl starts from: every building, then every referenced but uninstantiated
+       record that may be a game object, each group sorted."""
+    buildings = sorted(x.record_name for x in model.records.values(Building))
+    missing = sorted(x for x in model.records.missing_keys() if is_crawlable_name(x))
+    return buildings + missing
+
+def fetch_item_page(record_name: str, force: Optional[bool]=False) -> Tuple[str, List[TokenizedTable]]:
+    """Fetches the page of a record and parses its tables. Returns the page's wikitext and tables."""
+    markdown = get_page_markdown(get_record_page(record_name), bool(force))
+    backend = get_table_parser_backend()
+    with span(f"parse_tables[{backend.name}]"):
+        return markdown, backend.parse_tables(markdown)
+
+def _building_name(recipe: Recipe) -> Optional[str]:
+    if recipe._building is None or isinstance(recipe._building, UnsetType):
+        return None
+    return recipe._building.record_name
+
+def _recipe_ref_names(recipe: Recipe) -> Iterator[str]:
+    """Yields the names of the records a recipe references: its building, products and ingredients."""
+    building_name = _building_name(recipe)
+    if building_name is not None:
+        yield building_name
+    for refs in (recipe._product_refs, recipe._ingredient_refs):
+        if not isinstance(refs, UnsetType):
+            for ref in refs:
+                yield ref.obj_ref.record_name
+
+@profiled()
+def crawl_model(
+        model: FactoryTownModel,
+        force: Optional[bool]=False,
+        max_workers: int=DEFAULT_CRAWL_WORKERS,
+        max_pages: Optional[int]=None,
+        seeds: Optional[Iterable[str]]=None,
+      ) -> CrawlResult:
+    """Crawls the per-item pages reachable from seeds (by default crawl_seeds(model)) into model, fetching
+       up to max_workers pages at once and at most max_pages pages in all. A crawled page whose record is
+       not yet instantiated, and is not used as a building, is instantiated as an Item. Pages that fail
+       are reported in the result rather than raised."""
+    start = time.perf_counter()
+    frontier = CrawlFrontier()
+    for name in (crawl_seeds(model) if seeds is None else seeds):
+        frontier.add(name, 0, link=False)
+    in_flight: Deque[Tuple[str, int, 'Future[Tuple[str, List[TokenizedTable]]]']] = deque()
+    failed: Dict[str, str] = {}
+    recipes: Set[str] = set()
+    # Kept up to date from each page's recipes, so a page costs time in its own size, not the model's.
+    building_names = set(
+        name for name in (_building_name(x) for x in model.records.values(Recipe)) if name is not None
+      )
+    n_started = 0
+    n_pages = 0
+    n_items = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while len(in_flight) < max_workers and (max_pages is None or n_started < max_pages):
+                entry = frontier.pop()
+                if entry is None:
+                    break
+                name, depth = entry
+                in_flight.append((name, depth, executor.submit(fetch_item_page, name, force)))
+                n_started += 1
+            if len(in_flight) == 0:
+                break
+            name, depth, future = in_flight.popleft()
+            try:
+                markdown, tables = future.result()
+            except Exception as ex:
+                logger.info(f"Could not crawl {name!r}: {ex}")
+                failed[name] = f"{ex.__class__.__name__}: {ex}"
+                continue
+            n_pages += 1
+            with span("scrape_item_page"):
+                page_recipes = scrape_item_page(model, name, tables)
+            recipes.update(page_recipes)
+            page_refs: Set[str] = set()
+            for recipe_name in page_recipes:
+                recipe = model.records.try_get(recipe_name, Recipe)
+                assert recipe is not None
+                building_name = _building_name(recipe)
+                if building_name is not None:
+                    building_names.add(building_name)
+                page_refs.update(_recipe_ref_names(recipe))
+            if name not in model.records and name not in building_names:
+                model.records.create(name, Item)
+                n_items += 1
+            for link in find_item_links(markdown):
+                if is_crawlable_name(link) and link != name:
+                    frontier.add(link, depth + 1)
+            # The records this page newly referenced are among those its recipes reference.
+            for missing in sorted(page_refs):
+                if missing not in model.records and is_crawlable_name(missing) and missing not in frontier:
+                    frontier.add(missing, depth + 1, link=False)
+    assumed = assume_product_quantities(model, sorted(recipes))
+    if len(assumed) > 0:
+        logger.info(f"Assumed a product quantity of 1 for {len(assumed)} recipes listed only on their products' pages")
+    REGISTRY_DANGLING_REFS.set(len(model.records.missing_keys()))
+    result = CrawlResult(
+        pages=n_pages,
+        failed=failed,
+        recipes=len(recipes),
+        items_created=n_items,
+        assumed_quantities=len(assumed),
+        remaining=len(frontier),
+        seconds=time.perf_counter() - start,
+      )
+    logger.debug(f"Crawl finished: {result}")
+    return result
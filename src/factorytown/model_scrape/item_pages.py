@@ -0,0 +1,128 @@
+from ..internal_types import *
+
+from ..model import (
+    FactoryTownModel,
+    Building,
+    GameObject,
+    Recipe,
+)
+from ..model.recipe import CountedGameObjectRefList
+from ..mdparse import Table
+
+from .util import (
+    StreamingTableReader,
+    split_md_template,
+    parse_counted_game_object_ref_list,
+    parse_leading_int,
+)
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+RECIPE_COLUMN_ALIASES: Dict[str, List[str]] = {
+    "product": ["Product", "Products", "Output", "Produces"],
+    "building": ["Building", "Made In", "Produced In", "Crafted In"],
+    "ingredients": ["Ingredients", "Input", "Inputs"],
+    "work_units": ["Work Units", "Work", "Work Required"],
+}
+"""Header names, by role, that identify the columns of a recipe table on a per-item page. A table is a
+   recipe table if it has ingredients and work_units columns and at least one of product and building;
+   the missing one is the page's own record (an item page lists the buildings that make it, a building
+   page the products it makes)."""
+
+RECIPE_COLUMNS = [c for aliases in RECIPE_COLUMN_ALIASES.values() for c in aliases]
+
+def _find_column(reader: StreamingTableReader, role: str) -> Optional[str]:
+    for column in RECIPE_COLUMN_ALIASES[role]:
+        if reader.has_column(column):
+            return column
+    return None
+
+def _counted_key(refs: CountedGameObjectRefList) -> List[Tuple[str, int]]:
+    return sorted((x.obj_ref.record_name, x.quantity) for x in refs)
+
+def _merge_recipe(
+        recipe: Recipe,
+        products: Optional[CountedGameObjectRefList],
+        ingredients: CountedGameObjectRefList,
+        work_units: Optional[int],
+      ) -> bool:
+    """Fills in a recipe's products, ingredients and work units. The same recipe is usually listed on both
+       its product's page and its building's page; if the pages disagree, the values already set are kept
+       and False is returned. products is None if the page does not say how many of each product the
+       recipe makes (an item page); the product's name is then known only from the recipe's name, and its
+       quantity is left for a building's page to fill in (see assume_product_quantities)."""
+    if products is not None and recipe.n_products > 0 and _counted_key(recipe.product_refs) != _counted_key(products):
+        return False
+    if not isinstance(recipe._ingredient_refs, UnsetType) and _counted_key(recipe.ingredient_refs) != _counted_key(ingredients):
+        return False
+    if work_units is not None and not isinstance(recipe._work_units, UnsetType) and recipe.work_units != work_units:
+        return False
+    if products is not None and recipe.n_products == 0:
+        for product in products:
+            recipe.add_product(product.obj_ref, product.quantity)
+    if isinstance(recipe._ingredient_refs, UnsetType):
+        recipe.ingredients = ingredients
+    if work_units is not None:
+        recipe.work_units = work_units
+    return True
+
+def assume_product_quantities(model: FactoryTownModel, recipe_names: Iterable[str]) -> List[str]:
+    """Gives each of the named recipes that still has no products (because it was only listed on its
+       product's page) its primary product, in a quantity of 1. Returns the names of the recipes changed."""
+    assumed: List[str] = []
+    for recipe_name in recipe_names:
+        recipe = model.records.try_get(recipe_name, Recipe)
+        if recipe is not None and recipe.n_products == 0:
+            recipe.set_product(Recipe.parse_record_name(recipe_name)[1], 1)
+            assumed.append(recipe_name)
+    return assumed
+
+def scrape_item_page(model: FactoryTownModel, record_name: str, tables: Sequence[Table]) -> List[str]:
+    """Adds the recipes listed in the recipe tables (see RECIPE_COLUMN_ALIASES) of the per-item page of
+       record_name, filling in their products, ingredients and work units. Rows that cannot be parsed, or
+       that disagree with a recipe already scraped from another page, are skipped with a warning. Returns
+       the record names of the recipes added or confirmed, in table order. Recipes listed only on their
+       product's page are left without products; see assume_product_quantities."""
+    registry = model.records
+    page_record = registry.try_get(record_name) if record_name in registry else None
+    recipe_names: List[str] = []
+    for i, table in enumerate(tables):
+        reader = StreamingTableReader(table, f"{record_name}[{i}]", RECIPE_COLUMNS)
+        product_col = _find_column(reader, "product")
+        building_col = _find_column(reader, "building")
+        ingredients_col = _find_column(reader, "ingredients")
+        work_col = _find_column(reader, "work_units")
+        if ingredients_col is None or work_col is None or (product_col is None and building_col is None):
+            continue
+        if building_col is None and page_record is not None and not isinstance(page_record, Building):
+            logger.warning(f"Skipping table {reader.name}: lists products, but {record_name!r} is not a building")
+            continue
+        for row in reader:
+            try:
+                products: Optional[CountedGameObjectRefList] = None
+                if product_col is not None:
+                    products = parse_counted_game_object_ref_list(registry, row[product_col])
+                if building_col is None:
+                    building_name = record_name
+                else:
+                    building_name = split_md_template(row[building_col])[1]
+                ingredients = parse_counted_game_object_ref_list(registry, row[ingredients_col])
+            except (AssertionError, ValueError) as ex:
+                logger.warning(f"Skipping unparseable row {reader.name}[{row.index}]: {row.row_data} ({ex!r})")
+                continue
+            if (products is not None and len(products) == 0) or building_name in ("", "N/A"):
+                continue
+            building = registry.try_get(building_name) if building_name in registry else None
+            if building is not None and not isinstance(building, Building):
+                logger.warning(f"Skipping row {reader.name}[{row.index}]: {building_name!r} is not a building")
+                continue
+            product_name = record_name if products is None else products[0].obj_ref.record_name
+            recipe_name = Recipe.create_record_name(building_name, product_name)
+            recipe = registry.get_or_create(recipe_name, Recipe)
+            if not _merge_recipe(recipe, products, ingredients, parse_leading_int(row[work_col])):
+                logger.warning(f"Recipe {recipe_name!r} on page {record_name!r} conflicts with {recipe}; keeping the first")
+                continue
+            recipe_names.append(recipe_name)
+    return recipe_names
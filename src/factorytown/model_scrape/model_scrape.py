@@ -2,14 +2,77 @@ from ..internal_types import *
 
 from ..model import (
     FactoryTownModel,
+    ChangeSet,
+    merge_change_sets,
 )
 
+from ..profiling import profiled, span
+from ..metrics import REGISTRY_DANGLING_REFS
+
 from .buildings import scrape_buildings
 from .coins import scrape_coins
+from .crawler import crawl_model, DEFAULT_CRAWL_WORKERS
+
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+PageScraper = Callable[[FactoryTownModel, Optional[bool]], None]
+
+PAGE_SCRAPERS: Dict[str, PageScraper] = {
+    "coins": scrape_coins,
+    "buildings": scrape_buildings,
+}
+"""The scrapers that make up the model, by name, in the order their results are merged."""
+
+@profiled()
+def scrape_change_set(scraper_name: str, force: Optional[bool]=False) -> ChangeSet:
+    """Runs one page scraper into a fresh model and returns its records as a change set."""
+    model = FactoryTownModel()
+    PAGE_SCRAPERS[scraper_name](model, force)
+    return ChangeSet.from_model(model, source=scraper_name)
+
+@profiled()
+def scrape_model(
+        *,
+        force: Optional[bool]=False,
+        model: Optional[FactoryTownModel]=None,
+        jobs: Optional[int]=1,
+        crawl: bool=False,
+        crawl_workers: int=DEFAULT_CRAWL_WORKERS,
+        max_pages: Optional[int]=None,
+      ) -> FactoryTownModel:
+    """Scrapes the wiki into a model.
+
+    Args:
+        force: Force refresh of the cache.
+        model: An existing model to add to. A new model is created if None.
+        jobs: Number of worker processes. With 1 (the default), the page scrapers run one after another
+            directly against the model. Otherwise each scraper runs in a worker process into its own
+            model, and the resulting change sets are merged in PAGE_SCRAPERS order, so the result does
+            not depend on which worker finishes first. None uses the CPU count.
+        crawl: After the page scrapers, crawl the per-item pages they link to (see crawl_model).
+        crawl_workers: Pages the crawl fetches at once.
+        max_pages: The most pages the crawl fetches. None is unlimited.
 
-def scrape_model(*, force: Optional[bool]=False, model: Optional[FactoryTownModel]=None) -> FactoryTownModel:
+    Raises:
+        ModelMergeError: If scrapers disagree on the value of a field. The error lists every conflict.
+    """
     if model is None:
         model = FactoryTownModel()
-    scrape_coins(model, force)
-    scrape_buildings(model, force)
+    if jobs == 1:
+        for scraper in PAGE_SCRAPERS.values():
+            scraper(model, force)
+    else:
+        names = list(PAGE_SCRAPERS)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            change_sets = list(executor.map(scrape_change_set, names, [force] * len(names)))
+        for change_set in change_sets:
+            logger.debug(f"Scraper {change_set.source!r} produced {len(change_set.records)} records")
+        with span("merge_change_sets"):
+            merge_change_sets(model.records, change_sets)
+    if crawl:
+        crawl_model(model, force, max_workers=crawl_workers, max_pages=max_pages)
+    REGISTRY_DANGLING_REFS.set(len(model.records.missing_keys()))
     return model
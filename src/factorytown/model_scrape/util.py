@@ -1,14 +1,34 @@
 import re
 
 from ..internal_types import *
-from ..raw_scrape import get_page_html, get_page_markdown, get_page_asset
-from ..mdparse import parse_markdown, WikiText, Table
+from ..raw_scrape import get_page_html, get_page_markdown, open_page_asset
+from ..mdparse import parse_markdown, get_table_parser_backend, WikiText, Table, TokenizedTable
 from ..model import GridDim, RecordRegistry, GameObject
 from ..model.recipe import CountedGameObjectRef, CountedGameObjectRefList
+from ..profiling import profiled, span
 
 item_count_re = re.compile(r"\s*(\d+)\s*x\s+(.*)")
 """A pattern that indicataes a quantity followed by an item name, in the form f"{quantity}x {item_name}"."""
 
+item_link_re = re.compile(r"\{\{\s*Item\s*\|\s*([^|{}]+?)\s*(?:\|[^{}]*)?\}\}")
+"""A pattern that matches an {{Item|name}} template anywhere in wikitext, capturing the name."""
+
+leading_int_re = re.compile(r"\s*(\d+)")
+
+def find_item_links(markdown: str) -> List[str]:
+    """Returns the distinct item names linked with {{Item|...}} templates in wikitext, in order of first
+       appearance."""
+    return list(dict.fromkeys(m.group(1) for m in item_link_re.finditer(markdown)))
+
+def parse_leading_int(val: str) -> Optional[int]:
+    """Parses the integer at the start of a cell such as "30" or "30 WU", or returns None if there is none."""
+    m = leading_int_re.match(val)
+    return None if m is None else int(m.group(1))
+
+def get_record_page(record_name: str) -> str:
+    """Returns the wiki page name of a game object's record name, e.g. "Cactus_Fruit" for "Cactus Fruit"."""
+    return record_name.replace(" ", "_")
+
 def parse_counted_game_object_ref_list(registry: RecordRegistry, val: str) -> CountedGameObjectRefList:
     val = val.strip()
     result: CountedGameObjectRefList = []
@@ -71,8 +91,26 @@ def parse_counted_game_object_ref_list(registry: RecordRegistry, val: str) -> Co
             
     return result
 
+@profiled()
 def parse_page(page: str, force: Optional[bool]=False) -> WikiText:
-    return parse_markdown(get_page_markdown(page, force))
+    markdown = get_page_markdown(page, force)
+    with span("parse_markdown"):
+        return parse_markdown(markdown)
+
+@profiled()
+def parse_page_tables(page: str, force: Optional[bool]=False) -> List[TokenizedTable]:
+    """Returns the top-level tables of a page, parsed with the selected table parser backend (see
+       get_table_parser_backend)."""
+    markdown = get_page_markdown(page, force)
+    backend = get_table_parser_backend()
+    with span(f"parse_tables[{backend.name}]"):
+        return backend.parse_tables(markdown)
+
+def normalize_table_header(header: str) -> str:
+    result = header.strip()
+    result = result.replace("<br>", " ")
+    result = ' '.join(result.split())
+    return result
 
 class TableRow:
     reader: 'TableReader'
@@ -114,17 +152,16 @@ class TableReader:
     def __init__(self, table: Table, name: str):
         self.table = table
         self.name = name
-        d = table.data()
-        self._table_headers = [ self.normalize_header(x) for x in d[0]]
-        self._table_data = d[1:]
-        self._header_map = {h: i for i, h in enumerate(self._table_headers)}
-        self._rows = [TableRow(self, i) for i in range(len(self))]
+        with span("TableReader.data"):
+            d = table.data()
+        with span("TableReader.index"):
+            self._table_headers = [ self.normalize_header(x) for x in d[0]]
+            self._table_data = d[1:]
+            self._header_map = {h: i for i, h in enumerate(self._table_headers)}
+            self._rows = [TableRow(self, i) for i in range(len(self))]
         
     def normalize_header(self, header: str) -> str:
-        result = header.strip()
-        result = result.replace("<br>", " ")
-        result = ' '.join(result.split())
-        return result
+        return normalize_table_header(header)
         
     @property
     def headers(self) -> List[str]:
@@ -164,3 +201,138 @@ class TableReader:
     
     def __repr__(self):
         return str(self)
+
+ColumnConverter = Callable[[List[str]], List[Any]]
+"""Converts a batch of cleaned cell values from one column into typed values."""
+
+def batch_converter(convert: Callable[[str], Any]) -> ColumnConverter:
+    """Makes a ColumnConverter that applies a per-cell conversion function to each value in a batch."""
+    def convert_batch(values: List[str]) -> List[Any]:
+        return [convert(v) for v in values]
+    return convert_batch
+
+def iter_table_rows(table: Table) -> Iterator[List[str]]:
+    """Yields the raw rows of a table, header row first. Tables that can produce their rows lazily
+       (i.e., that have an iter_rows() method) are read lazily; others are read with data()."""
+    iter_rows = getattr(table, "iter_rows", None)
+    if iter_rows is not None:
+        yield from iter_rows()
+    else:
+        yield from table.data()
+
+class StreamingTableRow:
+    """A row produced by StreamingTableReader. Holds only the projected columns, already cleaned and
+       converted."""
+    __slots__ = ("reader", "index", "values")
+    reader: 'StreamingTableReader'
+    index: int
+    values: List[Any]
+
+    def __init__(self, reader: 'StreamingTableReader', index: int, values: List[Any]):
+        self.reader = reader
+        self.index = index
+        self.values = values
+
+    def __getitem__(self, col: int|str) -> Any:
+        if isinstance(col, str):
+            col = self.reader._column_map[col]
+        return self.values[col]
+
+    def has_column(self, col: int|str) -> bool:
+        return self.reader.has_column(col)
+
+    @property
+    def row_data(self) -> Dict[str, Any]:
+        return dict(zip(self.reader.columns, self.values))
+
+    def __str__(self):
+        return f"StreamingTableRow({self.reader.name}[{self.index}] = {self.row_data})"
+
+    def __repr__(self):
+        return str(self)
+
+class StreamingTableReader:
+    """Reads table rows lazily, extracting and cleaning only the requested columns.
+
+       Unlike TableReader, no row matrix or per-row objects are kept: rows are read from the table in
+       batches of batch_size, each projected column of the batch is cleaned and then converted with one
+       call to its ColumnConverter, and the rows are yielded. Requested columns that the table does not
+       have are left out, so has_column() can be used to handle optional columns.
+    """
+    table: Table
+    name: str
+    headers: List[str]
+    """All normalized headers of the table."""
+
+    columns: List[str]
+    """The projected columns present in the table, in the requested order."""
+
+    converters: Dict[str, ColumnConverter]
+    batch_size: int
+    _column_map: Dict[str, int]
+    _source_indices: List[int]
+    _rows: Iterator[List[str]]
+    _consumed: bool = False
+
+    def __init__(
+            self,
+            table: Table,
+            name: str,
+            columns: Optional[Sequence[str]]=None,
+            converters: Optional[Mapping[str, ColumnConverter]]=None,
+            batch_size: int=256,
+          ):
+        self.table = table
+        self.name = name
+        self._rows = iter_table_rows(table)
+        header_row = next(self._rows, None)
+        self.headers = [] if header_row is None else [ normalize_table_header(x or "") for x in header_row ]
+        header_map = {h: i for i, h in enumerate(self.headers)}
+        if columns is None:
+            columns = self.headers
+        self.columns = [c for c in columns if c in header_map]
+        self._column_map = {c: i for i, c in enumerate(self.columns)}
+        self._source_indices = [header_map[c] for c in self.columns]
+        self.converters = {} if converters is None else dict(converters)
+        self.batch_size = batch_size
+
+    def has_column(self, col: int|str) -> bool:
+        if isinstance(col, str):
+            return col in self._column_map
+        return 0 <= col < len(self.columns)
+
+    def __iter__(self) -> Iterator[StreamingTableRow]:
+        if self._consumed:
+            raise FactoryTownError(f"Streaming table {self.name!r} can only be iterated once")
+        self._consumed = True
+        index = 0
+        batch: List[List[str]] = []
+        for raw in self._rows:
+            batch.append(raw)
+            if len(batch) >= self.batch_size:
+                yield from self._convert_batch(index, batch)
+                index += len(batch)
+                batch = []
+        if len(batch) > 0:
+            yield from self._convert_batch(index, batch)
+
+    def _convert_batch(self, start_index: int, batch: List[List[str]]) -> Iterator[StreamingTableRow]:
+        columns: List[List[Any]] = []
+        with span("StreamingTableReader.convert_batch"):
+            for column, source_index in zip(self.columns, self._source_indices):
+                values = [
+                    (raw[source_index] or "").strip() if source_index < len(raw) else ""
+                    for raw in batch
+                  ]
+                converter = self.converters.get(column)
+                if converter is not None:
+                    values = converter(values)
+                columns.append(values)
+        for i in range(len(batch)):
+            yield StreamingTableRow(self, start_index + i, [c[i] for c in columns])
+
+    def __str__(self):
+        return f"StreamingTableReader(name={self.name}, columns={self.columns})"
+
+    def __repr__(self):
+        return str(self)
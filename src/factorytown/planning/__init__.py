@@ -0,0 +1,20 @@
+from .requirements import (
+    Scenario,
+    Requirements,
+    evaluate_requirements,
+    evaluate_item_costs,
+    is_building_available,
+    is_recipe_available,
+)
+from .sweep import run_sweep, SweepResult, ScenarioEvaluator
+from .availability import AvailabilityIndex, iter_bits
+from .research_planner import ResearchPlan, ResearchPlanner, plan_research
+from .valuation import (
+    MarketPrices,
+    MarketPriceTable,
+    MarketValuation,
+    ItemCost,
+    RankedYield,
+    VALUATION_MEASURES,
+    get_market_valuation,
+)
@@ -0,0 +1,148 @@
+from ..internal_types import *
+from ..model import FactoryTownModel, CompactModel, Research, NO_ID
+
+class AvailabilityIndex:
+    """Precomputed bitsets answering "what can be built with these researches at tech level N".
+
+       Bit i of each bitset corresponds to record id i of the CompactModel. Buildings and recipes are
+       subject to availability; a building requires its own tech level and research, and a recipe
+       requires everything needed by the building that runs it and by any building it constructs.
+
+       Availability for a (tech level, research set) pair is then:
+
+           tech_mask[N] & ~(OR of requires[r] for each research r not in the set)
+    """
+    cm: CompactModel
+    max_tech_level: int
+    subject_mask: int
+    """Bitset of the buildings and recipes that availability applies to."""
+
+    _tech_masks: List[int]
+    """_tech_masks[N] is the bitset of subject records whose tech level requirement is <= N."""
+
+    _research_masks: Dict[int, int]
+    """Bitset of subject records requiring each research id."""
+
+    _class_masks: Dict[str, int]
+    _tech_requirements: List[int]
+    _research_requirements: List[AbstractSet[int]]
+
+    def __init__(self, cm: CompactModel):
+        self.cm = cm
+        n = len(cm)
+        tech_requirements = [0] * n
+        research_requirements: List[AbstractSet[int]] = [frozenset()] * n
+        subject_mask = 0
+        class_masks: Dict[str, int] = {}
+
+        def building_requirements(building_id: int) -> Tuple[int, AbstractSet[int]]:
+            tech = max(0, cm.tech_levels[building_id])
+            research_id = cm.research[building_id]
+            return tech, frozenset() if research_id == NO_ID else frozenset([research_id])
+
+        for i in range(n):
+            class_name = cm.classes[i]
+            if class_name != "":
+                class_masks[class_name] = class_masks.get(class_name, 0) | (1 << i)
+            if class_name == "Building":
+                tech_requirements[i], research_requirements[i] = building_requirements(i)
+                subject_mask |= 1 << i
+            elif class_name == "Recipe":
+                buildings = [p for p, _ in cm.products[i] if cm.classes[p] == "Building"]
+                if cm.recipe_buildings[i] != NO_ID:
+                    buildings.append(cm.recipe_buildings[i])
+                tech = 0
+                research: Set[int] = set()
+                for building_id in buildings:
+                    t, r = building_requirements(building_id)
+                    tech = max(tech, t)
+                    research |= r
+                tech_requirements[i] = tech
+                research_requirements[i] = frozenset(research)
+                subject_mask |= 1 << i
+
+        self.max_tech_level = max((tech_requirements[i] for i in range(n)), default=0)
+        tech_masks = [0] * (self.max_tech_level + 1)
+        research_masks: Dict[int, int] = {}
+        for i in range(n):
+            if not (subject_mask >> i) & 1:
+                continue
+            tech_masks[tech_requirements[i]] |= 1 << i
+            for research_id in research_requirements[i]:
+                research_masks[research_id] = research_masks.get(research_id, 0) | (1 << i)
+        for level in range(1, len(tech_masks)):
+            tech_masks[level] |= tech_masks[level - 1]
+
+        self.subject_mask = subject_mask
+        self._tech_masks = tech_masks
+        self._research_masks = research_masks
+        self._class_masks = class_masks
+        self._tech_requirements = tech_requirements
+        self._research_requirements = research_requirements
+
+    @classmethod
+    def from_model(cls, model: FactoryTownModel|CompactModel) -> Self:
+        return cls(model if isinstance(model, CompactModel) else CompactModel.from_model(model))
+
+    def research_id(self, research: str) -> int:
+        """Returns the record id of a research, given its name with or without the "[Research]" prefix."""
+        record_name = Research.get_record_name(research)
+        research_id = self.cm.try_id_of(record_name)
+        if research_id == NO_ID or self.cm.classes[research_id] != "Research":
+            raise FactoryTownError(f"Unknown research {research!r}")
+        return research_id
+
+    def tech_mask(self, tech_level: Optional[int]) -> int:
+        """Bitset of subject records whose tech level requirement is met at tech_level (None for no limit)."""
+        if tech_level is None or tech_level >= self.max_tech_level:
+            return self._tech_masks[-1] if len(self._tech_masks) > 0 else 0
+        if tech_level < 0:
+            return 0
+        return self._tech_masks[tech_level]
+
+    def research_mask(self, researches: Iterable[str|int]) -> int:
+        """Bitset of subject records whose research requirements are all in researches."""
+        done = {r if isinstance(r, int) else self.research_id(r) for r in researches}
+        blocked = 0
+        for research_id, mask in self._research_masks.items():
+            if research_id not in done:
+                blocked |= mask
+        return self.subject_mask & ~blocked
+
+    def class_mask(self, class_name: str) -> int:
+        return self._class_masks.get(class_name, 0)
+
+    def available_mask(self, tech_level: Optional[int], researches: Iterable[str|int]=()) -> int:
+        return self.tech_mask(tech_level) & self.research_mask(researches)
+
+    def available_names(self, tech_level: Optional[int], researches: Iterable[str|int]=(), class_name: Optional[str]=None) -> List[str]:
+        """Names of the buildings and recipes available, in record-name order."""
+        mask = self.available_mask(tech_level, researches)
+        if class_name is not None:
+            mask &= self.class_mask(class_name)
+        return [self.cm.names[i] for i in iter_bits(mask)]
+
+    def is_available(self, record_name: str, tech_level: Optional[int], researches: Iterable[str|int]=()) -> bool:
+        record_id = self.cm.id_of(record_name)
+        if not (self.subject_mask >> record_id) & 1:
+            return True
+        return (self.available_mask(tech_level, researches) >> record_id) & 1 == 1
+
+    def tech_requirement(self, record_id: int) -> int:
+        return self._tech_requirements[record_id]
+
+    def research_requirements(self, record_id: int) -> AbstractSet[int]:
+        return self._research_requirements[record_id]
+
+    def __str__(self):
+        return f"AvailabilityIndex(records={len(self.cm)}, max_tech_level={self.max_tech_level}, researches={len(self._research_masks)})"
+
+    def __repr__(self):
+        return str(self)
+
+def iter_bits(mask: int) -> Iterator[int]:
+    """Yields the indices of the set bits of a non-negative int, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
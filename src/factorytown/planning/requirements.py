@@ -0,0 +1,237 @@
+from ..internal_types import *
+from ..model import CompactModel, NO_ID
+from ..model.compact import CountedIdList
+
+class Scenario(NamedTuple):
+    """One point in a planning sweep: what to produce, and under which constraints."""
+
+    targets: Tuple[Tuple[str, float], ...]
+    """(record name, rate) pairs to produce."""
+
+    tech_level: Optional[int] = None
+    """The highest tech level that may be used, or None for no limit."""
+
+    excluded_buildings: Tuple[str, ...] = ()
+    """Names of buildings that may not be used."""
+
+    label: str = ""
+
+    @classmethod
+    def from_jsonable(cls, data: JsonableDict) -> Self:
+        targets = data.get("targets", {})
+        assert isinstance(targets, dict)
+        excluded = data.get("excluded_buildings", [])
+        assert isinstance(excluded, list)
+        tech_level = data.get("tech_level")
+        return cls(
+            targets=tuple((str(k), float(v)) for k, v in sorted(targets.items())),
+            tech_level=None if tech_level is None else int(tech_level),
+            excluded_buildings=tuple(sorted(str(x) for x in excluded)),
+            label=str(data.get("label", "")),
+          )
+
+    def to_jsonable(self) -> JsonableDict:
+        return dict(
+            targets={k: v for k, v in self.targets},
+            tech_level=self.tech_level,
+            excluded_buildings=list(self.excluded_buildings),
+            label=self.label,
+          )
+
+class Requirements(NamedTuple):
+    """The result of expanding a scenario's targets through the available recipes."""
+
+    raw_inputs: Dict[str, float]
+    """Rates of records that have no available producing recipe and must be supplied."""
+
+    crafts: Dict[str, float]
+    """Rate at which each used recipe must run."""
+
+    work_units: float
+    """Total work units per unit time across all crafts with known work units."""
+
+    unavailable: List[str]
+    """Targets or intermediates whose only producing recipes are excluded by the scenario."""
+
+    def to_jsonable(self) -> JsonableDict:
+        return dict(
+            raw_inputs=self.raw_inputs,
+            crafts=self.crafts,
+            work_units=self.work_units,
+            unavailable=self.unavailable,
+          )
+
+def is_building_available(cm: CompactModel, building_id: int, tech_level: Optional[int], excluded: AbstractSet[int]) -> bool:
+    if building_id in excluded:
+        return False
+    if tech_level is not None and cm.tech_levels[building_id] > tech_level:
+        return False
+    return True
+
+def is_recipe_available(cm: CompactModel, recipe_id: int, tech_level: Optional[int], excluded: AbstractSet[int]) -> bool:
+    building_id = cm.recipe_buildings[recipe_id]
+    if building_id != NO_ID and not is_building_available(cm, building_id, tech_level, excluded):
+        return False
+    for product_id, _ in cm.products[recipe_id]:
+        if cm.classes[product_id] == "Building" and not is_building_available(cm, product_id, tech_level, excluded):
+            return False
+    return True
+
+def _chosen_ingredients(cm: CompactModel, record_id: int, choose_recipe: Callable[[int], int]) -> CountedIdList:
+    recipe_id = choose_recipe(record_id)
+    return cm.ingredients[recipe_id] if recipe_id != NO_ID else ()
+
+def _search_recipe_graph(
+        cm: CompactModel,
+        roots: Iterable[int],
+        choose_recipe: Callable[[int], int],
+      ) -> Tuple[List[int], Set[Tuple[int, int]]]:
+    """Finds the records reached from roots through the ingredients of their chosen recipes, by a
+       depth-first search from the roots in order (without recursion, as chains can be deep). Returns them
+       in post-order, every record after the ingredients it reaches, together with the (record,
+       ingredient index) edges that lead back onto the search path and so close a recipe cycle."""
+    post_order: List[int] = []
+    on_path: Set[int] = set()
+    done: Set[int] = set()
+    cycle_edges: Set[Tuple[int, int]] = set()
+    for root_id in roots:
+        if root_id in done:
+            continue
+        stack: List[Tuple[int, CountedIdList, int]] = [(root_id, _chosen_ingredients(cm, root_id, choose_recipe), 0)]
+        on_path.add(root_id)
+        while len(stack) > 0:
+            record_id, ingredients, i = stack[-1]
+            if i < len(ingredients):
+                stack[-1] = (record_id, ingredients, i + 1)
+                ingredient_id = ingredients[i][0]
+                if ingredient_id in on_path:
+                    cycle_edges.add((record_id, i))
+                elif ingredient_id not in done:
+                    on_path.add(ingredient_id)
+                    stack.append((ingredient_id, _chosen_ingredients(cm, ingredient_id, choose_recipe), 0))
+                continue
+            stack.pop()
+            on_path.discard(record_id)
+            done.add(record_id)
+            post_order.append(record_id)
+    return post_order, cycle_edges
+
+def evaluate_requirements(cm: CompactModel, scenario: Scenario) -> Requirements:
+    """Expands the scenario's target rates into raw input rates.
+
+       Each record is produced with the lowest-id available recipe that produces it. Records with no
+       producing recipe at all are raw inputs; records whose producing recipes are all unavailable are
+       reported as unavailable and also counted as raw inputs. Recipe cycles are broken by treating the
+       ingredient that closes the cycle, as found by a depth-first search from the targets in order, as a
+       raw input of the recipe that uses it.
+
+       Requirements are linear in the target rates, so each record is expanded once, with its total rate,
+       in topological order; the time taken is linear in the size of the recipe graph reached.
+    """
+    excluded = { cm.try_id_of(x) for x in scenario.excluded_buildings } - { NO_ID }
+    raw_inputs: Dict[str, float] = {}
+    crafts: Dict[str, float] = {}
+    unavailable: Set[str] = set()
+    work_units = 0.0
+    chosen: Dict[int, int] = {}
+
+    def choose_recipe(record_id: int) -> int:
+        recipe_id = chosen.get(record_id)
+        if recipe_id is None:
+            recipe_id = NO_ID
+            producers = cm.producers(record_id)
+            for candidate in producers:
+                if is_recipe_available(cm, candidate, scenario.tech_level, excluded):
+                    recipe_id = candidate
+                    break
+            if recipe_id == NO_ID and len(producers) > 0:
+                unavailable.add(cm.names[record_id])
+            chosen[record_id] = recipe_id
+        return recipe_id
+
+    def add_raw_input(record_id: int, rate: float):
+        name = cm.names[record_id]
+        raw_inputs[name] = raw_inputs.get(name, 0.0) + rate
+
+    rates: Dict[int, float] = {}
+    for name, rate in scenario.targets:
+        record_id = cm.try_id_of(name)
+        if record_id == NO_ID:
+            unavailable.add(name)
+            continue
+        rates[record_id] = rates.get(record_id, 0.0) + rate
+
+    post_order, cycle_edges = _search_recipe_graph(cm, rates, choose_recipe)
+
+    # Every record comes after all of the records that use it, so its total rate is known when it is reached.
+    for record_id in reversed(post_order):
+        rate = rates.get(record_id, 0.0)
+        recipe_id = choose_recipe(record_id)
+        if recipe_id == NO_ID:
+            add_raw_input(record_id, rate)
+            continue
+        quantity = next(q for p, q in cm.products[recipe_id] if p == record_id)
+        craft_rate = rate / quantity
+        recipe_name = cm.names[recipe_id]
+        crafts[recipe_name] = crafts.get(recipe_name, 0.0) + craft_rate
+        if cm.work_units[recipe_id] != NO_ID:
+            work_units += craft_rate * cm.work_units[recipe_id]
+        for i, (ingredient_id, ingredient_quantity) in enumerate(cm.ingredients[recipe_id]):
+            if (record_id, i) in cycle_edges:
+                add_raw_input(ingredient_id, craft_rate * ingredient_quantity)
+            else:
+                rates[ingredient_id] = rates.get(ingredient_id, 0.0) + craft_rate * ingredient_quantity
+
+    return Requirements(
+        raw_inputs=dict(sorted(raw_inputs.items())),
+        crafts=dict(sorted(crafts.items())),
+        work_units=work_units,
+        unavailable=sorted(unavailable),
+      )
+
+class ItemCost(NamedTuple):
+    """The total upstream cost of producing one unit of an item."""
+    raw_inputs: float
+    work_units: float
+
+def evaluate_item_costs(cm: CompactModel, names: Iterable[str]) -> Dict[str, ItemCost]:
+    """Returns the cost of producing one unit of each named record, with every recipe available.
+
+       This is what evaluate_requirements gives for a target rate of 1 of each record on its own, but all
+       of the records are costed together in one pass over the recipe graph, each record once, instead of
+       one pass per record. A recipe cycle is broken where the search from the records, in order, first
+       closes it, so for records in a cycle the cost can differ from the single-target one. Unknown names
+       are ignored.
+    """
+    chosen: Dict[int, int] = {}
+
+    def choose_recipe(record_id: int) -> int:
+        recipe_id = chosen.get(record_id)
+        if recipe_id is None:
+            recipe_id = next(iter(cm.producers(record_id)), NO_ID)
+            chosen[record_id] = recipe_id
+        return recipe_id
+
+    record_ids = { name: cm.try_id_of(name) for name in names }
+    roots = [x for x in record_ids.values() if x != NO_ID]
+    post_order, cycle_edges = _search_recipe_graph(cm, roots, choose_recipe)
+
+    # Every record comes after the ingredients it reaches, so their unit costs are known when it is reached.
+    costs: Dict[int, ItemCost] = {}
+    for record_id in post_order:
+        recipe_id = choose_recipe(record_id)
+        if recipe_id == NO_ID:
+            costs[record_id] = ItemCost(1.0, 0.0)
+            continue
+        quantity = next(q for p, q in cm.products[recipe_id] if p == record_id)
+        raw_inputs = 0.0
+        work_units = 0.0 if cm.work_units[recipe_id] == NO_ID else float(cm.work_units[recipe_id])
+        for i, (ingredient_id, ingredient_quantity) in enumerate(cm.ingredients[recipe_id]):
+            if (record_id, i) in cycle_edges:
+                raw_inputs += ingredient_quantity
+            else:
+                ingredient_cost = costs[ingredient_id]
+                raw_inputs += ingredient_quantity * ingredient_cost.raw_inputs
+                work_units += ingredient_quantity * ingredient_cost.work_units
+        costs[record_id] = ItemCost(raw_inputs / quantity, work_units / quantity)
+    return { name: costs[x] for name, x in record_ids.items() if x != NO_ID }
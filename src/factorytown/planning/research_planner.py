@@ -0,0 +1,282 @@
+from ..internal_types import *
+from ..model import FactoryTownModel, CompactModel, Research, NO_ID
+from .availability import AvailabilityIndex
+
+from collections import ChainMap
+import heapq
+
+class ResearchPlan(NamedTuple):
+    """The researches needed to unlock a target, in the order they should be done."""
+
+    target: str
+    tech_level: int
+    """The minimum tech level at which the target chain becomes available."""
+
+    research_order: List[str]
+    """Research record names, prerequisites first, cheapest first among those that are ready."""
+
+    total_cost: float
+    """Total cost of the researches in research_order."""
+
+    buildings: List[str]
+    """Buildings that the chosen production chain depends on, in record-name order."""
+
+    def to_jsonable(self) -> JsonableDict:
+        return dict(
+            target=self.target,
+            tech_level=self.tech_level,
+            research_order=self.research_order,
+            total_cost=self.total_cost,
+            buildings=self.buildings,
+          )
+
+class _Need(NamedTuple):
+    tech_level: int
+    researches: AbstractSet[int]
+    buildings: AbstractSet[int]
+
+_NO_NEED = _Need(0, frozenset(), frozenset())
+
+class ResearchPlanner:
+    """Finds a set and order of researches that unlocks a target building, recipe or item.
+
+       The target's production chain is followed through recipes: a building needs its own research and
+       tech level plus everything needed to construct it, a recipe needs the buildings that run it or
+       that it constructs plus its ingredients, and an item needs the producing recipe whose own needs
+       cost the least research. That choice is made for each item on its own, so research shared with
+       other parts of the chain is not taken into account, and the set found is not necessarily the
+       cheapest overall. Items with no producing recipe are raw and need nothing. Records that need each
+       other through a recipe cycle are computed together; see _solve_cycle.
+
+       Research records scraped from the wiki do not yet carry costs or prerequisites, so both may be
+       supplied by the caller; by default every research costs 1 and has no prerequisites.
+    """
+    index: AvailabilityIndex
+    costs: Dict[int, float]
+    prerequisites: Dict[int, AbstractSet[int]]
+    _researched: AbstractSet[int]
+    _needs: Dict[int, _Need]
+
+    def __init__(
+            self,
+            model: FactoryTownModel|CompactModel|AvailabilityIndex,
+            *,
+            costs: Optional[Mapping[str, float]]=None,
+            prerequisites: Optional[Mapping[str, Iterable[str]]]=None,
+            researched: Iterable[str]=(),
+          ):
+        self.index = model if isinstance(model, AvailabilityIndex) else AvailabilityIndex.from_model(model)
+        index = self.index
+        self.costs = {} if costs is None else { index.research_id(k): float(v) for k, v in costs.items() }
+        self.prerequisites = {}
+        if prerequisites is not None:
+            for k, v in prerequisites.items():
+                self.prerequisites[index.research_id(k)] = frozenset(index.research_id(x) for x in v)
+        self._researched = frozenset(index.research_id(x) for x in researched)
+        self._needs = {}
+
+    def cost(self, research_id: int) -> float:
+        return 0.0 if research_id in self._researched else self.costs.get(research_id, 1.0)
+
+    def _closure(self, researches: AbstractSet[int]) -> AbstractSet[int]:
+        """Adds all transitive prerequisites and removes researches that are already done."""
+        result: Set[int] = set()
+        stack = list(researches)
+        while stack:
+            r = stack.pop()
+            if r in result or r in self._researched:
+                continue
+            result.add(r)
+            stack.extend(self.prerequisites.get(r, ()))
+        return frozenset(result)
+
+    def _set_cost(self, researches: AbstractSet[int]) -> float:
+        return sum(self.cost(r) for r in self._closure(researches))
+
+    def _combine(self, needs: Iterable[_Need]) -> _Need:
+        tech = 0
+        researches: Set[int] = set()
+        buildings: Set[int] = set()
+        for need in needs:
+            tech = max(tech, need.tech_level)
+            researches |= need.researches
+            buildings |= need.buildings
+        return _Need(tech, frozenset(researches), frozenset(buildings))
+
+    def _recipe_parts(self, recipe_id: int) -> List[int]:
+        """The records a recipe needs: the building that runs it, the buildings it constructs, and its
+           ingredients."""
+        cm = self.index.cm
+        parts: List[int] = []
+        building_id = cm.recipe_buildings[recipe_id]
+        if building_id != NO_ID:
+            parts.append(building_id)
+        for product_id, _ in cm.products[recipe_id]:
+            if cm.classes[product_id] == "Building":
+                parts.append(product_id)
+        for ingredient_id, _ in cm.ingredients[recipe_id]:
+            parts.append(ingredient_id)
+        return parts
+
+    def _recipe_groups(self, record_id: int) -> List[List[int]]:
+        """The records that record_id needs, as one group per alternative: a single group for a building
+           (its own recipe's parts) or a recipe, and one group per producing recipe for an item. A record
+           never needs itself, so it is left out of its own groups."""
+        cm = self.index.cm
+        class_name = cm.classes[record_id]
+        if class_name == "Building":
+            recipe_id = cm.building_recipes[record_id]
+            recipe_ids = [] if recipe_id == NO_ID else [recipe_id]
+        elif class_name == "Recipe":
+            return [[x for x in self._recipe_parts(record_id) if x != record_id]]
+        else:
+            recipe_ids = list(cm.producers(record_id))
+        return [[x for x in self._recipe_parts(r) if x != record_id] for r in recipe_ids]
+
+    def _evaluate(self, record_id: int, groups: List[List[int]], needs: Mapping[int, _Need]) -> _Need:
+        """Computes what record_id needs from the needs of the records in its groups."""
+        cm = self.index.cm
+        class_name = cm.classes[record_id]
+        options = [self._combine(needs[x] for x in group) for group in groups]
+        if class_name == "Building":
+            own = _Need(
+                self.index.tech_requirement(record_id),
+                self.index.research_requirements(record_id),
+                frozenset([record_id]),
+              )
+            return self._combine([own] + options)
+        if class_name == "Recipe":
+            return options[0]
+        return min(
+            options,
+            key=lambda n: (self._set_cost(n.researches), n.tech_level, sorted(n.researches)),
+            default=_NO_NEED,
+          )
+
+    def _solve_cycle(self, members: List[int], groups: Dict[int, List[List[int]]]):
+        """Computes the needs of a set of records that all need each other through recipe cycles. Their
+           needs start out empty and are recomputed together from each other's until they stop changing,
+           or for at most as many rounds as there are members, which covers every path through the cycle
+           without a repeated record. The result depends only on the recipe graph, not on which member was
+           reached first, so it can always be cached."""
+        needs = ChainMap({ m: _NO_NEED for m in members }, self._needs)
+        for _ in range(len(members)):
+            values = { m: self._evaluate(m, groups[m], needs) for m in members }
+            if all(values[m] == needs[m] for m in members):
+                break
+            needs.maps[0] = values
+        self._needs.update(needs.maps[0])
+
+    def _need(self, record_id: int) -> _Need:
+        """Returns what record_id needs, computing it and everything it depends on first.
+
+           The records reached are found by a depth-first search without recursion, as chains can be deep,
+           which groups them into strongly connected components (Tarjan's algorithm). Components are
+           completed in reverse topological order, so everything a component needs from outside it is
+           already in self._needs when it is computed."""
+        need = self._needs.get(record_id)
+        if need is not None:
+            return need
+        order: Dict[int, int] = {}
+        low: Dict[int, int] = {}
+        groups: Dict[int, List[List[int]]] = {}
+        component: List[int] = []
+        on_component: Set[int] = set()
+        stack: List[Tuple[int, List[int], int]] = []
+
+        def visit(v: int):
+            order[v] = low[v] = len(order)
+            component.append(v)
+            on_component.add(v)
+            groups[v] = self._recipe_groups(v)
+            stack.append((v, sorted(set(x for group in groups[v] for x in group)), 0))
+
+        visit(record_id)
+        while len(stack) > 0:
+            v, children, i = stack[-1]
+            if i < len(children):
+                stack[-1] = (v, children, i + 1)
+                w = children[i]
+                if w in self._needs:
+                    continue
+                if w not in order:
+                    visit(w)
+                elif w in on_component:
+                    low[v] = min(low[v], order[w])
+                continue
+            stack.pop()
+            if len(stack) > 0:
+                u = stack[-1][0]
+                low[u] = min(low[u], low[v])
+            if low[v] == order[v]:
+                members: List[int] = []
+                while True:
+                    w = component.pop()
+                    on_component.discard(w)
+                    members.append(w)
+                    if w == v:
+                        break
+                if len(members) == 1:
+                    self._needs[v] = self._evaluate(v, groups[v], self._needs)
+                else:
+                    self._solve_cycle(members, groups)
+        return self._needs[record_id]
+
+    def _order(self, researches: AbstractSet[int]) -> List[int]:
+        """Topologically orders researches by prerequisites, taking the cheapest ready research first."""
+        cm = self.index.cm
+        n_waiting: Dict[int, int] = {}
+        dependents: Dict[int, List[int]] = { r: [] for r in researches }
+        for r in researches:
+            pre = self.prerequisites.get(r, frozenset()) & researches
+            n_waiting[r] = len(pre)
+            for p in pre:
+                dependents[p].append(r)
+        ready = [(self.cost(r), cm.names[r], r) for r, n in n_waiting.items() if n == 0]
+        heapq.heapify(ready)
+        order: List[int] = []
+        while ready:
+            _, _, r = heapq.heappop(ready)
+            order.append(r)
+            for other in dependents[r]:
+                n_waiting[other] -= 1
+                if n_waiting[other] == 0:
+                    heapq.heappush(ready, (self.cost(other), cm.names[other], other))
+        if len(order) != len(researches):
+            cycle = sorted(cm.names[r] for r in researches if r not in order)
+            raise FactoryTownError(f"Research prerequisites contain a cycle among {cycle}")
+        return order
+
+    def plan(self, target: str) -> ResearchPlan:
+        """Plans the researches needed to unlock target, a building, recipe or item record name."""
+        cm = self.index.cm
+        record_id = cm.try_id_of(target)
+        if record_id == NO_ID:
+            record_id = cm.try_id_of(Research.get_record_name(target))
+        if record_id == NO_ID:
+            raise FactoryTownError(f"Unknown record {target!r}")
+        if cm.classes[record_id] == "Research":
+            need = _Need(0, frozenset([record_id]), frozenset())
+        else:
+            need = self._need(record_id)
+        researches = self._closure(need.researches)
+        order = self._order(researches)
+        return ResearchPlan(
+            target=cm.names[record_id],
+            tech_level=need.tech_level,
+            research_order=[cm.names[r] for r in order],
+            total_cost=sum(self.cost(r) for r in order),
+            buildings=sorted(cm.names[b] for b in need.buildings),
+          )
+
+def plan_research(
+        model: FactoryTownModel|CompactModel|AvailabilityIndex,
+        target: str,
+        *,
+        costs: Optional[Mapping[str, float]]=None,
+        prerequisites: Optional[Mapping[str, Iterable[str]]]=None,
+        researched: Iterable[str]=(),
+      ) -> ResearchPlan:
+    """Convenience wrapper around ResearchPlanner.plan for a single target."""
+    planner = ResearchPlanner(model, costs=costs, prerequisites=prerequisites, researched=researched)
+    return planner.plan(target)
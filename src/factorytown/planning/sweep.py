@@ -0,0 +1,131 @@
+from ..internal_types import *
+from ..model import FactoryTownModel, CompactModel
+from .requirements import Scenario, evaluate_requirements
+
+from concurrent.futures import ProcessPoolExecutor, Future
+from multiprocessing.shared_memory import SharedMemory
+from logging import getLogger
+import os
+
+logger = getLogger(__name__)
+
+R = TypeVar('R')
+
+ScenarioEvaluator = Callable[[CompactModel, Scenario], R]
+"""A function that evaluates one scenario against a model. Must be a picklable module-level function
+   to be used with worker processes."""
+
+SweepResult = Tuple[int, Scenario, R]
+"""(scenario index, scenario, evaluation result)"""
+
+_worker_shm: Optional[SharedMemory] = None
+_worker_model: Optional[CompactModel] = None
+_worker_evaluate: Optional[ScenarioEvaluator] = None
+
+def _init_worker(shm_name: str, size: int, evaluate: ScenarioEvaluator):
+    """Process pool initializer. Attaches to the shared model once per worker process. Its integer columns
+       are read in place from the shared memory, which stays attached for the life of the worker."""
+    global _worker_shm, _worker_model, _worker_evaluate
+    _worker_shm = SharedMemory(name=shm_name)
+    _worker_model = CompactModel.from_bytes(_worker_shm.buf[:size])
+    _worker_evaluate = evaluate
+
+def _evaluate_chunk(chunk: List[Tuple[int, Scenario]]) -> List[Tuple[int, Any]]:
+    assert _worker_model is not None and _worker_evaluate is not None
+    return [(i, _worker_evaluate(_worker_model, scenario)) for i, scenario in chunk]
+
+def _iter_chunks(scenarios: Iterable[Scenario], chunk_size: int) -> Iterator[List[Tuple[int, Scenario]]]:
+    chunk: List[Tuple[int, Scenario]] = []
+    for i, scenario in enumerate(scenarios):
+        chunk.append((i, scenario))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+def run_sweep(
+        model: FactoryTownModel|CompactModel,
+        scenarios: Iterable[Scenario],
+        evaluate: ScenarioEvaluator=evaluate_requirements,
+        *,
+        max_workers: Optional[int]=None,
+        chunk_size: int=16,
+        max_pending_chunks: Optional[int]=None,
+      ) -> Iterator[SweepResult]:
+    """Evaluates many scenarios against a model across a pool of worker processes.
+
+       The model is converted to a CompactModel and packed into shared memory once (see
+       CompactModel.to_bytes). Each worker reads the integer columns in place from the shared memory and
+       decodes only the table of names, classes and tags, once, in its initializer, so only the scenarios
+       themselves are pickled per task.
+
+       Results are streamed back as soon as they are available, but always in the order of the input
+       scenarios. At most max_pending_chunks chunks are in flight at a time (default: 4 per worker), so
+       scenarios may be a lazy iterator over a very large grid.
+
+    Args:
+        model: The model to evaluate against.
+        scenarios: The scenarios to evaluate.
+        evaluate: The evaluation function. Defaults to evaluate_requirements.
+        max_workers: Number of worker processes. None uses the CPU count. 1 evaluates in-process.
+        chunk_size: Number of scenarios sent to a worker per task.
+        max_pending_chunks: Limit on chunks in flight. Defaults to 4 per worker.
+
+    Yields:
+        (scenario index, scenario, result) tuples, in scenario order.
+    """
+    cm = model if isinstance(model, CompactModel) else CompactModel.from_model(model)
+    if max_workers == 1:
+        for i, scenario in enumerate(scenarios):
+            yield i, scenario, evaluate(cm, scenario)
+        return
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_pending_chunks is None:
+        max_pending_chunks = 4 * max_workers
+
+    blob = cm.to_bytes()
+    shm = SharedMemory(create=True, size=max(1, len(blob)))
+    try:
+        shm.buf[:len(blob)] = blob
+        with ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_worker,
+                initargs=(shm.name, len(blob), evaluate),
+              ) as executor:
+            pending: Dict[int, Future] = {}
+            ready: Dict[int, Any] = {}
+            scenario_by_index: Dict[int, Scenario] = {}
+            chunks = _iter_chunks(scenarios, chunk_size)
+            next_chunk = 0
+            next_result = 0
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < max_pending_chunks:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        exhausted = True
+                        break
+                    for i, scenario in chunk:
+                        scenario_by_index[i] = scenario
+                    pending[next_chunk] = executor.submit(_evaluate_chunk, chunk)
+                    next_chunk += 1
+                if len(pending) == 0:
+                    break
+                # Wait for the oldest chunk; later chunks that finish first are buffered in ready.
+                oldest = min(pending)
+                for i, result in pending.pop(oldest).result():
+                    ready[i] = result
+                for chunk_id in [k for k, f in pending.items() if f.done()]:
+                    future = pending.pop(chunk_id)
+                    for i, result in future.result():
+                        ready[i] = result
+                while next_result in ready:
+                    yield next_result, scenario_by_index.pop(next_result), ready.pop(next_result)
+                    next_result += 1
+            logger.debug(f"Sweep evaluated {next_result} scenarios")
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,199 @@
+from ..internal_types import *
+from ..model import FactoryTownModel, CompactModel, NO_ID
+from .requirements import ItemCost, evaluate_item_costs
+
+from array import array
+import hashlib
+import json
+import math
+
+MarketPriceTable = Mapping[str, Mapping[str, Mapping[str, float]]]
+"""Coins paid per unit sold, as {market building: {item: {coin color: amount}}}."""
+
+VALUATION_MEASURES = ("unit", "work", "raw")
+"""The yields computed for every (item, market, coin color):
+      unit: coins per unit sold
+      work: coins per upstream work unit
+      raw:  coins per upstream raw input unit
+"""
+
+class MarketPrices:
+    """A market price table. The wiki pages scraped so far do not include sale prices, so prices are
+       supplied separately, e.g. from a JSON file."""
+    table: Dict[str, Dict[str, Dict[str, float]]]
+
+    def __init__(self, table: MarketPriceTable):
+        self.table = {
+            market: { item: { color: float(amount) for color, amount in colors.items() } for item, colors in items.items() }
+            for market, items in table.items()
+          }
+
+    @classmethod
+    def load(cls, filename: str) -> Self:
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise FactoryTownError(f"Market price file {filename!r} must contain a JSON object")
+        return cls(data)
+
+    @property
+    def fingerprint(self) -> str:
+        """A content hash of the table, used as part of the model's derived-data cache key."""
+        canonical = json.dumps(self.table, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class RankedYield(NamedTuple):
+    item: str
+    market: str
+    color: str
+    value: float
+
+def _per_cost_yields(unit: array, costs: List[ItemCost], block: int) -> Tuple[array, array]:
+    """Divides each item's block of unit yields by its work units and by its raw inputs, with numpy if it
+       is installed. A zero cost gives an inf yield."""
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is not None:
+        values = np.frombuffer(unit, dtype=np.float64).reshape(len(costs), block)
+        result: List[array] = []
+        for column in (1, 0):
+            cost = np.array([c[column] for c in costs], dtype=np.float64)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scaled = values * (1.0 / cost)[:, np.newaxis]
+            result.append(array('d', scaled.tobytes()))
+        return result[0], result[1]
+    per_work = array('d', unit)
+    per_raw = array('d', unit)
+    for i, cost in enumerate(costs):
+        work_scale = math.inf if cost.work_units == 0 else 1.0 / cost.work_units
+        raw_scale = math.inf if cost.raw_inputs == 0 else 1.0 / cost.raw_inputs
+        for k in range(i * block, (i + 1) * block):
+            v = unit[k]
+            if v == v:
+                per_work[k] = v * work_scale
+                per_raw[k] = v * raw_scale
+    return per_work, per_raw
+
+class MarketValuation:
+    """Coin yields for every sellable item x market x coin color, computed in one batch.
+
+       The upstream cost of every priced item is found in a single pass over the recipe graph (see
+       evaluate_item_costs), and the per-cost yields are computed with numpy when it is installed.
+
+       Each measure is stored as a flat array of doubles indexed by
+       (item_index * n_markets + market_index) * n_colors + color_index, with NaN where the market does not
+       buy the item for that color, and inf where the upstream cost is zero.
+
+       Rankings are computed on first use and memoized, so repeated ranking queries are dictionary lookups.
+    """
+    items: List[str]
+    markets: List[str]
+    colors: List[str]
+    costs: List[ItemCost]
+    yields: Dict[str, array]
+    _rankings: Dict[Tuple[str, Optional[str], Optional[str]], List[RankedYield]]
+    _item_index: Dict[str, int]
+    _market_index: Dict[str, int]
+    _color_index: Dict[str, int]
+
+    def __init__(self, items: List[str], markets: List[str], colors: List[str], costs: List[ItemCost], yields: Dict[str, array]):
+        self.items = items
+        self.markets = markets
+        self.colors = colors
+        self.costs = costs
+        self.yields = yields
+        self._rankings = {}
+        self._item_index = { x: i for i, x in enumerate(items) }
+        self._market_index = { x: i for i, x in enumerate(markets) }
+        self._color_index = { x: i for i, x in enumerate(colors) }
+
+    @classmethod
+    def compute(cls, model: FactoryTownModel|CompactModel, prices: MarketPrices) -> Self:
+        cm = model if isinstance(model, CompactModel) else CompactModel.from_model(model)
+        markets = [cm.names[i] for i in cm.ids_of_class("Building") if cm.has_tag(i, "Market")]
+        colors = [cm.names[i].rsplit(" ", 1)[0] for i in cm.ids_of_class("Coins")]
+        unknown_markets = sorted(set(prices.table) - set(markets))
+        if len(unknown_markets) > 0:
+            raise FactoryTownError(f"Prices given for buildings that are not markets: {unknown_markets}")
+        items = sorted({ item for market_items in prices.table.values() for item in market_items })
+        unknown_colors = sorted({
+            color for market_items in prices.table.values() for item_colors in market_items.values() for color in item_colors
+          } - set(colors))
+        if len(unknown_colors) > 0:
+            raise FactoryTownError(f"Prices given in unknown coin colors: {unknown_colors}")
+        unknown_items = [item for item in items if cm.try_id_of(item) == NO_ID]
+        if len(unknown_items) > 0:
+            raise FactoryTownError(f"Prices given for unknown items: {unknown_items}")
+
+        item_costs = evaluate_item_costs(cm, items)
+        costs = [item_costs[item] for item in items]
+
+        n_markets, n_colors = len(markets), len(colors)
+        size = len(items) * n_markets * n_colors
+        unit = array('d', [math.nan]) * size
+        market_index = {m: i for i, m in enumerate(markets)}
+        color_index = {c: i for i, c in enumerate(colors)}
+        item_index = {x: i for i, x in enumerate(items)}
+        for market, market_items in prices.table.items():
+            m = market_index[market]
+            for item, item_colors in market_items.items():
+                base = (item_index[item] * n_markets + m) * n_colors
+                for color, amount in item_colors.items():
+                    unit[base + color_index[color]] = amount
+
+        per_work, per_raw = _per_cost_yields(unit, costs, n_markets * n_colors)
+        return cls(items, markets, colors, costs, dict(unit=unit, work=per_work, raw=per_raw))
+
+    def _offset(self, item: str, market: str, color: str) -> int:
+        try:
+            i = self._item_index[item]
+            m = self._market_index[market]
+            c = self._color_index[color]
+        except KeyError as ex:
+            raise FactoryTownError(f"No valuation for item {item!r} at market {market!r} in {color!r} coins") from ex
+        return (i * len(self.markets) + m) * len(self.colors) + c
+
+    def get(self, item: str, market: str, color: str, measure: str="unit") -> Optional[float]:
+        """Returns one yield, or None if the market does not buy the item for that color."""
+        value = self.yields[measure][self._offset(item, market, color)]
+        return None if value != value else value
+
+    def rank(self, measure: str="unit", color: Optional[str]=None, market: Optional[str]=None, top: Optional[int]=None) -> List[RankedYield]:
+        """Returns (item, market, color, value) entries sorted best first, optionally restricted to one coin
+           color and/or one market."""
+        if measure not in self.yields:
+            raise FactoryTownError(f"Unknown valuation measure {measure!r}; choose from {list(VALUATION_MEASURES)}")
+        key = (measure, color, market)
+        ranking = self._rankings.get(key)
+        if ranking is None:
+            values = self.yields[measure]
+            n_markets, n_colors = len(self.markets), len(self.colors)
+            ranking = []
+            for k, v in enumerate(values):
+                if v != v:
+                    continue
+                c = k % n_colors
+                m = (k // n_colors) % n_markets
+                if color is not None and self.colors[c] != color:
+                    continue
+                if market is not None and self.markets[m] != market:
+                    continue
+                ranking.append(RankedYield(self.items[k // (n_colors * n_markets)], self.markets[m], self.colors[c], v))
+            ranking.sort(key=lambda r: (-r.value, r.item, r.market, r.color))
+            self._rankings[key] = ranking
+        return ranking if top is None else ranking[:top]
+
+    def __str__(self):
+        return f"MarketValuation(items={len(self.items)}, markets={len(self.markets)}, colors={len(self.colors)})"
+
+    def __repr__(self):
+        return str(self)
+
+def get_market_valuation(model: FactoryTownModel, prices: MarketPrices) -> MarketValuation:
+    """Returns the market valuation for a model and price table, cached with the model."""
+    return model.get_derived(
+        ("market_valuation", prices.fingerprint),
+        lambda: MarketValuation.compute(model, prices),
+      )
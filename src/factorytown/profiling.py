@@ -0,0 +1,187 @@
+"""
+Lightweight hierarchical timing spans.
+
+Spans are recorded only while a Profiler is active (see start_profiling()). When profiling is off, span()
+returns a shared no-op context manager and functions wrapped with @profiled() make one extra global check
+per call, so instrumentation can stay in hot paths.
+
+Spans nest by call structure: a span opened while another is open on the same thread is recorded as its
+child. Spans with the same name under the same parent are aggregated into one node with a call count.
+Work done in worker processes is not recorded.
+"""
+
+from .internal_types import *
+
+import functools
+import threading
+import time
+from typing import ContextManager
+
+class SpanNode:
+    """Aggregated timing of all spans with the same name and the same parent."""
+    name: str
+    count: int
+    total_seconds: float
+    children: Dict[str, 'SpanNode']
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.total_seconds = 0.0
+        self.children = {}
+
+    def child(self, name: str) -> 'SpanNode':
+        node = self.children.get(name)
+        if node is None:
+            node = SpanNode(name)
+            self.children[name] = node
+        return node
+
+    @property
+    def self_seconds(self) -> float:
+        """Time spent in this span but not in any child span."""
+        return max(0.0, self.total_seconds - sum(c.total_seconds for c in self.children.values()))
+
+    def to_jsonable(self) -> JsonableDict:
+        return dict(
+            name=self.name,
+            count=self.count,
+            total_seconds=self.total_seconds,
+            self_seconds=self.self_seconds,
+            children=[c.to_jsonable() for c in self.sorted_children()],
+          )
+
+    def sorted_children(self) -> List['SpanNode']:
+        return sorted(self.children.values(), key=lambda c: -c.total_seconds)
+
+    def format_tree(self, indent: str="", parent_seconds: Optional[float]=None) -> List[str]:
+        """Formats the node and its descendants, most expensive first, one line per node."""
+        percent = "" if not parent_seconds else f" {100.0 * self.total_seconds / parent_seconds:5.1f}%"
+        lines = [
+            f"{self.total_seconds * 1000:10.2f} ms{percent:>7} {indent}{self.name}"
+            f" [{self.count} call{'' if self.count == 1 else 's'}, self {self.self_seconds * 1000:.2f} ms]"
+          ]
+        for c in self.sorted_children():
+            lines.extend(c.format_tree(indent + "  ", self.total_seconds))
+        return lines
+
+    def __str__(self):
+        return f"SpanNode({self.name!r}, count={self.count}, total_seconds={self.total_seconds:.6f})"
+
+    def __repr__(self):
+        return str(self)
+
+class _Span:
+    __slots__ = ("profiler", "name", "node", "start")
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self) -> Self:
+        profiler = self.profiler
+        stack = profiler._stack()
+        parent = stack[-1] if len(stack) > 0 else profiler.root
+        with profiler._lock:
+            self.node = parent.child(self.name)
+        stack.append(self.node)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        elapsed = time.perf_counter() - self.start
+        profiler = self.profiler
+        profiler._stack().pop()
+        with profiler._lock:
+            self.node.count += 1
+            self.node.total_seconds += elapsed
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        pass
+
+_null_span = _NullSpan()
+
+class Profiler:
+    """Collects a tree of timing spans. The root node covers the time from start() to stop()."""
+    root: SpanNode
+    _start: float
+    _local: threading.local
+    _lock: threading.Lock
+
+    def __init__(self, name: str="total"):
+        self.root = SpanNode(name)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def _stack(self) -> List[SpanNode]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = []
+            self._local.stack = stack
+        return stack
+
+    def span(self, name: str) -> _Span:
+        return _Span(self, name)
+
+    def stop(self):
+        self.root.count = 1
+        self.root.total_seconds = time.perf_counter() - self._start
+
+    def format_tree(self) -> str:
+        return "\n".join(self.root.format_tree())
+
+    def to_jsonable(self) -> JsonableDict:
+        return self.root.to_jsonable()
+
+_profiler: Optional[Profiler] = None
+
+def start_profiling() -> Profiler:
+    """Starts recording spans in a new Profiler, which is returned."""
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+def stop_profiling() -> Optional[Profiler]:
+    """Stops recording spans. Returns the stopped Profiler, or None if profiling was not active."""
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+def get_profiler() -> Optional[Profiler]:
+    return _profiler
+
+def span(name: str) -> ContextManager[Any]:
+    """Returns a context manager that records a timing span while profiling is active, and does nothing
+       otherwise."""
+    profiler = _profiler
+    if profiler is None:
+        return _null_span
+    return _Span(profiler, name)
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+def profiled(name: Optional[str]=None) -> Callable[[F], F]:
+    """Decorates a function so that each call is recorded as a span while profiling is active. The span
+       name defaults to the function's qualified name."""
+    def decorator(fn: F) -> F:
+        span_name = fn.__qualname__ if name is None else name
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return fn(*args, **kwargs)
+            with _Span(profiler, span_name):
+                return fn(*args, **kwargs)
+        return cast(F, wrapper)
+    return decorator
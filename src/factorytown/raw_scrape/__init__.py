@@ -1,2 +1,36 @@
-from .factorytown_wiki_scrape import get_page_html, get_page_markdown, get_page_asset
+from .factorytown_wiki_scrape import get_page_html, get_page_markdown, get_page_asset, get_page_asset_url, open_page_asset
 
+from .fandom_scrape import CacheFileTee, get_memory_cache, get_scrape_cache_stats, open_url_stream, write_cache_chunks
+
+from .memory_cache import MemoryCache, RequestCoalescer
+
+from .assets import (
+    IMAGE_EXTENSIONS,
+    AssetEntry,
+    AssetStore,
+    AssetSyncResult,
+    get_asset_store_dir,
+    get_image_urls,
+    get_image_file_name,
+    find_page_image_urls,
+    get_referenced_image_urls,
+    get_model_image_names,
+    fetch_asset,
+    fetch_image,
+    sync_assets,
+)
+
+from .fetch_scheduler import (
+    DEFAULT_FETCH_RATE,
+    DEFAULT_FETCH_CONCURRENCY,
+    FETCH_RATE_ENV_VAR,
+    FETCH_CONCURRENCY_ENV_VAR,
+    DEFAULT_CHUNK_SIZE,
+    TokenBucket,
+    AimdLimiter,
+    FetchScheduler,
+    parse_retry_after,
+    iter_response_chunks,
+    get_fetch_scheduler,
+    set_fetch_scheduler,
+)
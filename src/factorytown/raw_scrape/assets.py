@@ -0,0 +1,388 @@
+"""
+A content-addressed store for wiki assets (images).
+
+Fandom serves the same image under many URLs (the file page redirect, the original, and any number of
+thumbnail sizes and cache-busting queries), and the wiki's pages reference whichever of them they were
+rendered with. sync_assets fetches the image URLs the pages actually reference, each distinct URL once,
+and stores each distinct content once, by SHA-256, with an index from each URL fetched to the digest of
+its content. The URLs a fetch was redirected through are indexed separately, as aliases. The store lives
+in the "assets" directory of the scrape cache:
+
+    assets/blobs/<2 hex digits>/<sha256>   The content, stored once
+    assets/index.json                      {"urls": {url: {"sha256": ..., "size": ...}},
+                                            "aliases": {url: {"sha256": ..., "size": ...}}}
+"""
+
+from ..internal_types import *
+from ..model import FactoryTownModel, GameObject
+from ..metrics import CACHE_REQUESTS
+from .fandom_scrape import cache_file_lock, get_cache_dir, get_url_filename, make_cache_temp_file
+from .fetch_scheduler import FetchScheduler, get_fetch_scheduler, iter_response_chunks
+from .factorytown_wiki_scrape import get_page_asset_url, get_page_html, get_page_url
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote, urlsplit
+import hashlib
+import html
+import json
+import os
+import re
+import requests
+import threading
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".png", ".gif", ".jpg")
+"""File extensions tried, in order, when resolving a record's image name to a wiki file."""
+
+def get_asset_store_dir() -> str:
+    return os.path.join(get_cache_dir(), "assets")
+
+def get_image_urls(image_name: str) -> List[str]:
+    """Returns the URLs that may hold the image with the given name, most likely first. Each is the wiki's
+       Special:FilePath redirect to the original file."""
+    return [get_page_url(f"Special:FilePath/{quote(image_name + ext)}") for ext in IMAGE_EXTENSIONS]
+
+image_src_re = re.compile(r"""\b(?:src|data-src)\s*=\s*["']([^"']+)["']""")
+
+def get_image_file_name(url: str) -> Optional[str]:
+    """Returns the name of the wiki file an image URL serves, with spaces for underscores, e.g. "Cactus
+       Fruit.png" for the original or any thumbnail of File:Cactus_Fruit.png. Returns None if the URL is not
+       a wiki image."""
+    parts = [unquote(x) for x in urlsplit(url).path.split("/")]
+    if "revision" in parts:
+        # https://static.wikia.nocookie.net/<wiki>/images/a/ab/<file>/revision/latest/scale-to-width-down/40
+        i = parts.index("revision") - 1
+    elif "thumb" in parts and len(parts) > parts.index("thumb") + 3:
+        # .../images/thumb/a/ab/<file>/40px-<file>
+        i = parts.index("thumb") + 3
+    else:
+        i = len(parts) - 1
+    name = parts[i].split(":", 1)[-1] if i >= 0 else ""
+    if not name.lower().endswith(IMAGE_EXTENSIONS):
+        return None
+    return name.replace("_", " ")
+
+def find_page_image_urls(page: str, page_html: str) -> List[str]:
+    """Returns the distinct wiki image URLs referenced by img tags in a page's HTML, made absolute, in
+       order of first appearance."""
+    urls: Dict[str, None] = {}
+    for m in image_src_re.finditer(page_html):
+        url = html.unescape(m.group(1))
+        if url.startswith("data:"):
+            continue
+        url = get_page_asset_url(page, url)
+        if get_image_file_name(url) is not None:
+            urls[url] = None
+    return list(urls)
+
+def get_referenced_image_urls(
+        image_names: Iterable[str],
+        pages: Iterable[str],
+        max_workers: int=8,
+        force: bool=False,
+      ) -> Dict[str, List[str]]:
+    """Fetches the HTML of each page and returns, by image name, the distinct URLs of the original and
+       thumbnails of the image's file that the pages reference. Pages that cannot be fetched are skipped;
+       image names no page references are left out."""
+    files = { f"{name}{ext}": name for name in image_names for ext in IMAGE_EXTENSIONS }
+
+    def page_urls(page: str) -> List[str]:
+        try:
+            return find_page_image_urls(page, get_page_html(page, force))
+        except Exception as ex:
+            logger.info(f"Could not read page {page!r} for image URLs: {ex}")
+            return []
+
+    result: Dict[str, Dict[str, None]] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for urls in executor.map(page_urls, list(dict.fromkeys(pages))):
+            for url in urls:
+                file_name = get_image_file_name(url)
+                name = None if file_name is None else files.get(file_name)
+                if name is not None:
+                    result.setdefault(name, {})[url] = None
+    return { name: list(urls) for name, urls in result.items() }
+
+class AssetEntry(NamedTuple):
+    sha256: str
+    size: int
+
+class AssetStore:
+    """A deduplicating, content-addressed store of downloaded assets with a URL index. Safe for use from
+       multiple threads; the index is written to disk by save()."""
+    root: str
+    urls: Dict[str, AssetEntry]
+    """Entries by the URL fetched."""
+
+    aliases: Dict[str, AssetEntry]
+    """Entries by a URL a fetch was redirected through (or to)."""
+
+    _lock: threading.Lock
+
+    def __init__(self, root: Optional[str]=None):
+        self.root = get_asset_store_dir() if root is None else root
+        self._lock = threading.Lock()
+        self.urls, self.aliases = self._read_index()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.root, "index.json")
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "blobs", sha256[:2], sha256)
+
+    def has_blob(self, sha256: str) -> bool:
+        return os.path.exists(self.blob_path(sha256))
+
+    def get_entry(self, url: str) -> Optional[AssetEntry]:
+        with self._lock:
+            entry = self.urls.get(url)
+            return self.aliases.get(url) if entry is None else entry
+
+    def get(self, url: str) -> Optional[bytes]:
+        """Returns the stored content for a URL, or None if the URL has not been fetched."""
+        entry = self.get_entry(url)
+        if entry is None or not self.has_blob(entry.sha256):
+            return None
+        with open(self.blob_path(entry.sha256), 'rb') as f:
+            return f.read()
+
+    def put_stream(self, url: str, chunks: Iterable[bytes], aliases: Iterable[str]=()) -> Tuple[AssetEntry, bool]:
+        """Stores content, given as chunks, unless content with the same digest is already stored, and
+           indexes url, and each of aliases as an alias, to it. The chunks are written to a temporary file
+           and hashed as they arrive, so only one chunk at a time is held in memory. Returns the entry and
+           whether new content was written."""
+        tmp_dir = os.path.join(self.root, "blobs")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = make_cache_temp_file(tmp_dir)
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    h.update(chunk)
+                    size += len(chunk)
+            entry = AssetEntry(h.hexdigest(), size)
+            path = self.blob_path(entry.sha256)
+            is_new = not os.path.exists(path)
+            if is_new:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            else:
+                os.unlink(tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._index(url, entry, aliases)
+        return entry, is_new
+
+    def _index(self, url: str, entry: AssetEntry, aliases: Iterable[str]):
+        with self._lock:
+            self.urls[url] = entry
+            for alias in aliases:
+                if alias != url:
+                    self.aliases[alias] = entry
+
+    def _read_index(self) -> Tuple[Dict[str, AssetEntry], Dict[str, AssetEntry]]:
+        if not os.path.exists(self.index_path):
+            return {}, {}
+        with open(self.index_path, 'r') as f:
+            data = json.load(f)
+        return (
+            {url: AssetEntry(**entry) for url, entry in data.get("urls", {}).items()},
+            {url: AssetEntry(**entry) for url, entry in data.get("aliases", {}).items()},
+          )
+
+    def save(self):
+        """Writes the URL index to disk, atomically. Another process may have saved entries into the same
+           store since this one loaded it, so the index on disk is re-read and merged, with this store's
+           entries taking precedence, under a lock shared by all processes using the scrape cache."""
+        os.makedirs(self.root, exist_ok=True)
+        with cache_file_lock("assets", get_url_filename(os.path.abspath(self.index_path))):
+            urls, aliases = self._read_index()
+            with self._lock:
+                urls.update(self.urls)
+                aliases.update(self.aliases)
+                self.urls = urls
+                self.aliases = aliases
+                data = dict(
+                    urls={url: entry._asdict() for url, entry in sorted(urls.items())},
+                    aliases={url: entry._asdict() for url, entry in sorted(aliases.items())},
+                  )
+            fd, tmp_path = make_cache_temp_file(self.root, ".index-")
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=1)
+                f.write("\n")
+            os.replace(tmp_path, self.index_path)
+
+    def usage(self) -> JsonableDict:
+        """Returns the number of URLs fetched, aliases and distinct blobs indexed, the bytes the fetched URLs'
+           content would take if stored per URL, the bytes actually stored, and the difference saved by
+           deduplication. Aliases name the same download as the URL fetched, so they count toward neither."""
+        with self._lock:
+            entries = list(self.urls.values())
+            n_aliases = len(self.aliases)
+        blobs = {entry.sha256: entry.size for entry in entries}
+        logical = sum(entry.size for entry in entries)
+        stored = sum(blobs.values())
+        return dict(
+            urls=len(entries),
+            aliases=n_aliases,
+            blobs=len(blobs),
+            logical_bytes=logical,
+            stored_bytes=stored,
+            saved_bytes=logical - stored,
+          )
+
+class AssetSyncResult(NamedTuple):
+    images: int
+    """Distinct image names to sync."""
+
+    urls: int
+    """Distinct asset URLs the images resolved to: those the pages reference, or for an image no page
+       references, its Special:FilePath URL."""
+
+    cached: int
+    """URLs already in the store."""
+
+    downloaded: int
+    """URLs fetched."""
+
+    new_blobs: int
+    """Fetched URLs whose content was not already stored."""
+
+    failed: Dict[str, str]
+    """Error description by image name, for images that could not be fetched."""
+
+    bytes_downloaded: int
+    usage: JsonableDict
+    """The store's usage after the sync (see AssetStore.usage)."""
+
+    def to_jsonable(self) -> JsonableDict:
+        return self._asdict()
+
+def get_model_image_names(model: FactoryTownModel) -> List[str]:
+    """Returns the distinct image names of all game objects in a model, sorted."""
+    return sorted(set(x.image_name for x in model.records.values(GameObject)))
+
+def _store_response(store: AssetStore, url: str, r: requests.Response) -> Tuple[bool, int, bool]:
+    # Index the redirect chain and the final URL as aliases, since all of them name this content.
+    aliases = [x.url for x in r.history] + [r.url]
+    entry, is_new = store.put_stream(url, iter_response_chunks(r), aliases)
+    return True, entry.size, is_new
+
+def fetch_asset(store: AssetStore, url: str, scheduler: FetchScheduler, force: bool=False) -> Tuple[bool, int, bool]:
+    """Fetches one asset URL into the store unless it is already there. Returns (downloaded, bytes
+       downloaded, new content stored)."""
+    if not force:
+        entry = store.get_entry(url)
+        if entry is not None and store.has_blob(entry.sha256):
+            CACHE_REQUESTS.inc(tier="asset", result="hit")
+            return False, 0, False
+    CACHE_REQUESTS.inc(tier="asset", result="miss")
+    r = scheduler.fetch(url, stream=True)
+    if not r.ok:
+        r.close()
+        r.raise_for_status()
+    return _store_response(store, url, r)
+
+def fetch_image(store: AssetStore, image_name: str, scheduler: FetchScheduler, force: bool=False) -> Tuple[bool, int, bool]:
+    """Fetches an image that no page references into the store, from the first of its Special:FilePath
+       URLs (see get_image_urls) that exists, unless one of them is already there. Returns (downloaded,
+       bytes downloaded, new content stored).
+
+    Raises:
+        FactoryTownError: If none of the image's candidate URLs could be fetched.
+    """
+    candidates = get_image_urls(image_name)
+    if not force:
+        for url in candidates:
+            entry = store.get_entry(url)
+            if entry is not None and store.has_blob(entry.sha256):
+                CACHE_REQUESTS.inc(tier="asset", result="hit")
+                return False, 0, False
+    CACHE_REQUESTS.inc(tier="asset", result="miss")
+    errors: List[str] = []
+    for url in candidates:
+        r = scheduler.fetch(url, stream=True)
+        if not r.ok:
+            r.close()
+            if r.status_code == 404:
+                errors.append(f"{url}: 404")
+                continue
+            r.raise_for_status()
+        return _store_response(store, url, r)
+    raise FactoryTownError(f"Image {image_name!r} not found: {'; '.join(errors)}")
+
+def sync_assets(
+        image_names: Iterable[str],
+        store: Optional[AssetStore]=None,
+        max_workers: int=8,
+        force: bool=False,
+        pages: Iterable[str]=(),
+      ) -> AssetSyncResult:
+    """Fetches every named image that is not already in the store, with up to max_workers fetches queued
+       on the process's fetch scheduler (which decides how many are actually in flight), and saves the
+       store's index. Images that fail are reported in the result rather than raised.
+
+       The images are resolved to the URLs that the given pages reference (see
+       get_referenced_image_urls), so every thumbnail the wiki uses is fetched, each distinct URL once
+       however many pages and images share it; an image none of the pages references is fetched through
+       its Special:FilePath URL instead (see fetch_image)."""
+    if store is None:
+        store = AssetStore()
+    names = list(dict.fromkeys(image_names))
+    referenced = get_referenced_image_urls(names, pages, max_workers, force)
+    scheduler = get_fetch_scheduler()
+    failed: Dict[str, str] = {}
+    lock = threading.Lock()
+    url_images: Dict[str, str] = {}
+    unreferenced: List[str] = []
+    for name in names:
+        if name in referenced:
+            for url in referenced[name]:
+                url_images.setdefault(url, name)
+        else:
+            unreferenced.append(name)
+
+    def fail(image_name: str, ex: Exception):
+        logger.warning(f"Could not fetch image {image_name!r}: {ex}")
+        with lock:
+            failed.setdefault(image_name, f"{ex.__class__.__name__}: {ex}")
+
+    def fetch_url(url: str) -> Optional[Tuple[bool, int, bool]]:
+        try:
+            return fetch_asset(store, url, scheduler, force)
+        except Exception as ex:
+            fail(url_images[url], ex)
+            return None
+
+    def fetch_unreferenced(image_name: str) -> Optional[Tuple[bool, int, bool]]:
+        try:
+            return fetch_image(store, image_name, scheduler, force)
+        except Exception as ex:
+            fail(image_name, ex)
+            return None
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(fetch_url, url_images))
+            results += list(executor.map(fetch_unreferenced, unreferenced))
+    finally:
+        store.save()
+    fetched = [x for x in results if x is not None]
+    return AssetSyncResult(
+        images=len(names),
+        urls=len(results),
+        cached=sum(1 for downloaded, _, _ in fetched if not downloaded),
+        downloaded=sum(1 for downloaded, _, _ in fetched if downloaded),
+        new_blobs=sum(1 for _, _, is_new in fetched if is_new),
+        failed=failed,
+        bytes_downloaded=sum(n for _, n, _ in fetched),
+        usage=store.usage(),
+      )
@@ -1,13 +1,26 @@
 from ..internal_types import *
-from .fandom_scrape import get_url_markdown, get_url_text, get_url_bytes
+from .fandom_scrape import get_url_markdown, get_url_text, open_url_stream
 
 from functools import cache
+import os
 from urllib.parse import urljoin
 
 FACTORYTOWN_WIKI = "https://factorytown.fandom.com/wiki"
+"""The wiki's base URL. Can be overridden with the FACTORYTOWN_WIKI environment variable, e.g. to scrape
+   from a local replay server."""
+
+def get_wiki_base_url() -> str:
+    return os.environ.get('FACTORYTOWN_WIKI') or FACTORYTOWN_WIKI
+
+def set_wiki_base_url(url: Optional[str]):
+    """Overrides the wiki's base URL for this process and its child processes. None restores the default."""
+    if url is None:
+        os.environ.pop('FACTORYTOWN_WIKI', None)
+    else:
+        os.environ['FACTORYTOWN_WIKI'] = url
 
 def get_page_url(page: str) -> str:
-    wiki = FACTORYTOWN_WIKI
+    wiki = get_wiki_base_url()
     if not wiki.endswith("/"):
         wiki += "/"
     return f"{wiki}{page}"
@@ -18,9 +31,18 @@ def get_page_html(page: str, force: bool=False) -> str:
 def get_page_markdown(page: str, force: bool=False) -> str:
     return get_url_markdown(get_page_url(page), force)
 
-def get_page_asset(page: Optional[str], asset_url: str) -> bytes:
+def get_page_asset_url(page: Optional[str], asset_url: str) -> str:
+    """Resolves an asset URL found on a page (which may be relative to the page's URL)."""
     if page is None or page == "":
-        url = asset_url
-    else:
-        url = urljoin(get_page_url(page), asset_url)
-    return get_url_bytes(url)
\ No newline at end of file
+        return asset_url
+    return urljoin(get_page_url(page), asset_url)
+
+def open_page_asset(page: Optional[str], asset_url: str, force: bool=False) -> Iterator[bytes]:
+    """Returns an iterator over an asset found on a page, a chunk at a time, yielding chunks while they
+       download if the asset is not cached yet (see open_url_stream)."""
+    return open_url_stream(get_page_asset_url(page, asset_url), force)
+
+def get_page_asset(page: Optional[str], asset_url: str, force: bool=False) -> bytes:
+    """Returns the whole content of an asset found on a page. Assets are read from their cache file each
+       time rather than kept in the in-memory cache tier."""
+    return b"".join(open_page_asset(page, asset_url, force))
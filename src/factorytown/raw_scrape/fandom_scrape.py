@@ -1,12 +1,22 @@
 from ..internal_types import *
 from ..proj_dir import get_project_dir
+from ..profiling import profiled, span
+from ..metrics import CACHE_REQUESTS, EXTRACT_CALLS, EXTRACT_SECONDS
+from .fetch_scheduler import DEFAULT_CHUNK_SIZE, get_fetch_scheduler, iter_response_chunks
+from .memory_cache import MemoryCache, RequestCoalescer
 
+from contextlib import contextmanager
 from functools import cache
 import os
 import hashlib
 import re
-import requests
 import subprocess
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not POSIX
+    fcntl = None  # type: ignore[assignment]
 
 @cache
 def get_markdown_scrape_script() -> str:
@@ -14,7 +24,20 @@ def get_markdown_scrape_script() -> str:
 
 @cache
 def get_cache_dir() -> str:
-    return os.path.join(get_project_dir(), "data", "cache", "scrape")
+    """Returns the scrape cache directory: $FACTORYTOWN_CACHE_DIR if set, otherwise data/cache/scrape in
+       the project directory."""
+    cache_dir = os.environ.get('FACTORYTOWN_CACHE_DIR')
+    if cache_dir is None:
+        cache_dir = os.path.join(get_project_dir(), "data", "cache", "scrape")
+    return cache_dir
+
+def reset_cache_dirs():
+    """Forgets the cached scrape cache directory paths, so a change to FACTORYTOWN_CACHE_DIR takes effect."""
+    get_cache_dir.cache_clear()
+    get_http_cache_dir.cache_clear()
+    get_markdown_cache_dir.cache_clear()
+    get_lock_dir.cache_clear()
+    get_memory_cache().clear()
 
 @cache
 def get_http_cache_dir() -> str:
@@ -24,6 +47,171 @@ def get_http_cache_dir() -> str:
 def get_markdown_cache_dir() -> str:
     return os.path.join(get_cache_dir(), "md")
 
+@cache
+def get_lock_dir() -> str:
+    return os.path.join(get_cache_dir(), "locks")
+
+MEMORY_CACHE_ENV_VAR = "FACTORYTOWN_MEMORY_CACHE_MB"
+"""Environment variable setting the size of the in-memory scrape cache tier, in megabytes; 0 disables it."""
+
+DEFAULT_MEMORY_CACHE_MB = 64
+
+MAX_MEMORY_CACHED_BYTES = 1024 * 1024
+"""The largest value kept in the memory tier. Larger pages are read from their cache files each time, so a
+   few large downloads do not evict the many small pages."""
+
+@cache
+def get_memory_cache() -> MemoryCache:
+    """Returns the in-memory tier in front of the on-disk http and md caches, which keeps recently used page
+       bytes and markdown so repeated lookups need not reopen and decode the cache files. Its size is
+       $FACTORYTOWN_MEMORY_CACHE_MB, or 64 MB; values larger than MAX_MEMORY_CACHED_BYTES are not kept.
+
+       Each value is versioned by the identity of the cache file it was read from (see file_version), so
+       a cache file rewritten by another process, or by hand, is read again rather than served stale."""
+    size_mb = float(os.environ.get(MEMORY_CACHE_ENV_VAR, DEFAULT_MEMORY_CACHE_MB))
+    return MemoryCache(int(size_mb * 1024 * 1024), max_value_bytes=MAX_MEMORY_CACHED_BYTES)
+
+FileVersion = Tuple[int, int, int]
+
+def file_version(st: os.stat_result) -> FileVersion:
+    """The identity of a file's content, as far as a stat can tell: its inode, modification time and size.
+       Cache files are replaced by renaming (see CacheFileTee), which changes the inode."""
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _get_memory_cached(key: Tuple[str, str], cache_path: str) -> Any:
+    """Returns the memory tier's value for key if cache_path has not changed since it was read, or UNSET."""
+    try:
+        version: Optional[FileVersion] = file_version(os.stat(cache_path))
+    except FileNotFoundError:
+        # Still a lookup (and a miss); it also drops any value read from a file since removed.
+        version = None
+    return get_memory_cache().get(key, version)
+
+def _read_cache_file(path: str, mode: str) -> Tuple[Any, FileVersion]:
+    """Reads a cache file, returning its content and the version of the file read."""
+    with open(path, mode) as f:
+        return f.read(), file_version(os.fstat(f.fileno()))
+
+_coalescer = RequestCoalescer()
+
+def get_scrape_cache_stats() -> JsonableDict:
+    """Returns this process's scrape cache lookups and hit ratio by tier (memory, http, md), the memory
+       tier's stats (see MemoryCache.stats), and the number of requests coalesced with one in flight."""
+    tiers: JsonableDict = {}
+    for tier in ("memory", "http", "md"):
+        counts = {result: int(CACHE_REQUESTS.get(tier=tier, result=result)) for result in ("hit", "shared", "miss")}
+        lookups = sum(counts.values())
+        tiers[tier] = dict(counts, hit_ratio=None if lookups == 0 else (counts["hit"] + counts["shared"]) / lookups)
+    return dict(tiers=tiers, memory=get_memory_cache().stats(), coalesced=_coalescer.coalesced)
+
+@cache
+def get_umask() -> int:
+    """Returns the process's umask, read once: it can only be read by setting it, which is not safe to do
+       while other threads create files."""
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+def make_cache_temp_file(dir: str, prefix: str=".tmp-") -> Tuple[int, str]:
+    """Creates a temporary file in dir to be renamed into the cache, and returns its descriptor and path.
+       Unlike tempfile.mkstemp's files, which are readable only by their owner, it gets the mode any new
+       file would (0666 less the umask), so the cache stays shared by every user the umask allows."""
+    fd, path = tempfile.mkstemp(dir=dir, prefix=prefix)
+    if hasattr(os, "fchmod"):
+        os.fchmod(fd, 0o666 & ~get_umask())
+    return fd, path
+
+class CacheFileTee:
+    """Passes chunks through to whoever iterates over it while writing them to a cache file atomically:
+       each chunk is written to a temporary file in the cache file's directory and added to a SHA-256
+       hash before it is yielded, and once the chunks run out the temporary file is renamed over path, so
+       readers in other processes see either the old file or the complete new one, never a partial write.
+
+       sha256 and size are set when the file is in place. If iteration is abandoned (close(), or the tee
+       is garbage collected) or the chunks raise, the temporary file is removed and path is left as it
+       was."""
+    path: str
+    sha256: Optional[str]
+    size: int
+
+    def __init__(self, path: str, chunks: Iterable[bytes]):
+        self.path = path
+        self.sha256 = None
+        self.size = 0
+        self._chunks = self._tee(chunks)
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self._chunks
+
+    def close(self):
+        self._chunks.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _tee(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        cache_dir = os.path.dirname(self.path)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = make_cache_temp_file(cache_dir)
+        h = hashlib.sha256()
+        source = iter(chunks)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in source:
+                    f.write(chunk)
+                    h.update(chunk)
+                    self.size += len(chunk)
+                    yield chunk
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        finally:
+            # Let an abandoned source (e.g., a streamed response) release its resources now.
+            close = getattr(source, "close", None)
+            if close is not None:
+                close()
+        self.sha256 = h.hexdigest()
+
+def write_cache_chunks(path: str, chunks: Iterable[bytes]) -> Tuple[str, int]:
+    """Writes a cache file atomically, one chunk at a time (see CacheFileTee). Returns the content's hex
+       SHA-256 digest, computed as it is written, and its size."""
+    tee = CacheFileTee(path, chunks)
+    for _ in tee:
+        pass
+    assert tee.sha256 is not None
+    return tee.sha256, tee.size
+
+def write_cache_file(path: str, content: bytes):
+    """Writes a cache file atomically (see write_cache_chunks)."""
+    write_cache_chunks(path, [content])
+
+@contextmanager
+def cache_file_lock(tier: str, filename: str, enabled: bool=True) -> Generator[None, None, None]:
+    """Holds an exclusive lock on one cache entry for the duration of the context, shared by all threads
+       and processes using the same cache directory. Used so only one of them fills a missing entry while
+       the others wait and then read it.
+
+       Lock files live in the cache's "locks" directory and are left in place, since removing a lock file
+       another process has open would let a third process lock a different file of the same name. The
+       operating system releases the lock if its holder dies. Without fcntl (i.e., not on POSIX), this
+       does nothing, as it does if enabled is False."""
+    if fcntl is None or not enabled:
+        yield
+        return
+    lock_dir = os.path.join(get_lock_dir(), tier)
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, filename), 'a') as f:
+        with span(f"{tier}_cache_lock"):
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
 def get_url_filename(url: str) -> str:
     """Maps an arbitrary URL into a unique but readable filename.
        
@@ -44,6 +232,7 @@ def get_url_filename(url: str) -> str:
     h.update(url.encode('utf-8'))
     return f"{filename}.{h.hexdigest()}"
 
+@profiled()
 def get_url_bytes(url: str, force: bool=False) -> bytes:
     """Fetch the raw binary content at the given URL, either from cache or by downloading.
        Updates the cache if the content is downloaded.
@@ -54,22 +243,81 @@ def get_url_bytes(url: str, force: bool=False) -> bytes:
 
     Returns:
         bytes: The raw content at the location
+
+    Raises:
+        requests.HTTPError: If the response is still an error after the fetch scheduler's retries.
     """
+    key = ("http", url)
+    if force:
+        return _get_url_bytes(url, force)
+    content = _get_memory_cached(key, os.path.join(get_http_cache_dir(), get_url_filename(url)))
+    if not isinstance(content, UnsetType):
+        return content
+    # Concurrent callers in this process share one disk read or download.
+    return _coalescer.run(key, lambda: _get_url_bytes(url, force), tier="http")
+
+def _get_url_bytes(url: str, force: bool) -> bytes:
+    cache_path = _ensure_http_cache(url, force)
+    with span("http_cache_read"):
+        content, version = _read_cache_file(cache_path, 'rb')
+    get_memory_cache().put(("http", url), content, version)
+    return content
+
+def _ensure_http_cache(url: str, force: bool) -> str:
+    """Downloads url into the http cache unless it is already there (or force), and returns the path of
+       its cache file."""
+    for _ in _fill_http_cache(url, force):
+        pass
+    return os.path.join(get_http_cache_dir(), get_url_filename(url))
+
+def _fill_http_cache(url: str, force: bool) -> Iterator[bytes]:
+    """Downloads url into the http cache unless it is already there (or force), yielding the body's chunks
+       as they are written; yields nothing if the cache file was already there. The cache file appears
+       once the last chunk has been consumed (see CacheFileTee)."""
     filename = get_url_filename(url)
-    cache_dir = get_http_cache_dir()
-    cache_path = os.path.join(cache_dir, filename)
+    cache_path = os.path.join(get_http_cache_dir(), filename)
     if not force and os.path.exists(cache_path):
-        with open(cache_path, 'rb') as f:
-            return f.read()
-    # Download the content
-    r = requests.get(url)
-    r.raise_for_status()
-    content = r.content
-    # Write to cache
-    os.makedirs(cache_dir, exist_ok=True)
-    with open(cache_path, 'wb') as f:
-        f.write(content)
-    return content
+        CACHE_REQUESTS.inc(tier="http", result="hit")
+        return
+    # A forced refresh wants its own copy, so it does not wait on (or hold up) other fetches of the entry.
+    with cache_file_lock("http", filename, enabled=not force):
+        if not force and os.path.exists(cache_path):
+            # Another thread or process downloaded it while we waited for the lock.
+            CACHE_REQUESTS.inc(tier="http", result="shared")
+            return
+        CACHE_REQUESTS.inc(tier="http", result="miss")
+        with span("http_download"):
+            r = get_fetch_scheduler().fetch(url, stream=True)
+            if not r.ok:
+                r.close()
+                r.raise_for_status()
+        # Stream the content into the cache, so a download never needs more than a chunk of memory.
+        with CacheFileTee(cache_path, iter_response_chunks(r)) as tee:
+            yield from tee
+
+def _iter_file_chunks(path: str, chunk_size: int=DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+def open_url_stream(url: str, force: bool=False) -> Iterator[bytes]:
+    """Returns an iterator over the raw binary content at the given URL, a chunk at a time. Unlike
+       get_url_bytes, the content is never held in memory as a whole (nor added to the memory tier).
+
+       If the content is not already cached (or force), the chunks are yielded as they are downloaded,
+       each written to the cache on the way through; the cache file is put in place when the last chunk
+       has been consumed. Closing the iterator early discards the partial download. Nothing is fetched
+       until the first chunk is asked for.
+
+    Raises:
+        requests.HTTPError: If the response is still an error after the fetch scheduler's retries.
+    """
+    downloaded = False
+    for chunk in _fill_http_cache(url, force):
+        downloaded = True
+        yield chunk
+    if not downloaded:
+        yield from _iter_file_chunks(os.path.join(get_http_cache_dir(), get_url_filename(url)))
 
 def get_url_text(url: str, force: bool=False) -> str:
     """Fetch the text content at the given URL, either from cache or by downloading.
@@ -84,6 +332,7 @@ def get_url_text(url: str, force: bool=False) -> str:
     """
     return get_url_bytes(url, force).decode('utf-8')
 
+@profiled()
 def get_url_markdown(url: str, force: bool=False) -> str:
     """Fetch the wikitext markdown content at the given URL, either from cache or by downloading.
        Updates the cache if the content is downloaded.
@@ -98,23 +347,43 @@ def get_url_markdown(url: str, force: bool=False) -> str:
     """
     if not url.endswith("?action=edit"):
         url += "?action=edit"
+    key = ("md", url)
+    if force:
+        return _get_url_markdown(url, force)
+    markdown = _get_memory_cached(key, os.path.join(get_markdown_cache_dir(), get_url_filename(url)))
+    if not isinstance(markdown, UnsetType):
+        return markdown
+    return _coalescer.run(key, lambda: _get_url_markdown(url, force), tier="md")
+
+def _get_url_markdown(url: str, force: bool) -> str:
     filename = get_url_filename(url)
     cache_dir = get_markdown_cache_dir()
     cache_path = os.path.join(cache_dir, filename)
     if not force and os.path.exists(cache_path):
-        with open(cache_path, 'r') as f:
-            return f.read()
-        
-    html = get_url_text(url, force)
-    script = get_markdown_scrape_script()
-    
-    # Run the script with fetched html as input
-    
-    markdown_utf8 = subprocess.check_output([script], input=html.encode('utf-8'))
-    markdown = markdown_utf8.decode('utf-8')
-    
-    # Write to cache
-    os.makedirs(cache_dir, exist_ok=True)
-    with open(cache_path, 'w') as f:
-        f.write(markdown)
+        CACHE_REQUESTS.inc(tier="md", result="hit")
+        with span("md_cache_read"):
+            markdown, version = _read_cache_file(cache_path, 'r')
+    else:
+        with cache_file_lock("md", filename, enabled=not force):
+            if not force and os.path.exists(cache_path):
+                # Another thread or process extracted it while we waited for the lock.
+                CACHE_REQUESTS.inc(tier="md", result="shared")
+                with span("md_cache_read"):
+                    markdown, version = _read_cache_file(cache_path, 'r')
+            else:
+                CACHE_REQUESTS.inc(tier="md", result="miss")
+
+                html = get_url_text(url, force)
+                script = get_markdown_scrape_script()
+
+                # Run the script with fetched html as input
+
+                EXTRACT_CALLS.inc()
+                with span("extract_subprocess"), EXTRACT_SECONDS.time():
+                    markdown_utf8 = subprocess.check_output([script], input=html.encode('utf-8'))
+                markdown = markdown_utf8.decode('utf-8')
+
+                write_cache_file(cache_path, markdown_utf8)
+                version = file_version(os.stat(cache_path))
+    get_memory_cache().put(("md", url), markdown, version)
     return markdown
@@ -0,0 +1,329 @@
+"""
+Rate-limited, adaptively concurrent HTTP fetching with retries.
+
+Every request passes through a token bucket, which caps the request rate, and an AIMD (additive increase,
+multiplicative decrease) concurrency limit, which finds how many requests the server sustains at once:
+
+  * Each success raises the limit by 1 / limit, so it grows by about one per limit's worth of successes.
+  * A success much slower than the typical latency lowers the limit by latency_backoff, since queueing
+    at the server shows up as latency before it shows up as errors.
+  * A 429 or 503 response halves the limit, and all requests wait out the response's Retry-After.
+
+Failed requests (429, 5xx and connection errors) are retried with full-jitter exponential backoff, never
+sooner than Retry-After asks.
+"""
+
+from ..internal_types import *
+from ..metrics import (
+    HTTP_REQUESTS, HTTP_RESPONSE_BYTES, HTTP_REQUEST_SECONDS, FETCH_RETRIES, FETCH_CONCURRENCY_LIMIT,
+)
+
+from email.utils import parsedate_to_datetime
+import os
+import random
+import requests
+import threading
+import time
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_FETCH_RATE = 20.0
+"""Default maximum requests per second, per process."""
+
+DEFAULT_FETCH_CONCURRENCY = 32
+"""Default maximum concurrent requests, per process."""
+
+FETCH_RATE_ENV_VAR = "FACTORYTOWN_FETCH_RATE"
+"""Environment variable overriding DEFAULT_FETCH_RATE for the shared scheduler; 0 or "none" removes the
+   limit."""
+
+FETCH_CONCURRENCY_ENV_VAR = "FACTORYTOWN_FETCH_CONCURRENCY"
+"""Environment variable overriding DEFAULT_FETCH_CONCURRENCY for the shared scheduler."""
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+"""Bytes read at a time from streamed response bodies."""
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+THROTTLE_STATUSES = frozenset([429, 503])
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+"""Request errors that may succeed when retried. Others, such as an invalid URL, are raised at once."""
+
+class TokenBucket:
+    """Allows rate acquisitions per second on average, with bursts of up to burst. A rate of None allows
+       any rate."""
+    rate: Optional[float]
+    burst: float
+    _tokens: float
+    _updated: float
+    _lock: threading.Lock
+
+    def __init__(self, rate: Optional[float], burst: Optional[float]=None):
+        self.rate = rate
+        self.burst = max(1.0, burst if burst is not None else (rate or 1.0))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, and takes it."""
+        if self.rate is None:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class AimdLimiter:
+    """A concurrency limit adjusted by additive increase and multiplicative decrease. acquire() blocks
+       while the number of requests in flight is at the limit."""
+    limit: float
+    min_limit: float
+    max_limit: float
+    latency_backoff: float
+    latency_tolerance: float
+    in_flight: int
+    _typical_latency: Optional[float] = None
+    _condition: threading.Condition
+
+    def __init__(
+            self,
+            initial: float=4,
+            min_limit: float=1,
+            max_limit: float=64,
+            latency_backoff: float=0.9,
+            latency_tolerance: float=3.0,
+          ):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_backoff = latency_backoff
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        FETCH_CONCURRENCY_LIMIT.set(self.limit)
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= max(1, int(self.limit)):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def _set_limit(self, limit: float):
+        # Called with the condition held.
+        self.limit = min(self.max_limit, max(self.min_limit, limit))
+        FETCH_CONCURRENCY_LIMIT.set(self.limit)
+        self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        with self._condition:
+            typical = self._typical_latency
+            if typical is not None and latency > typical * self.latency_tolerance:
+                self._set_limit(self.limit * self.latency_backoff)
+            else:
+                self._set_limit(self.limit + 1.0 / self.limit)
+            # Track the typical latency with an exponentially weighted moving average.
+            self._typical_latency = latency if typical is None else 0.9 * typical + 0.1 * latency
+
+    def on_throttle(self):
+        with self._condition:
+            self._set_limit(self.limit / 2)
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header, in seconds or as an HTTP date, into seconds from now."""
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class FetchScheduler:
+    """Issues HTTP GETs through a token bucket and an AIMD concurrency limit, retrying throttled and
+       failed requests. Safe to use from many threads; one is shared per process (see
+       get_fetch_scheduler)."""
+    bucket: TokenBucket
+    limiter: AimdLimiter
+    max_attempts: int
+    base_delay: float
+    max_delay: float
+    timeout: float
+    session: requests.Session
+    retries: int = 0
+    throttled: int = 0
+    """Responses with status 429 or 503."""
+
+    _paused_until: float = 0.0
+    _lock: threading.Lock
+    _rng: random.Random
+
+    def __init__(
+            self,
+            rate: Optional[float]=DEFAULT_FETCH_RATE,
+            burst: Optional[float]=None,
+            initial_concurrency: float=4,
+            max_concurrency: float=DEFAULT_FETCH_CONCURRENCY,
+            max_attempts: int=6,
+            base_delay: float=0.5,
+            max_delay: float=30.0,
+            timeout: float=60.0,
+          ):
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AimdLimiter(initial=initial_concurrency, max_limit=max_concurrency)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=int(max_concurrency))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        with self._lock:
+            delay = self._rng.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def _pause(self, seconds: float):
+        """Holds back every new request for seconds, as a server's Retry-After asks."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _wait_for_pause(self):
+        while True:
+            with self._lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def _count_retry(self, reason: str):
+        with self._lock:
+            self.retries += 1
+        FETCH_RETRIES.inc(reason=reason)
+
+    def fetch(self, url: str, stream: bool=False) -> requests.Response:
+        """GETs url, retrying 429, 5xx, connection errors and timeouts (RETRY_EXCEPTIONS) up to max_attempts
+           times in all. Returns the last response, whatever its status; raises the last connection error if
+           no response was received. Other request errors are raised without retrying.
+
+           If stream is True, the body of a successful response is not read; consume it with
+           iter_response_chunks(), which closes the response. Its concurrency slot is released once the
+           headers arrive, so the limit then bounds requests waiting on the server, not body transfers."""
+        attempt = 0
+        while True:
+            self._wait_for_pause()
+            self.bucket.acquire()
+            self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, timeout=self.timeout, stream=stream)
+                if not stream or response.status_code in RETRY_STATUSES:
+                    content = response.content
+            except RETRY_EXCEPTIONS as ex:
+                self.limiter.release()
+                self.limiter.on_throttle()
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise
+                self._count_retry(ex.__class__.__name__)
+                delay = self._backoff(attempt, None)
+                logger.info(f"GET {url} failed ({ex}); retrying in {delay:.2f} s")
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.limiter.release()
+                raise
+            latency = time.perf_counter() - start
+            self.limiter.release()
+            HTTP_REQUEST_SECONDS.observe(latency)
+            HTTP_REQUESTS.inc(status=response.status_code)
+            if not stream or response.status_code in RETRY_STATUSES:
+                HTTP_RESPONSE_BYTES.inc(len(content))
+            if response.status_code not in RETRY_STATUSES:
+                self.limiter.on_success(latency)
+                return response
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if response.status_code in THROTTLE_STATUSES:
+                with self._lock:
+                    self.throttled += 1
+                self.limiter.on_throttle()
+                if retry_after is not None:
+                    self._pause(min(retry_after, self.max_delay))
+            attempt += 1
+            if attempt >= self.max_attempts:
+                return response
+            self._count_retry(str(response.status_code))
+            delay = self._backoff(attempt, retry_after)
+            logger.info(f"GET {url} returned {response.status_code}; retrying in {delay:.2f} s")
+            time.sleep(delay)
+
+    def stats(self) -> JsonableDict:
+        with self._lock:
+            retries, throttled = self.retries, self.throttled
+        return dict(
+            rate=self.bucket.rate,
+            concurrency_limit=self.limiter.limit,
+            max_concurrency=self.limiter.max_limit,
+            in_flight=self.limiter.in_flight,
+            retries=retries,
+            throttled=throttled,
+          )
+
+def iter_response_chunks(response: requests.Response, chunk_size: int=DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yields the body of a response fetched with stream=True, chunk_size bytes at a time, and closes the
+       response when done or abandoned."""
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            HTTP_RESPONSE_BYTES.inc(len(chunk))
+            yield chunk
+    finally:
+        response.close()
+
+_scheduler: Optional[FetchScheduler] = None
+_scheduler_pid: Optional[int] = None
+_scheduler_lock = threading.Lock()
+
+def get_fetch_scheduler() -> FetchScheduler:
+    """Returns this process's shared FetchScheduler, creating it on first use (and again in a forked child,
+       so children do not share connections with their parent). Its limits come from
+       $FACTORYTOWN_FETCH_RATE and $FACTORYTOWN_FETCH_CONCURRENCY, if set."""
+    global _scheduler, _scheduler_pid
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler_pid != os.getpid():
+            rate: Optional[float] = DEFAULT_FETCH_RATE
+            rate_env = os.environ.get(FETCH_RATE_ENV_VAR)
+            if rate_env is not None:
+                rate = None if rate_env.lower() in ("", "none") or float(rate_env) <= 0 else float(rate_env)
+            max_concurrency = int(os.environ.get(FETCH_CONCURRENCY_ENV_VAR, DEFAULT_FETCH_CONCURRENCY))
+            _scheduler = FetchScheduler(rate=rate, max_concurrency=max_concurrency)
+            _scheduler_pid = os.getpid()
+        return _scheduler
+
+def set_fetch_scheduler(scheduler: Optional[FetchScheduler]):
+    """Replaces this process's shared FetchScheduler. None creates a default one on next use."""
+    global _scheduler, _scheduler_pid
+    with _scheduler_lock:
+        _scheduler = scheduler
+        _scheduler_pid = None if scheduler is None else os.getpid()
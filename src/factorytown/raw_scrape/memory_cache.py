@@ -0,0 +1,153 @@
+"""
+In-process caching in front of the on-disk scrape cache: a least-recently-used cache bounded by the size of
+its values, and coalescing of concurrent requests for the same key.
+"""
+
+from ..internal_types import *
+from ..metrics import CACHE_REQUESTS, MEMORY_CACHE_BYTES, REQUESTS_COALESCED
+
+from collections import OrderedDict
+from typing import Hashable
+import sys
+import threading
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+T = TypeVar('T')
+
+_memory_hits = CACHE_REQUESTS.labels(tier="memory", result="hit")
+_memory_misses = CACHE_REQUESTS.labels(tier="memory", result="miss")
+
+def value_size(value: Any) -> int:
+    """The memory a cached value takes, in bytes, including the object header."""
+    return sys.getsizeof(value)
+
+class MemoryCache:
+    """A thread-safe LRU cache whose total value size (see value_size) is kept at or below max_bytes, by
+       evicting the least recently used values. A value larger than max_value_bytes (by default,
+       max_bytes) is not cached. A max_bytes of 0 disables the cache.
+
+       A value may be cached with a version (e.g., the identity of the file it was read from); a lookup
+       with a different version finds nothing, and drops the outdated value."""
+    max_bytes: int
+    max_value_bytes: int
+    size: int
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    _values: 'OrderedDict[Hashable, Tuple[Any, int, Hashable]]'
+    _lock: threading.Lock
+
+    def __init__(self, max_bytes: int, max_value_bytes: Optional[int]=None):
+        self.max_bytes = max_bytes
+        self.max_value_bytes = max_bytes if max_value_bytes is None else min(max_bytes, max_value_bytes)
+        self.size = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: Hashable=None) -> Any:
+        """Returns the value cached under key with the given version, or UNSET."""
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None and entry[2] != version:
+                del self._values[key]
+                self.size -= entry[1]
+                MEMORY_CACHE_BYTES.set(self.size)
+                entry = None
+            if entry is not None:
+                self._values.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is None:
+            _memory_misses.inc()
+            return UNSET
+        _memory_hits.inc()
+        return entry[0]
+
+    def put(self, key: Hashable, value: Any, version: Hashable=None):
+        size = value_size(value)
+        with self._lock:
+            old = self._values.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if size <= self.max_value_bytes:
+                self._values[key] = (value, size, version)
+                self.size += size
+                while self.size > self.max_bytes:
+                    _, (_, evicted_size, _) = self._values.popitem(last=False)
+                    self.size -= evicted_size
+                    self.evictions += 1
+            MEMORY_CACHE_BYTES.set(self.size)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.size = 0
+            MEMORY_CACHE_BYTES.set(0)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def stats(self) -> JsonableDict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                entries=len(self._values),
+                bytes=self.size,
+                max_bytes=self.max_bytes,
+                hits=self.hits,
+                misses=self.misses,
+                hit_ratio=None if lookups == 0 else self.hits / lookups,
+                evictions=self.evictions,
+              )
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class RequestCoalescer:
+    """Runs at most one call per key at a time in this process: a caller asking for a key that another
+       thread is already computing waits for that call and shares its result (or its exception)."""
+    coalesced: int = 0
+    """Calls answered by another thread's call."""
+
+    _calls: Dict[Hashable, _Call]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: Hashable, func: Callable[[], T], tier: str="") -> T:
+        """Returns func(), or the result of the call already in flight for key."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        assert call is not None
+        if not leader:
+            REQUESTS_COALESCED.inc(tier=tier)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return cast(T, call.result)
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
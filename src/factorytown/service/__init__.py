@@ -0,0 +1,9 @@
+from .engine import (
+    QueryEngine,
+    QueryError,
+    DEFAULT_QUERY_CACHE_SIZE,
+    DEFAULT_CHAIN_DEPTH,
+)
+from .server import ModelSource, ModelServer, DEFAULT_SERVER_PORT
+from .client import ModelClient, SERVER_ENV_VAR, get_server_url
+from .batch import run_batch, answer_line, Queryable
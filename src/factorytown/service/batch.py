@@ -0,0 +1,129 @@
+from ..internal_types import *
+from .engine import QueryEngine, QueryError
+from .client import ModelClient
+
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import json
+import os
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+BatchLine = Tuple[int, str]
+"""(0-based input line number, line text)"""
+
+Queryable = Union[QueryEngine, ModelClient]
+"""Anything with a query(request) method: an in-process engine or a client for a running server."""
+
+def answer_line(target: Queryable, index: int, line: str) -> JsonableDict:
+    """Answers one line of batch input. The response always has "index", the input line number, and
+       echoes the request's "id" if it has one; it then has either "result", or "error" and "status"."""
+    response: JsonableDict = dict(index=index)
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise QueryError("A query must be a JSON object")
+        if "id" in request:
+            response.update(id=request["id"])
+            request = {k: v for k, v in request.items() if k != "id"}
+        response.update(result=target.query(request))
+    except QueryError as ex:
+        response.update(error=str(ex), status=ex.status)
+    except ValueError as ex:
+        response.update(error=f"Invalid JSON query: {ex}", status=400)
+    return response
+
+_worker_target: Optional[Queryable] = None
+
+def _init_worker(target: Queryable):
+    """Process pool initializer. Receives the engine once per worker process."""
+    global _worker_target
+    _worker_target = target
+
+def _answer_chunk(chunk: List[BatchLine], target: Optional[Queryable]=None) -> List[JsonableDict]:
+    if target is None:
+        target = _worker_target
+    assert target is not None
+    return [answer_line(target, i, line) for i, line in chunk]
+
+def _iter_chunks(lines: Iterable[str], chunk_size: int) -> Iterator[List[BatchLine]]:
+    chunk: List[BatchLine] = []
+    for i, line in enumerate(lines):
+        if line.strip() == "":
+            continue
+        chunk.append((i, line))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+def run_batch(
+        target: Queryable,
+        lines: Iterable[str],
+        *,
+        ordered: bool=True,
+        max_workers: Optional[int]=1,
+        chunk_size: int=64,
+        max_pending_chunks: Optional[int]=None,
+      ) -> Iterator[JsonableDict]:
+    """Answers newline-delimited JSON queries, yielding one response per non-blank input line (see
+       answer_line()). A malformed or failed query yields an error response rather than stopping the batch.
+
+       With max_workers=1, each line is answered as soon as it is read, so lines may come from an
+       interactive pipe. Otherwise lines are sent to workers in chunks of chunk_size: worker processes
+       that each receive a copy of an in-process engine once, or threads sharing a ModelClient. At most
+       max_pending_chunks chunks (default: 4 per worker) are in flight, which bounds both the input read
+       ahead and the results buffered to restore input order.
+
+    Args:
+        target: The engine or server client to query.
+        lines: The input lines.
+        ordered: Yield responses in input order. If False, each chunk's responses are yielded as soon as
+            the chunk completes.
+        max_workers: Number of workers. None uses the CPU count. 1 answers in the calling thread.
+        chunk_size: Number of lines sent to a worker per task.
+        max_pending_chunks: Limit on chunks in flight.
+    """
+    if max_workers == 1:
+        for i, line in enumerate(lines):
+            if line.strip() != "":
+                yield answer_line(target, i, line)
+        return
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_pending_chunks is None:
+        max_pending_chunks = 4 * max_workers
+
+    executor: Executor
+    if isinstance(target, QueryEngine):
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(target,))
+        submit = lambda chunk: executor.submit(_answer_chunk, chunk)
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        submit = lambda chunk: executor.submit(_answer_chunk, chunk, target)
+    with executor:
+        pending: Dict[int, Future] = {}
+        chunks = _iter_chunks(lines, chunk_size)
+        next_chunk = 0
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending_chunks:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                pending[next_chunk] = submit(chunk)
+                next_chunk += 1
+            if len(pending) == 0:
+                break
+            if ordered:
+                # Wait for the oldest chunk; chunks that finish first stay in pending until their turn.
+                yield from pending.pop(min(pending)).result()
+            else:
+                done, _ = wait(pending.values(), return_when=FIRST_COMPLETED)
+                for chunk_id in [k for k, f in pending.items() if f in done]:
+                    yield from pending.pop(chunk_id).result()
+        logger.debug(f"Batch answered {next_chunk} chunks")
@@ -0,0 +1,63 @@
+from ..internal_types import *
+from .engine import QueryError
+
+import http.client
+import json
+import os
+from urllib.parse import urlsplit
+
+SERVER_ENV_VAR = "FACTORYTOWN_SERVER"
+"""Environment variable holding the URL of a running `factorytown serve`, which CLI queries then use."""
+
+def get_server_url() -> Optional[str]:
+    """Returns the query server URL from $FACTORYTOWN_SERVER, or None if it is not set."""
+    url = os.environ.get(SERVER_ENV_VAR)
+    return None if url is None or url == "" else url
+
+class ModelClient:
+    """Sends queries to a ModelServer. Each call makes one HTTP request on a new connection."""
+    url: str
+    timeout: float
+
+    def __init__(self, url: str, timeout: float=60.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, body: Optional[JsonableDict]=None) -> JsonableDict:
+        parts = urlsplit(self.url)
+        if parts.scheme != "http" or parts.hostname is None:
+            raise FactoryTownError(f"Query server URL must be http://host:port, not {self.url!r}")
+        connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=self.timeout)
+        try:
+            data = None if body is None else json.dumps(body).encode('utf-8')
+            headers = {} if data is None else {"Content-Type": "application/json"}
+            try:
+                connection.request(method, path, body=data, headers=headers)
+                response = connection.getresponse()
+                payload = response.read()
+            except OSError as ex:
+                raise FactoryTownError(f"Could not reach query server at {self.url}: {ex}") from ex
+        finally:
+            connection.close()
+        result = json.loads(payload)
+        if response.status != 200:
+            raise QueryError(str(result.get("error", payload)), status=response.status)
+        return result
+
+    def query(self, request: JsonableDict) -> Jsonable:
+        """Sends a query (see QueryEngine.query) and returns its result.
+
+        Raises:
+            QueryError: If the server rejected the query.
+            FactoryTownError: If the server could not be reached.
+        """
+        return self._request("POST", "/query", request)["result"]
+
+    def status(self) -> JsonableDict:
+        return self._request("GET", "/status")
+
+    def __str__(self):
+        return f"ModelClient({self.url!r})"
+
+    def __repr__(self):
+        return str(self)
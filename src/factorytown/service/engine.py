@@ -0,0 +1,237 @@
+from ..internal_types import *
+from ..model import FactoryTownModel, CompactModel, NO_ID, record_fields
+from ..planning import Scenario, evaluate_requirements
+from ..metrics import CACHE_REQUESTS, QUERY_SECONDS
+
+from collections import OrderedDict
+import json
+import threading
+import time
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+_query_hits = CACHE_REQUESTS.labels(tier="query", result="hit")
+_query_misses = CACHE_REQUESTS.labels(tier="query", result="miss")
+
+DEFAULT_QUERY_CACHE_SIZE = 4096
+"""Number of query results an engine keeps by default."""
+
+DEFAULT_CHAIN_DEPTH = 6
+
+class QueryError(FactoryTownError):
+    """A query that cannot be answered. status is the HTTP status the server responds with."""
+    status: int
+
+    def __init__(self, msg: str, status: int=400):
+        super().__init__(msg)
+        self.status = status
+
+class QueryEngine:
+    """Answers JSON queries against a snapshot of a model.
+
+       All the data queries need is extracted from the model when the engine is created, so queries never
+       touch the record registry (whose lookups can add references) and any number of threads can query
+       one engine at once. Later changes to the model are not seen; build a new engine instead.
+
+       Each query is a dict with an "op" key; see query() for the operations. Results are cached by
+       query, least recently used first out, up to cache_size results.
+    """
+    records: Dict[str, JsonableDict]
+    """Record name, class, and encoded fields (see record_fields) of each instantiated record, by name."""
+
+    compact: CompactModel
+    tag_index: Dict[str, List[str]]
+    """Sorted record names by tag."""
+
+    class_index: Dict[str, List[str]]
+    """Sorted record names by record class name."""
+
+    cache_size: int
+    loaded_at: float
+    _cache: 'OrderedDict[str, Jsonable]'
+    _cache_lock: threading.Lock
+    _hits: int = 0
+    _misses: int = 0
+
+    def __init__(self, model: FactoryTownModel, cache_size: int=DEFAULT_QUERY_CACHE_SIZE):
+        self.records = {}
+        tag_index: Dict[str, List[str]] = {}
+        class_index: Dict[str, List[str]] = {}
+        for name, record in sorted(model.records.referenced_items()):
+            if record is None:
+                continue
+            class_name = record.__class__.__name__
+            self.records[name] = dict(name=name, class_name=class_name, fields=record_fields(record))
+            class_index.setdefault(class_name, []).append(name)
+            for tag in sorted(record.tags):
+                tag_index.setdefault(tag, []).append(name)
+        self.tag_index = tag_index
+        self.class_index = class_index
+        self.compact = CompactModel.from_model(model)
+        if len(self.compact) > 0:
+            # Build the lazily computed producer index now, rather than racing to build it in queries.
+            self.compact.producers(0)
+        self.cache_size = cache_size
+        self.loaded_at = time.time()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Engines are pickled to send them to batch worker processes; each worker starts with an empty cache.
+        state = dict(vars(self))
+        for attr in ("_cache", "_cache_lock", "_hits", "_misses"):
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        vars(self).update(state)
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def query(self, request: JsonableDict) -> Jsonable:
+        """Answers a query, from the cache if possible. Operations and their arguments:
+
+           record(name): The record's class and fields.
+           records(class_name=None, tag=None, prefix=None): Sorted names of matching records.
+           tags(): The number of records with each tag.
+           classes(): The number of records of each class.
+           chain(name, max_depth=6): The tree of recipes producing a record, down to records with no
+               producing recipe, max_depth recipes deep.
+           requirements(targets, tech_level=None, excluded_buildings=[]): Raw inputs and crafts needed to
+               produce targets (a dict of record name to rate); see evaluate_requirements().
+
+        Raises:
+            QueryError: If the query is malformed or names an unknown record.
+        """
+        key = json.dumps(request, sort_keys=True)
+        with self._cache_lock:
+            result = self._cache.get(key, UNSET)
+            if not isinstance(result, UnsetType):
+                self._cache.move_to_end(key)
+                self._hits += 1
+                _query_hits.inc()
+                return result
+            self._misses += 1
+        _query_misses.inc()
+        op = request.get("op")
+        handler = self._OPS.get(op) if isinstance(op, str) else None
+        if handler is None:
+            raise QueryError(f"Unknown query op {op!r}; expected one of {', '.join(sorted(self._OPS))}")
+        args = {k: v for k, v in request.items() if k != "op"}
+        with QUERY_SECONDS.time(op=op):
+            try:
+                result = handler(self, **args)
+            except TypeError as ex:
+                raise QueryError(f"Bad arguments for query op {op!r}: {ex}") from ex
+        with self._cache_lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def cache_stats(self) -> JsonableDict:
+        with self._cache_lock:
+            return dict(size=len(self._cache), max_size=self.cache_size, hits=self._hits, misses=self._misses)
+
+    def status(self) -> JsonableDict:
+        return dict(
+            records=len(self.records),
+            referenced=len(self.compact),
+            loaded_at=self.loaded_at,
+            cache=self.cache_stats(),
+          )
+
+    def _record_id(self, name: str) -> int:
+        record_id = self.compact.try_id_of(name)
+        if record_id == NO_ID:
+            raise QueryError(f"Unknown record {name!r}", status=404)
+        return record_id
+
+    def record(self, name: str) -> JsonableDict:
+        result = self.records.get(name)
+        if result is None:
+            if self.compact.try_id_of(name) != NO_ID:
+                raise QueryError(f"Record {name!r} is referenced but not instantiated", status=404)
+            raise QueryError(f"Unknown record {name!r}", status=404)
+        return result
+
+    def list_records(self, class_name: Optional[str]=None, tag: Optional[str]=None, prefix: Optional[str]=None) -> List[str]:
+        if class_name is not None:
+            names = self.class_index.get(class_name, [])
+        elif tag is not None:
+            names = self.tag_index.get(tag, [])
+        else:
+            names = list(self.records)
+        if class_name is not None and tag is not None:
+            tagged = set(self.tag_index.get(tag, []))
+            names = [x for x in names if x in tagged]
+        if prefix is not None:
+            names = [x for x in names if x.startswith(prefix)]
+        return list(names)
+
+    def tags(self) -> Dict[str, int]:
+        return {tag: len(names) for tag, names in sorted(self.tag_index.items())}
+
+    def classes(self) -> Dict[str, int]:
+        return {class_name: len(names) for class_name, names in sorted(self.class_index.items())}
+
+    def chain(self, name: str, max_depth: int=DEFAULT_CHAIN_DEPTH) -> JsonableDict:
+        return self._chain(self._record_id(name), max_depth, frozenset())
+
+    def _chain(self, record_id: int, depth: int, path: AbstractSet[int]) -> JsonableDict:
+        cm = self.compact
+        node: JsonableDict = dict(name=cm.names[record_id], class_name=cm.classes[record_id] or None)
+        if record_id in path:
+            node.update(cycle=True)
+            return node
+        producers = cm.producers(record_id)
+        if len(producers) == 0:
+            return node
+        if depth <= 0:
+            node.update(truncated=True)
+            return node
+        path = path | {record_id}
+        recipes: List[Jsonable] = []
+        for recipe_id in producers:
+            building_id = cm.recipe_buildings[recipe_id]
+            work_units = cm.work_units[recipe_id]
+            recipes.append(dict(
+                recipe=cm.names[recipe_id],
+                building=None if building_id == NO_ID else cm.names[building_id],
+                work_units=None if work_units == NO_ID else work_units,
+                products={cm.names[i]: q for i, q in cm.products[recipe_id]},
+                ingredients=[
+                    dict(quantity=q, **self._chain(i, depth - 1, path))
+                    for i, q in cm.ingredients[recipe_id]
+                  ],
+              ))
+        node.update(recipes=recipes)
+        return node
+
+    def requirements(
+            self,
+            targets: Dict[str, float],
+            tech_level: Optional[int]=None,
+            excluded_buildings: Optional[List[str]]=None,
+          ) -> JsonableDict:
+        for name in targets:
+            self._record_id(name)
+        scenario = Scenario.from_jsonable(dict(targets=targets, tech_level=tech_level, excluded_buildings=excluded_buildings or []))
+        return evaluate_requirements(self.compact, scenario).to_jsonable()
+
+    _OPS: Dict[str, Callable[..., Jsonable]] = {
+        "record": record,
+        "records": list_records,
+        "tags": tags,
+        "classes": classes,
+        "chain": chain,
+        "requirements": requirements,
+      }
+
+    def __str__(self):
+        return f"QueryEngine(records={len(self.records)})"
+
+    def __repr__(self):
+        return str(self)
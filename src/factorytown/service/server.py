@@ -0,0 +1,214 @@
+from ..internal_types import *
+from ..model import FactoryTownModel, load_snapshot
+from ..metrics import MODEL_RELOADS
+from .engine import QueryEngine, QueryError, DEFAULT_QUERY_CACHE_SIZE
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
+import os
+import threading
+import time
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_SERVER_PORT = 8765
+
+class ModelSource:
+    """Where a ModelServer loads its model from: a snapshot file, or a scrape of the wiki through the
+       scrape cache."""
+    snapshot: Optional[str]
+    jobs: Optional[int]
+    force: bool
+    """Refresh the scrape cache on the first load only."""
+
+    def __init__(self, snapshot: Optional[str]=None, jobs: Optional[int]=1, force: bool=False):
+        self.snapshot = snapshot
+        self.jobs = jobs
+        self.force = force
+
+    def signature(self) -> Tuple[Any, ...]:
+        """A value that changes whenever the source's files change: the snapshot file's size and
+           modification time, or the number, total size and latest modification time of the files in the
+           scrape cache. Lock files and dot-files (temporary files still being written) are not counted,
+           since they change without the cache's content changing."""
+        if self.snapshot is not None:
+            try:
+                st = os.stat(self.snapshot)
+            except FileNotFoundError:
+                return ()
+            return (st.st_size, st.st_mtime_ns)
+        from ..raw_scrape.fandom_scrape import get_cache_dir, get_lock_dir
+        lock_dir = os.path.normpath(get_lock_dir())
+        n_files = 0
+        total_size = 0
+        latest = 0
+        for dirpath, dirnames, filenames in os.walk(get_cache_dir()):
+            dirnames[:] = [
+                d for d in dirnames if not d.startswith(".") and os.path.normpath(os.path.join(dirpath, d)) != lock_dir
+              ]
+            for filename in filenames:
+                if filename.startswith("."):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, filename))
+                except FileNotFoundError:
+                    continue
+                n_files += 1
+                total_size += st.st_size
+                latest = max(latest, st.st_mtime_ns)
+        return (n_files, total_size, latest)
+
+    def load(self) -> FactoryTownModel:
+        if self.snapshot is not None:
+            return load_snapshot(self.snapshot)
+        from ..model_scrape import scrape_model
+        force = self.force
+        self.force = False
+        return scrape_model(force=force, jobs=self.jobs)
+
+    def __str__(self):
+        return f"snapshot {self.snapshot!r}" if self.snapshot is not None else "scrape cache"
+
+class ModelServer:
+    """Keeps a model loaded and answers queries on it over HTTP on a local port.
+
+       POST /query with a JSON query body (see QueryEngine.query) responds with {"result": ...}, or with
+       {"error": ...} and a 4xx status. GET /status describes the loaded model.
+
+       Requests are handled on separate threads. When reload_interval is set, the source is checked that
+       often and, when it has changed, a new model and QueryEngine are built in the background and swapped
+       in; queries keep being answered from the old engine meanwhile. A failed reload is logged, the old
+       engine is kept, and the reload is retried on each later check until it succeeds.
+    """
+    source: ModelSource
+    engine: QueryEngine
+    cache_size: int
+    reload_interval: Optional[float]
+    reloads: int = 0
+    _signature: Tuple[Any, ...]
+    _failed_signature: Optional[Tuple[Any, ...]] = None
+    """The signature of the last source that failed to load, so a source that keeps failing is only
+       reported once."""
+    _server: ThreadingHTTPServer
+    _stopping: threading.Event
+    _watcher: Optional[threading.Thread] = None
+
+    def __init__(
+            self,
+            source: ModelSource,
+            host: str="127.0.0.1",
+            port: int=DEFAULT_SERVER_PORT,
+            cache_size: int=DEFAULT_QUERY_CACHE_SIZE,
+            reload_interval: Optional[float]=2.0,
+          ):
+        self.source = source
+        self.cache_size = cache_size
+        self.reload_interval = reload_interval
+        self._stopping = threading.Event()
+        self._signature = source.signature()
+        start = time.perf_counter()
+        self.engine = QueryEngine(source.load(), cache_size=cache_size)
+        logger.info(f"Loaded {self.engine} from {source} in {time.perf_counter() - start:.3f} s")
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path == "/status":
+                    server._respond(self, 200, server.status())
+                else:
+                    server._respond(self, 404, dict(error=f"Not found: {self.path}"))
+
+            def do_POST(self):
+                if self.path != "/query":
+                    server._respond(self, 404, dict(error=f"Not found: {self.path}"))
+                    return
+                server._handle_query(self)
+
+            def log_message(self, format, *args):
+                logger.debug(f"query server: {format % args}")
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def status(self) -> JsonableDict:
+        return dict(source=str(self.source), reloads=self.reloads, **self.engine.status())
+
+    def _handle_query(self, request: BaseHTTPRequestHandler):
+        try:
+            length = int(request.headers.get("Content-Length", "0"))
+            query = json.loads(request.rfile.read(length))
+            if not isinstance(query, dict):
+                raise QueryError("A query must be a JSON object")
+            result = self.engine.query(query)
+        except QueryError as ex:
+            self._respond(request, ex.status, dict(error=str(ex)))
+        except ValueError as ex:
+            self._respond(request, 400, dict(error=f"Invalid JSON query: {ex}"))
+        except Exception as ex:
+            logger.exception("Query failed")
+            self._respond(request, 500, dict(error=f"{ex.__class__.__name__}: {ex}"))
+        else:
+            self._respond(request, 200, dict(result=result))
+
+    def _respond(self, request: BaseHTTPRequestHandler, status: int, body: JsonableDict):
+        data = json.dumps(body).encode('utf-8')
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def reload_if_changed(self) -> bool:
+        """Rebuilds the engine if the source has changed since it was last loaded. Returns True if a new
+           engine was swapped in."""
+        signature = self.source.signature()
+        if signature == self._signature:
+            return False
+        logger.info(f"Model source {self.source} changed; reloading")
+        start = time.perf_counter()
+        try:
+            engine = QueryEngine(self.source.load(), cache_size=self.cache_size)
+        except Exception:
+            MODEL_RELOADS.inc(result="error")
+            # The signature is left as it was, so the reload is retried on the next check.
+            if signature != self._failed_signature:
+                logger.exception(f"Reloading the model from {self.source} failed; keeping the previous model")
+            self._failed_signature = signature
+            return False
+        self._signature = signature
+        self._failed_signature = None
+        self.engine = engine
+        self.reloads += 1
+        MODEL_RELOADS.inc(result="ok")
+        logger.info(f"Reloaded {engine} in {time.perf_counter() - start:.3f} s")
+        return True
+
+    def _watch(self):
+        assert self.reload_interval is not None
+        while not self._stopping.wait(self.reload_interval):
+            self.reload_if_changed()
+
+    def serve_forever(self):
+        """Serves until stop() is called from another thread, or KeyboardInterrupt."""
+        if self.reload_interval is not None and self.reload_interval > 0:
+            self._watcher = threading.Thread(target=self._watch, name="model-reload", daemon=True)
+            self._watcher.start()
+        logger.info(f"Serving model queries at {self.url}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._stopping.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._server.shutdown()
+        self._server.server_close()
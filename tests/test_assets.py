@@ -0,0 +1,59 @@
+from factorytown.internal_types import *
+from factorytown.bench.replay import WikiReplayServer, replay_wiki
+from factorytown.raw_scrape.assets import AssetStore, get_image_file_name, sync_assets
+from factorytown.raw_scrape.factorytown_wiki_scrape import FACTORYTOWN_WIKI
+from factorytown.raw_scrape.fandom_scrape import get_url_filename
+from factorytown.raw_scrape.fetch_scheduler import FetchScheduler, get_fetch_scheduler, set_fetch_scheduler
+
+IMAGE_PATH = "/wiki/images/a/ab/Cactus_Fruit.png/revision/latest"
+ORIGINAL = f"{IMAGE_PATH}?cb=1"
+THUMB = f"{IMAGE_PATH}/scale-to-width-down/40?cb=1"
+THUMB_OTHER_CB = f"{IMAGE_PATH}/scale-to-width-down/40?cb=2"
+
+def _responses() -> Dict[str, bytes]:
+    def key(path: str) -> str:
+        return get_url_filename(f"{FACTORYTOWN_WIKI}{path[len('/wiki'):]}")
+    return {
+        key("/wiki/Cactus_Fruit"): f'<img src="{ORIGINAL}"><img data-src="{THUMB.replace("?", "&#63;")}">'.encode(),
+        key("/wiki/Buildings"): f'<img src="{THUMB}"><img src="{THUMB_OTHER_CB}"><img src="data:image/gif;base64,R0">'.encode(),
+        key(ORIGINAL): b"original" * 100,
+        key(THUMB): b"thumb" * 10,
+        key(THUMB_OTHER_CB): b"thumb" * 10,
+        key("/wiki/Special:FilePath/Unlinked%20Thing.png"): b"unlinked",
+      }
+
+def test_image_file_name_of_originals_and_thumbnails():
+    assert get_image_file_name(f"https://x{ORIGINAL}") == "Cactus Fruit.png"
+    assert get_image_file_name(f"https://x{THUMB}") == "Cactus Fruit.png"
+    assert get_image_file_name("https://x/images/thumb/a/ab/Cactus_Fruit.png/40px-Cactus_Fruit.png") == "Cactus Fruit.png"
+    assert get_image_file_name("https://x/wiki/Special:FilePath/Cactus%20Fruit.png") == "Cactus Fruit.png"
+    assert get_image_file_name("https://x/wiki/Cactus_Fruit") is None
+
+def test_sync_fetches_referenced_urls_once_and_dedups_content(tmp_path):
+    previous = get_fetch_scheduler()
+    set_fetch_scheduler(FetchScheduler(rate=None))
+    try:
+        with WikiReplayServer(responses=_responses()) as server, replay_wiki(server):
+            store = AssetStore(str(tmp_path))
+            pages = ["Buildings", "Cactus_Fruit", "Buildings"]
+            result = sync_assets(["Cactus Fruit", "Unlinked Thing"], store, pages=pages)
+            assert result.failed == {}
+            assert (result.urls, result.downloaded, result.cached, result.new_blobs) == (4, 4, 0, 3)
+            assert result.usage["saved_bytes"] == len(b"thumb" * 10)
+            n_requests = server.stats.requests
+
+            result = sync_assets(["Cactus Fruit", "Unlinked Thing"], AssetStore(str(tmp_path)), pages=pages)
+            assert (result.urls, result.downloaded, result.cached) == (4, 0, 4)
+            # Only the pages are read again; they come from the scrape cache, so nothing is fetched.
+            assert server.stats.requests == n_requests
+    finally:
+        set_fetch_scheduler(previous)
+
+def test_save_merges_entries_saved_by_another_store(tmp_path):
+    a = AssetStore(str(tmp_path))
+    b = AssetStore(str(tmp_path))
+    a.put_stream("https://x/a.png", [b"a"])
+    b.put_stream("https://x/b.png", [b"b"])
+    a.save()
+    b.save()
+    assert sorted(AssetStore(str(tmp_path)).urls) == ["https://x/a.png", "https://x/b.png"]
@@ -0,0 +1,102 @@
+from factorytown.internal_types import *
+from factorytown.layout import ContactHeuristic, Footprint, GridRouter, LayoutPacker, OccupancyGrid, Placement, optimize_layout
+from factorytown.model import GridDim
+
+import random
+
+def _random_grid(rng: random.Random, width: int, height: int, density: float) -> OccupancyGrid:
+    grid = OccupancyGrid(width, height)
+    for y in range(height):
+        for x in range(width):
+            if rng.random() < density:
+                grid.fill(x, y, 1, 1)
+    return grid
+
+def _random_placement(rng: random.Random, router: GridRouter, name: str) -> Placement:
+    w, h = rng.randint(1, 3), rng.randint(1, 3)
+    return Placement(name, rng.randrange(router.width - w + 1), rng.randrange(router.height - h + 1), w, h)
+
+def test_router_repair_matches_fresh_bfs():
+    rng = random.Random(12345)
+    width, height = 20, 14
+    terrain = _random_grid(rng, width, height, 0.05)
+    router = GridRouter(width, height, terrain=terrain)
+    next_id = 0
+    for _ in range(400):
+        keys = sorted(router.placements)
+        op = rng.choice(["add", "add", "move", "rotate", "remove"]) if len(keys) > 2 else "add"
+        try:
+            if op == "add":
+                router.add_building(f"b{next_id}", _random_placement(rng, router, "b"))
+                next_id += 1
+            elif op == "move":
+                key = rng.choice(keys)
+                p = router.placements[key]
+                router.move_building(key, p.x + rng.randint(-3, 3), p.y + rng.randint(-3, 3))
+            elif op == "rotate":
+                key = rng.choice(keys)
+                p = router.placements[key]
+                router.move_building(key, p.x, p.y, rotated=not p.rotated)
+            else:
+                router.remove_building(rng.choice(keys))
+        except FactoryTownError:
+            pass  # Out of bounds or overlapping; the router is left unchanged.
+
+        # Keep fields for single and multiple destinations cached, so the next change repairs them.
+        keys = sorted(router.placements)
+        for n in (1, 1, 3):
+            if len(keys) >= n:
+                router.distance_field(rng.sample(keys, n))
+        for field_keys, field in router._fields.items():
+            assert list(field.dist) == list(router._bfs(router._seeds(field_keys))), field_keys
+
+    stats = router.stats
+    assert stats.fields_repaired > 100 and stats.fields_dropped > 0 and stats.cells_reset > 0
+
+def _brute_force_contact(grid: OccupancyGrid, w: int, h: int) -> Optional[Tuple[int, int]]:
+    best: Optional[Tuple[int, int, int]] = None
+    for y in range(grid.height):
+        for x in range(grid.width):
+            if grid.fits(x, y, w, h):
+                score = ContactHeuristic._contact(grid, x, y, w, h)
+                if best is None or score > best[0]:
+                    best = (score, x, y)
+    return None if best is None else (best[1], best[2])
+
+def test_contact_heuristic_matches_brute_force():
+    rng = random.Random(2024)
+    heuristic = ContactHeuristic()
+    for _ in range(300):
+        grid = _random_grid(rng, rng.randint(1, 16), rng.randint(1, 12), rng.choice([0.0, 0.1, 0.3, 0.6]))
+        w, h = rng.randint(1, 5), rng.randint(1, 5)
+        assert heuristic.find_position(grid, w, h) == _brute_force_contact(grid, w, h), (grid.to_ascii(), w, h)
+
+def test_contact_heuristic_packs_against_placed_buildings():
+    grid = OccupancyGrid(8, 6)
+    grid.fill(3, 2, 2, 2)
+    packer = LayoutPacker(8, 6, ContactHeuristic(), allow_rotation=False)
+    placement = packer.place_one(grid, Footprint("A", GridDim(2, 2)))
+    # A corner touches two walls (4 cells); no free spot touches more.
+    assert placement == Placement("A", 0, 0, 2, 2)
+
+def _footprints(rng: random.Random, n: int) -> List[Footprint]:
+    return [Footprint(f"F{i}", GridDim(rng.randint(1, 4), rng.randint(1, 4))) for i in range(n)]
+
+def test_optimize_layout_is_deterministic_and_independent_of_workers():
+    footprints = _footprints(random.Random(7), 14)
+    for heuristic in ("top-left", "contact"):
+        kwargs = dict(heuristic=heuristic, starts=4, iterations=30, seed=3)
+        layout = optimize_layout(footprints, 12, 10, **kwargs)
+        assert optimize_layout(footprints, 12, 10, **kwargs).to_jsonable() == layout.to_jsonable()
+        assert optimize_layout(footprints, 12, 10, max_workers=2, **kwargs).to_jsonable() == layout.to_jsonable()
+
+def test_optimize_layout_is_no_worse_than_largest_first():
+    footprints = _footprints(random.Random(11), 18)
+    baseline = LayoutPacker(12, 10).pack(footprints)
+    layout = optimize_layout(footprints, 12, 10, starts=3, iterations=50)
+    assert layout.score >= baseline.score
+    placed = sorted(p.name for p in layout.placements) + sorted(f.name for f in layout.unplaced)
+    assert sorted(placed) == sorted(f.name for f in footprints)
+    grid = OccupancyGrid(12, 10)
+    for p in layout.placements:
+        grid.fill(p.x, p.y, p.w, p.h)  # asserts the placements do not overlap
@@ -0,0 +1,119 @@
+from factorytown.internal_types import *
+from factorytown.bench.bench import FIXTURE_PAGES, extraction_skip_reason, fixture_cache, install_page, read_fixture
+from factorytown.bench.replay import (
+    ReplayConfig,
+    WikiReplayServer,
+    fixture_responses,
+    replay_wiki,
+    run_fetch_load_test,
+    run_scrape_test,
+)
+from factorytown.model import Building, diff_models
+from factorytown.model_scrape import scrape_model
+from factorytown.raw_scrape import get_page_html, open_url_stream
+from factorytown.raw_scrape.factorytown_wiki_scrape import FACTORYTOWN_WIKI, get_page_url
+from factorytown.raw_scrape.fandom_scrape import get_cache_dir, get_http_cache_dir, get_url_filename
+from factorytown.raw_scrape.fetch_scheduler import DEFAULT_CHUNK_SIZE, FetchScheduler, get_fetch_scheduler, set_fetch_scheduler
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+import pytest
+
+def test_fetches_succeed_despite_throttling_and_errors():
+    config = ReplayConfig(throttle_rate=0.2, error_rate=0.1, retry_after=0.01, seed=1)
+    scheduler = FetchScheduler(rate=None, max_attempts=10, base_delay=0.005, max_delay=0.05)
+    with WikiReplayServer(config) as server:
+        result = run_fetch_load_test(server, n_requests=50, concurrency=4, scheduler=scheduler)
+    assert result.errors == {}
+    assert result.succeeded == result.requests
+    assert result.bytes_received == 50 * len(read_fixture(f"{FIXTURE_PAGES[0]}.edit.html").encode('utf-8'))
+    assert result.fetcher["throttled"] > 0 and result.fetcher["retries"] > 0
+    assert set(result.server["statuses"]) > {"200"}
+
+def test_lookup_matches_percent_encoded_page_names(tmp_path):
+    body = b"<html>Caf\xc3\xa9</html>"
+    (tmp_path / get_url_filename(f"{FACTORYTOWN_WIKI}/Café Table?action=edit")).write_bytes(body)
+    server = WikiReplayServer(cache_dir=str(tmp_path), responses={})
+    try:
+        assert server.lookup("/wiki/Caf%C3%A9%20Table?action=edit") == body
+        assert server.lookup("/wiki/Missing?action=edit") is None
+    finally:
+        server.stop()
+
+def _edit_page_responses(pages: Sequence[str], body: bytes) -> Dict[str, bytes]:
+    return { get_url_filename(f"{FACTORYTOWN_WIKI}/{page}?action=edit"): body for page in pages }
+
+def test_scraper_fetches_through_replay_server():
+    # The wikitext extraction tool is not built for the test suite, so the Buildings wikitext is
+    # installed in the md cache, as fixture_cache does; the HTML of every page is fetched from the server.
+    pages = [f"Replay Page {i}" for i in range(40)]
+    body = read_fixture("Buildings.edit.html").encode('utf-8')
+    responses = dict(fixture_responses(), **_edit_page_responses(pages, body))
+    previous = get_fetch_scheduler()
+    set_fetch_scheduler(FetchScheduler(rate=None))
+    try:
+        with WikiReplayServer(responses=responses) as server, replay_wiki(server):
+            assert os.listdir(get_cache_dir()) == []
+            install_page(get_cache_dir(), "Buildings", read_fixture("Buildings.wiki"))
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                htmls = list(executor.map(lambda page: get_page_html(f"{page}?action=edit"), pages))
+            seconds = time.perf_counter() - start
+            assert htmls == [body.decode('utf-8')] * len(pages)
+            assert server.stats.requests == len(pages)
+            assert len(os.listdir(get_http_cache_dir())) == len(pages)
+            # A generous floor: the server answers from memory, so this only fails if fetches serialize
+            # on something slow.
+            assert len(pages) / seconds > 20
+
+            # Cached pages are not fetched again.
+            assert get_page_html(f"{pages[0]}?action=edit") == body.decode('utf-8')
+            assert server.stats.requests == len(pages)
+
+            model = scrape_model()
+    finally:
+        set_fetch_scheduler(previous)
+    with fixture_cache():
+        expected = scrape_model()
+    assert len(list(model.records.values(Building))) > 0
+    assert diff_models(expected, model).is_empty
+
+def test_url_stream_yields_chunks_while_downloading():
+    body = bytes(range(256)) * (DEFAULT_CHUNK_SIZE // 64)
+    responses = _edit_page_responses(["Big Page", "Abandoned Page"], body)
+    previous = get_fetch_scheduler()
+    set_fetch_scheduler(FetchScheduler(rate=None))
+    try:
+        with WikiReplayServer(responses=responses) as server, replay_wiki(server):
+            url = get_page_url("Big Page?action=edit")
+            cache_path = os.path.join(get_http_cache_dir(), get_url_filename(url))
+            stream = open_url_stream(url)
+            chunks = [next(stream)]
+            # The caller has the first chunk before the download is complete or cached.
+            assert not os.path.exists(cache_path)
+            chunks.extend(stream)
+            assert len(chunks) > 1 and b"".join(chunks) == body
+            with open(cache_path, 'rb') as f:
+                assert f.read() == body
+
+            # Once cached, the content is read back from the cache file.
+            assert b"".join(open_url_stream(url)) == body
+            assert server.stats.requests == 1
+
+            # An abandoned download leaves nothing in the cache.
+            stream = open_url_stream(get_page_url("Abandoned Page?action=edit"))
+            next(stream)
+            stream.close()
+            assert os.listdir(get_http_cache_dir()) == [os.path.basename(cache_path)]
+    finally:
+        set_fetch_scheduler(previous)
+
+@pytest.mark.skipif(extraction_skip_reason() is not None, reason=str(extraction_skip_reason()))
+def test_scrape_model_from_replay_server():
+    with WikiReplayServer() as server:
+        model, _ = run_scrape_test(server)
+    with fixture_cache():
+        expected = scrape_model()
+    assert diff_models(expected, model).is_empty
@@ -0,0 +1,18 @@
+import pytest
+
+from factorytown.bench.startup import DEFAULT_STARTUP_COMMANDS, measure_startup, check_startup_budget
+
+import os
+
+@pytest.mark.parametrize("command", DEFAULT_STARTUP_COMMANDS, ids=" ".join)
+def test_startup_imports_no_heavy_modules(command):
+    result = measure_startup(command, repeat=1)
+    assert result.heavy_modules == []
+
+# Import time depends on the machine and its load, so the time budget is only checked on request (or with
+# `factorytown bench-startup`).
+@pytest.mark.skipif(os.environ.get('FACTORYTOWN_TEST_STARTUP_BUDGET') is None, reason="set FACTORYTOWN_TEST_STARTUP_BUDGET=1 to check startup time")
+@pytest.mark.parametrize("command", DEFAULT_STARTUP_COMMANDS, ids=" ".join)
+def test_startup_within_budget(command):
+    result = measure_startup(command, repeat=3)
+    assert check_startup_budget(result) == []
@@ -0,0 +1,92 @@
+import pytest
+
+from factorytown.bench.bench import read_fixture
+from factorytown.mdparse import (
+    TABLE_PARSER_BACKENDS, UnsupportedTableSyntax, compare_table_parsers, get_table_parser_backend, tokenize_tables,
+)
+
+INLINE_CELLS = """\
+{| class="wikitable"
+|+ Inline cells
+! Name !! Ingredients !! Work Units
+|-
+| {{Item|Wood}} || 2 x {{Item|Log}} || 10
+|-
+| {{Item|Plank}} || {{Item|Wood}} + {{Item|Nails}} || 20
+|}
+"""
+
+ATTRIBUTES = """\
+{| class="wikitable sortable" style="width: 100%"
+! scope="col" | Name
+! scope="col" | Size
+|-
+| style="text-align: left" | {{Building|Farm}}
+| 3x3
+|- style="background: #eee"
+| {{Building|Mill}} || style="color: red" | 2x2
+|}
+"""
+
+MULTILINE_CELLS = """\
+{| class="wikitable"
+! Name
+! Description
+|-
+| {{Item|Wheat}}
+| Grows on a farm.
+Needs water.
+|-
+| Short row
+|-
+| {{Item|Flour}} ||
+  Starts on the next line.
+|}
+"""
+
+NESTED_TABLES = """\
+{| class="wikitable"
+! Outer !! Cell
+|-
+| before ||
+{| class="wikitable"
+! Inner
+|-
+| inner cell
+|}
+|-
+| after || last
+|}
+"""
+
+TWO_TABLES = INLINE_CELLS + "\nSome text between the tables, with a {{Template|arg}}.\n\n" + ATTRIBUTES
+
+PAGES = {
+    "Buildings.wiki": read_fixture("Buildings.wiki"),
+    "inline-cells": INLINE_CELLS,
+    "attributes": ATTRIBUTES,
+    "multiline-cells": MULTILINE_CELLS,
+    "nested-tables": NESTED_TABLES,
+    "two-tables": TWO_TABLES,
+}
+
+def _tables(backend_name, markdown):
+    return [(t.caption, t.data()) for t in get_table_parser_backend(backend_name).parse_tables(markdown)]
+
+@pytest.mark.parametrize("page", sorted(PAGES))
+@pytest.mark.parametrize("backend_name", sorted(set(TABLE_PARSER_BACKENDS) - {"wikitextparser"}))
+def test_backend_matches_wikitextparser(backend_name, page):
+    markdown = PAGES[page]
+    expected = _tables("wikitextparser", markdown)
+    assert len(expected) > 0
+    assert _tables(backend_name, markdown) == expected
+
+@pytest.mark.parametrize("page", sorted(set(PAGES) - {"nested-tables"}))
+def test_tokenizer_handles_page_without_fallback(page):
+    markdown = PAGES[page]
+    assert len(tokenize_tables(markdown)) > 0
+    assert compare_table_parsers(markdown) == []
+
+def test_tokenizer_declines_nested_tables():
+    with pytest.raises(UnsupportedTableSyntax):
+        tokenize_tables(NESTED_TABLES)